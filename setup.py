@@ -114,7 +114,8 @@ setup(
               'execution_management_modules', 
               'application_management_modules', 
               'ram_namd',
-              'ram_amber'],
+              'ram_amber',
+              'exchange'],
     package_dir={'repex_utils': 'src/radical/repex/repex_utils',
                  'repex': 'src/radical/repex',
                  'replicas': 'src/radical/repex/replicas',
@@ -122,7 +123,8 @@ setup(
                  'execution_management_modules': 'src/radical/repex/execution_management_modules',
                  'application_management_modules': 'src/radical/repex/application_management_modules',
                  'ram_namd': 'src/radical/repex/remote_application_modules/ram_namd',
-                 'ram_amber': 'src/radical/repex/remote_application_modules/ram_amber'},
+                 'ram_amber': 'src/radical/repex/remote_application_modules/ram_amber',
+                 'exchange': 'src/radical/repex/exchange'},
     scripts=['bin/repex-version', 
              'bin/repex-amber', 
              'bin/repex-namd',
@@ -131,7 +133,7 @@ setup(
              'bin/calc-exchange-metrics'],
     license='LICENSE.txt',
     description='Radical Pilot based Replica Exchange Simulations Package',
-    install_requires=['radical.pilot', 'mpi4py'],
+    install_requires=['radical.pilot', 'mpi4py', 'numpy'],
     download_url = 'https://github.com/AntonsT/radical.repex/tarball/0.2.10',
     url = 'https://github.com/radical-cybertools/radical.repex.git',
     data_files=makeDataFiles('share/radical.repex/examples/', 'examples')
@@ -17,6 +17,7 @@ import shutil
 import pickle
 import tarfile
 import datetime
+import numpy as np
 from os import path
 from os import listdir
 from os.path import join
@@ -24,9 +25,20 @@ import radical.pilot as rp
 from os.path import isfile
 import radical.utils.logger as rul
 from kernels.kernels import KERNELS
+import exchange.engine
+from exchange.acceptance import get_acceptance
+from exchange.replica import create_replica
+from exchange.mdinfo import prefetch_historical_data
+from exchange.mdinfo import read_remlog
+from exchange.matrix_io import write_pairs
 import ram_amber.input_file_builder
-from replicas.replica import Replica
+from ram_amber.exchange_agent import request_script
+from replicas.replica import ReplicaStore
+from replicas.registry import ReplicaRegistry
 from repex_utils.simulation_restart import Restart
+from repex_utils.checkpoint import JOURNAL_FILE
+from repex_utils.checkpoint import CheckpointJournal
+from repex_utils.checkpoint import replay_journal
 
 #-------------------------------------------------------------------------------
 #
@@ -74,6 +86,21 @@ class AmmAmber(object):
             self.restart = False
             self.restart_done = True
 
+        # restart from the last checkpoint of a given cycle and dimension
+        self.restart_cycle     = inp_file['remd.input'].get('restart_cycle')
+        self.restart_dimension = inp_file['remd.input'].get('restart_dimension')
+        if self.restart_cycle is not None:
+            self.restart_cycle = int(self.restart_cycle)
+        if self.restart_dimension is not None:
+            self.restart_dimension = int(self.restart_dimension)
+
+        # full snapshot of replicas is written every checkpoint_interval steps
+        self.checkpoint_interval = int(inp_file['remd.input'].get('checkpoint_interval', '10'))
+        if self.checkpoint_interval < 1:
+            self.logger.info("checkpoint_interval must be a positive integer, exiting...")
+            sys.exit(1)
+        self.journal = CheckpointJournal(JOURNAL_FILE, self.checkpoint_interval)
+
         if ( (self.restart == True) and (self.restart_file == '') ):
             self.logger.info("If simulation is restarted, name of the restart_file must be specified, exiting...")
             sys.exit(1)
@@ -103,6 +130,75 @@ class AmmAmber(object):
             self.exchange_mpi = False
 
         self.exchange_mpi_cores = int(inp_file['remd.input'].get('exchange_mpi_cores', 0))
+
+        # gibbs - all replicas of a group are evaluated in every state
+        # neighbor, deo - only adjacent replicas are evaluated
+        self.exchange_scheme = inp_file['remd.input'].get('exchange_scheme', 'gibbs')
+        if self.exchange_scheme not in exchange.engine.SCHEMES:
+            self.logger.info("exchange_scheme must be one of: {0}, exiting...".format(exchange.engine.SCHEMES))
+            sys.exit(1)
+
+        # if True, global exchange calculators are run by exchange agent, 
+        # which is launched once per pilot, every cycle we submit only a light
+        # CU which passes request to the agent and waits for the result
+        if inp_file['remd.input'].get('exchange_agent', 'False') == "True":
+            self.exchange_agent = True
+        else:
+            self.exchange_agent = False
+        self.exchange_agent_timeout = int(inp_file['remd.input'].get('exchange_agent_timeout', '600'))
+
+        if self.exchange_agent and (self.exchange_mpi or self.group_exec):
+            self.logger.info("exchange_agent can't be used together with exchange_mpi or group_exec, exiting...")
+            sys.exit(1)
+
+        # if True, temperature exchange is calculated by this AMM: MD units 
+        # transfer .mdinfo files back and no global calculator unit is 
+        # submitted
+        if inp_file['remd.input'].get('local_exchange', 'False') == "True":
+            self.local_exchange = True
+        else:
+            self.local_exchange = False
+
+        if self.local_exchange and (self.exchange_mpi or self.group_exec):
+            self.logger.info("local_exchange can't be used together with exchange_mpi or group_exec, exiting...")
+            sys.exit(1)
+
+        # if True, single point energies for salt concentration exchange are
+        # calculated by a single unit per group (G x G calculations in one 
+        # groupfile) instead of a unit per replica
+        if inp_file['remd.input'].get('salt_group_exchange', 'False') == "True":
+            self.salt_group_exchange = True
+        else:
+            self.salt_group_exchange = False
+
+        # number of replicas of a group, which run MD simulation in a single 
+        # MPI unit (one Amber call with groupfile), if 0 or 1 - one unit per 
+        # replica
+        self.md_bundle_size = int(inp_file['remd.input'].get('md_bundle_size', '0'))
+
+        if (self.md_bundle_size > 1) and self.group_exec:
+            self.logger.info("md_bundle_size can't be used together with group_exec, exiting...")
+            sys.exit(1)
+
+        # if True, temperature exchange is done by Amber (-rem 1): replicas 
+        # of a temperature group run in a single MPI unit and Amber performs 
+        # native_remd_exchanges exchanges during a cycle, final temperatures
+        # are read from remlog file
+        if inp_file['remd.input'].get('native_remd', 'False') == "True":
+            self.native_remd = True
+        else:
+            self.native_remd = False
+        self.native_remd_exchanges = int(inp_file['remd.input'].get('native_remd_exchanges', '1'))
+        # remlog file name -> ids of replicas in groupfile order
+        self.native_logs = {}
+
+        if self.native_remd and (self.group_exec or self.local_exchange):
+            self.logger.info("native_remd can't be used together with group_exec or local_exchange, exiting...")
+            sys.exit(1)
+        if self.native_remd and ((self.native_remd_exchanges < 1) or \
+                                 (self.cycle_steps % self.native_remd_exchanges != 0)):
+            self.logger.info("native_remd_exchanges must be a positive divisor of steps_per_cycle, exiting...")
+            sys.exit(1)
            
         #-----------------------------------------------------------------------
     
@@ -227,6 +323,9 @@ class AmmAmber(object):
             if self.amber_path_mpi == None:
                 self.logger.info("Amber (sander.MPI) path can't be found, exiting...")
             sys.exit(1)
+        if ((self.md_bundle_size > 1) or self.native_remd) and (self.replica_gpu == False) and (self.amber_path_mpi == None):
+            self.logger.info("If md_bundle_size is greater than 1 or native_remd is True, Amber (sander.MPI) path must be specified, exiting...")
+            sys.exit(1)
 
         self.shared_urls = []
         self.shared_files = []     
@@ -243,6 +342,8 @@ class AmmAmber(object):
                 self.umbrella = True
 
         self.groups_numbers = [0, 0, 0] 
+        self.store = None
+        self.registry = None
 
         if ( (self.umbrella == True) and (self.us_template == '') ):
             self.logger.info("For umbrella exchange simulations must be specified us_template parameter, exiting...")
@@ -277,11 +378,13 @@ class AmmAmber(object):
                       dim_int, 
                       dim_str, 
                       replicas):
-        """Saves the state of the simulation and state of replicas to .pkl file. 
-        Method is called after every simulation cycle and for each dimension in 
-        the current simulation. Method first updates restart object, writes 
-        state of replicas to .pkl file and then writes restart object (which 
-        represents simulation state) to .pkl file
+        """Saves the state of the simulation and state of replicas to checkpoint
+        journal. Method is called after every simulation cycle and for each 
+        dimension in the current simulation. Method first updates restart 
+        object, then appends to the journal changes of replicas since the last 
+        call together with restart object (which represents simulation state). 
+        Every checkpoint_interval calls a full snapshot of replicas is appended
+        instead.
 
         Args:
             current_cycle - current simulation cycle
@@ -300,19 +403,15 @@ class AmmAmber(object):
         self.restart_object.current_cycle =  current_cycle
         self.restart_object.old_sandbox   = self.restart_object.new_sandbox
 
-        self.restart_file = 'simulation_objects_{0}_{1}.pkl'.format( dim_int, current_cycle )
-        with open(self.restart_file, 'wb') as output:
-            for replica in replicas:
-                pickle.dump(replica, output, pickle.HIGHEST_PROTOCOL)
-
-            pickle.dump(self.restart_object, output, pickle.HIGHEST_PROTOCOL)
+        self.journal.commit(dim_int, current_cycle, self.store, self.restart_object)
 
     #---------------------------------------------------------------------------
     #
     def recover_replicas(self):
-        """Recovers the state of the failed simulation from .pkl file. Updates 
-        restart_object of this AMM. Updates groups_numbers attribute of this 
-        AMM.  
+        """Recovers the state of the failed simulation by replaying checkpoint 
+        journal up to restart_cycle and restart_dimension (by default up to the
+        last checkpoint). Updates restart_object of this AMM. Updates groups_numbers attribute of this 
+        AMM. Rebuilds replica registry of this AMM.
 
         Args:
             None
@@ -321,13 +420,17 @@ class AmmAmber(object):
             list of recovered replica objects
         """
 
-        replicas = []
-        with open(self.restart_file, 'rb') as input:
-            for i in range(self.replicas):
-                r_temp = pickle.load(input)
-                replicas.append( r_temp )
-            self.restart_object = pickle.load(input)
-            self.groups_numbers = self.restart_object.groups_numbers
+        state = replay_journal(self.restart_file, 
+                               self.restart_cycle, 
+                               self.restart_dimension)
+        if state is None:
+            self.logger.info("No checkpoint for cycle {0} in restart file {1}, exiting...".format(self.restart_cycle, self.restart_file))
+            sys.exit(1)
+
+        self.store, self.restart_object = state
+        self.groups_numbers = self.restart_object.groups_numbers
+        replicas = self.store.replicas()
+        self.registry = ReplicaRegistry(self.nr_dims, replicas)
         return replicas
 
     #---------------------------------------------------------------------------
@@ -345,6 +448,11 @@ class AmmAmber(object):
             list of replica objects
         """
         self.restart_object = Restart()
+        self.journal.reset()
+        self.registry = None
+
+        types = [self.dims['d'+str(d)]['type'] for d in range(1, self.nr_dims+1)]
+        self.store = ReplicaStore(self.replicas, self.nr_dims, types)
 
         # parse coor file
         coor_path  = self.work_dir_local + "/" + self.input_folder + "/" + self.amber_coordinates_path
@@ -393,16 +501,12 @@ class AmmAmber(object):
                         else:
                             coor_file = self.coor_basename + ".0.0.0"
 
-                        re = Replica(rid, \
+                        re = self.store.set_replica(rid, rid, \
+                                    [float(dim_params['d1'][i]), \
+                                     float(dim_params['d2'][j]), \
+                                     float(dim_params['d3'][k])], \
                                     new_restraints=r, \
-                                    coor=coor_file,
-                                    d1_param=float(dim_params['d1'][i]), \
-                                    d2_param=float(dim_params['d2'][j]), \
-                                    d3_param=float(dim_params['d3'][k]), \
-                                    d1_type = self.dims['d1']['type'], \
-                                    d2_type = self.dims['d2']['type'], \
-                                    d3_type = self.dims['d3']['type'], \
-                                    nr_dims = self.nr_dims)
+                                    coor=coor_file)
                         replicas.append(re)
 
             self.assign_group_idx(replicas, 1)
@@ -427,14 +531,11 @@ class AmmAmber(object):
                     else:
                         coor_file = self.coor_basename + ".0.0"
 
-                    re = Replica(rid, \
+                    re = self.store.set_replica(rid, rid, \
+                                [float(dim_params['d1'][i]), \
+                                 float(dim_params['d2'][j])], \
                                 new_restraints=r, \
-                                coor=coor_file,
-                                d1_param=float(dim_params['d1'][i]), \
-                                d2_param=float(dim_params['d2'][j]), \
-                                d1_type = self.dims['d1']['type'], \
-                                d2_type = self.dims['d2']['type'], \
-                                nr_dims = self.nr_dims)
+                                coor=coor_file)
                     replicas.append(re)
 
             self.assign_group_idx(replicas, 1)
@@ -452,12 +553,10 @@ class AmmAmber(object):
                 else:
                     coor_file = self.coor_basename + ".0"
 
-                re = Replica(rid, \
+                re = self.store.set_replica(rid, rid, \
+                            [float(dim_params['d1'][i])], \
                             new_restraints=r, \
-                            coor=coor_file,
-                            d1_param=float(dim_params['d1'][i]), \
-                            d1_type = self.dims['d1']['type'], \
-                            nr_dims = self.nr_dims)
+                            coor=coor_file)
                 replicas.append(re)
 
             self.assign_group_idx(replicas, 1)
@@ -469,7 +568,8 @@ class AmmAmber(object):
     def assign_group_idx(self, replicas, dim_int):
         """assigns to each replica a group index in current dimension (specified
         by dim_int) Updates groups_numbers attribute of this AMM. Updates 
-        groups_numbers attribute of the restart object.   
+        groups_numbers attribute of the restart object. Creates replica registry
+        of this AMM or updates it's group index for current dimension.
 
         Args:
             replicas - list of replica objects
@@ -480,89 +580,19 @@ class AmmAmber(object):
             None
         """
 
-        if self.nr_dims == 3:
-
-            if dim_int == 1:
-                g_d1 = []
-                for r in replicas:
-                    updated = False
-                    if len(g_d1) == 0:
-                        g_d1.append([r.dims['d2']['par'], r.dims['d3']['par']]) 
-                    for i,j in enumerate(g_d1):
-                        if (g_d1[i][0] == r.dims['d2']['par']) and (g_d1[i][1] == r.dims['d3']['par']):
-                            r.group_idx[0] = i
-                            updated = True
-                    if updated == False:
-                        g_d1.append([r.dims['d2']['par'], r.dims['d3']['par']])
-                        r.group_idx[0] = len(g_d1) - 1
-                self.groups_numbers[0] = len(g_d1)
-
-            if dim_int == 2:
-                g_d2 = []
-                for r in replicas:
-                    updated = False
-                    if len(g_d2) == 0:
-                        g_d2.append([r.dims['d1']['par'], r.dims['d3']['par']]) 
-                    for i,j in enumerate(g_d2):
-                        if (g_d2[i][0] == r.dims['d1']['par']) and (g_d2[i][1] == r.dims['d3']['par']):
-                            r.group_idx[1] = i
-                            updated = True
-                    if updated == False:
-                        g_d2.append([r.dims['d1']['par'], r.dims['d3']['par']])
-                        r.group_idx[1] = len(g_d2) - 1
-                self.groups_numbers[1] = len(g_d2)
-
-            if dim_int == 3:
-                g_d3 = []
-                for r in replicas:
-                    updated = False
-                    if len(g_d3) == 0:
-                        g_d3.append([r.dims['d1']['par'], r.dims['d2']['par']])
-                    for i,j in enumerate(g_d3):
-                        if (g_d3[i][0] == r.dims['d1']['par']) and (g_d3[i][1] == r.dims['d2']['par']):
-                            r.group_idx[2] = i
-                            updated = True
-                    if updated == False:
-                        g_d3.append([r.dims['d1']['par'], r.dims['d2']['par']])
-                        r.group_idx[2] = len(g_d3) - 1
-                self.groups_numbers[2] = len(g_d3)
+        dim = dim_int-1
 
-        if self.nr_dims == 2:
-            if dim_int == 1:
-                g_d1 = []
-                for r in replicas:
-                    updated = False
-                    if len(g_d1) == 0:
-                        g_d1.append(r.dims['d2']['par'])
-                    for i,j in enumerate(g_d1):
-                        if (g_d1[i] == r.dims['d2']['par']):
-                            r.group_idx[0] = i
-                            updated = True
-                    if updated == False:
-                        g_d1.append(r.dims['d2']['par'])
-                        r.group_idx[0] = len(g_d1) - 1
-                self.groups_numbers[0] = len(g_d1) 
-
-            if dim_int == 2:
-                g_d2 = []
-                for r in replicas:
-                    updated = False
-                    if len(g_d2) == 0:
-                        g_d2.append(r.dims['d1']['par']) 
-                            
-                    for i,j in enumerate(g_d2):
-                        if (g_d2[i] == r.dims['d1']['par']):
-                            r.group_idx[1] = i
-                            updated = True
-                    if updated == False:
-                        g_d2.append(r.dims['d1']['par'])
-                        r.group_idx[1] = len(g_d2) - 1
-                self.groups_numbers[1] = len(g_d2) 
+        groups = self.store.assign_group_idx(dim_int)
 
         if self.nr_dims == 1:
-            for r in replicas:
-                r.group_idx[0] = 0
-            self.groups_numbers = [1] 
+            self.groups_numbers = [1]
+        else:
+            self.groups_numbers[dim] = groups
+
+        if self.registry is None:
+            self.registry = ReplicaRegistry(self.nr_dims, replicas)
+        else:
+            self.registry.reindex(dim_int)
 
         self.restart_object.groups_numbers = self.groups_numbers
                
@@ -611,6 +641,10 @@ class AmmAmber(object):
         build_inp_path      = rams_path + "/input_file_builder.py"
         salt_pre_exec_path  = rams_path + "/salt_conc_pre_exec.py"
         salt_post_exec_path = rams_path + "/salt_conc_post_exec.py"
+        exchange_agent_path = rams_path + "/exchange_agent.py"
+        salt_group_pre_exec_path  = rams_path + "/salt_group_pre_exec.py"
+        salt_group_post_exec_path = rams_path + "/salt_group_post_exec.py"
+        md_bundle_path      = rams_path + "/md_bundle.py"
 
         #-----------------------------------------------------------------------
         # now adding to shared_files:
@@ -709,17 +743,49 @@ class AmmAmber(object):
             coor_url = 'file://%s' % (cf_path)
             self.shared_urls.append(coor_url)
 
+        if self.exchange_agent == True:
+            self.shared_files.append("exchange_agent.py")
+            exchange_agent_url = 'file://%s' % (exchange_agent_path)
+            self.shared_urls.append(exchange_agent_url)
+
+        if (self.md_bundle_size > 1) or self.native_remd:
+            self.shared_files.append("md_bundle.py")
+            md_bundle_url = 'file://%s' % (md_bundle_path)
+            self.shared_urls.append(md_bundle_url)
+
+        if self.salt_group_exchange == True:
+            self.shared_files.append("salt_group_pre_exec.py")
+            salt_group_pre_exec_url = 'file://%s' % (salt_group_pre_exec_path)
+            self.shared_urls.append(salt_group_pre_exec_url)
+
+            self.shared_files.append("salt_group_post_exec.py")
+            salt_group_post_exec_url = 'file://%s' % (salt_group_post_exec_path)
+            self.shared_urls.append(salt_group_post_exec_url)
+
+        #-----------------------------------------------------------------------
+        # exchange package is used by global exchange calculators, files are 
+        # staged as exchange/<name> so it is importable in CU sandbox
+        exchange_path = os.path.dirname(exchange.engine.__file__)
+        for ex_file in sorted(os.listdir(exchange_path)):
+            if ex_file.endswith('.py'):
+                self.shared_files.append('exchange/' + ex_file)
+                ex_url = 'file://%s' % (join(exchange_path, ex_file))
+                self.shared_urls.append(ex_url)
+
     #---------------------------------------------------------------------------
     #                         
-    def prepare_replica_for_md(self, 
-                               current_cycle,
-                               dim_int, 
-                               dim_str, 
-                               group, 
-                               replica, 
-                               sd_shared_list):
-
-        """Prepares RPs compute unit for a given replica to run MD simulation. 
+    def get_md_task(self, 
+                    current_cycle,
+                    dim_int, 
+                    dim_str, 
+                    group, 
+                    replica, 
+                    sd_shared_list):
+
+        """Prepares everything which is needed to run MD simulation of a given 
+        replica: data directives, data for input_file_builder.py, post 
+        processing RAM and arguments of Amber. Used to prepare both a compute 
+        unit for a single replica and a bundle of replicas.
 
         Args:
             current_cycle - integer representing number of the current 
@@ -738,7 +804,9 @@ class AmmAmber(object):
             simulation input files
 
         Returns:
-            RPs compute unit
+            dictionary with keys: stage_in, stage_out, pre (data for 
+            input_file_builder.py), post (tuple with name of RAM and it's data 
+            or None) and arguments (string with arguments of Amber)
         """
 
         stage_out = []
@@ -749,11 +817,11 @@ class AmmAmber(object):
         outputname = "%s_%d_%d.mdout" % (basename, replica.id, replica.cycle)
         old_name = "%s_%d_%d" % (basename, replica.id, (replica.cycle-1))
 
-        replica.new_coor = "%s_%d_%d.rst" % (basename, replica.id, replica.cycle)
-        replica.new_traj = "%s_%d_%d.mdcrd" % (basename, replica.id, replica.cycle)
-        replica.new_info = "%s_%d_%d.mdinfo" % (basename, replica.id, replica.cycle)
+        new_coor = replica.name(basename) + ".rst"
+        new_traj = replica.name(basename) + ".mdcrd"
+        new_info = replica.name(basename) + ".mdinfo"
 
-        replica.old_coor = old_name + ".rst"
+        old_coor = old_name + ".rst"
 
         if (replica.cycle == 0):
             first_step = 0
@@ -767,15 +835,12 @@ class AmmAmber(object):
         input_file = "%s_%d_%d.mdin" % (self.inp_basename, replica.id, (replica.cycle-1))
         output_file = "%s_%d_%d.mdout" % (self.inp_basename, replica.id, (replica.cycle-1))
 
-        new_coor = replica.new_coor
-        new_traj = replica.new_traj
-        new_info = replica.new_info
-        old_coor = replica.old_coor
         rid      = replica.id
 
         replica_path = "replica_%d/" % (rid)
 
-        if (self.down_mdinfo == True):
+        if (self.down_mdinfo == True) or \
+           (self.is_local_exchange(dim_str) and not self.is_native_exchange(dim_str)):
             info_local = {
                 'source':   new_info,
                 'target':   new_info,
@@ -875,9 +940,8 @@ class AmmAmber(object):
                 "init_temp": str(self.init_temp)
                 }
 
-        dump_data = json.dumps(data)
-        json_pre_data_bash = dump_data.replace("\\", "")
-        json_pre_data_sh   = dump_data.replace("\"", "\\\\\"")
+        pre_data = data
+        post = None
 
         if self.dims[dim_str]['type'] == 'temperature':
 
@@ -904,9 +968,8 @@ class AmmAmber(object):
                 "rstr_vals" : rstr_vals
                 }
 
-            dump_data = json.dumps(data)
-            json_post_data_bash = dump_data.replace("\\", "")
-            json_post_data_sh   = dump_data.replace("\"", "\\\\\"")
+            if self.exchange_mpi == False and self.is_local_exchange(dim_str) == False:
+                post = ("matrix_calculator_temp_ex.py", data)
 
         #-----------------------------------------------------------------------
         self.logger.info( "current group: " )
@@ -926,7 +989,7 @@ class AmmAmber(object):
                 rstr_vals.append('_')
 
             current_group_rst = {}
-            for repl in group:
+            for repl in self.get_exchange_neighbors(dim_str, group, replica):
                 current_group_rst[str(repl.id)] = str(repl.new_restraints)
                 
             base_restraint = self.us_template + "."
@@ -949,88 +1012,18 @@ class AmmAmber(object):
                 "current_group_rst" : current_group_rst,
                 "rstr_vals" : rstr_vals
             }
-            dump_data = json.dumps(data)
-            json_post_data_bash = dump_data.replace("\\", "")
-            json_post_data_sh   = dump_data.replace("\"", "\\\\\"")
+            post = ("matrix_calculator_us_ex.py", data)
         
-        if self.dims[dim_str]['type'] == 'salt':
-            # 
-            current_group_tsu = {}
-            for repl in group:
-                # if no temperature exchange
-                if self.temperature_str == '':
-                    temp_str = str(self.init_temp)
-                else:
-                    temp_str = str(repl.dims[self.temperature_str]['par'])
-                current_group_tsu[str(repl.id)] = \
-                    [temp_str, \
-                     str(repl.dims[dim_str]['par']), \
-                     str(repl.new_restraints)]
-
-            data = {
-                "rid": str(replica.id),
-                "replica_cycle" : str(replica.cycle-1),
-                "replicas" : str(self.replicas),
-                "base_name" : str(basename),
-                "init_temp" : str(replica.dims[dim_str]['par']),
-                "amber_path" : str(self.amber_path),
-                "amber_input" : str(self.amber_input),
-                "amber_parameters": "../staging_area/"+str(self.amber_parameters),
-                "current_group_tsu" : current_group_tsu, 
-                "r_old_path": str(replica.old_path),
-            }
-
-            dump_data = json.dumps(data)
-            json_data_salt_bash = dump_data.replace("\\", "")
-            json_data_salt_sh   = dump_data.replace("\"", "\\\\\"")
-
         #-----------------------------------------------------------------------
         
-        if (self.replica_gpu == True):
-            amber_str = self.amber_path_gpu
-        elif (self.replica_mpi == True):
-            amber_str = self.amber_path_mpi
-        else:
-            amber_str = self.amber_path
-        
-        if self.dims[dim_str]['type'] == 'temperature' and self.exchange_mpi == False:
+        if self.dims[dim_str]['type'] == 'temperature' and self.exchange_mpi == False \
+        and self.is_local_exchange(dim_str) == False:
             # matrix_calculator_temp_ex.py
             stage_in.append(sd_shared_list[2])
         if self.dims[dim_str]['type'] == 'umbrella' and self.exchange_mpi == False: 
             # matrix_calculator_us_ex.py
             stage_in.append(sd_shared_list[3])
         
-        cu = rp.ComputeUnitDescription()
-        cu.cores = self.replica_cores    
-        cu.mpi = self.replica_mpi
-        
-        if KERNELS[self.resource]["shell"] == "bash":
-            cu.executable = '/bin/bash'
-            pre_exec_str  = "python input_file_builder.py " + "\'" + \
-                           json_pre_data_bash + "\'"
-            if self.dims[dim_str]['type'] == 'temperature':
-                if self.exchange_mpi == False:
-                    post_exec_str = "python matrix_calculator_temp_ex.py " + "\'" + \
-                                json_post_data_bash + "\'"
-                else:
-                    post_exec_str = " "
-            if self.dims[dim_str]['type'] == 'umbrella':
-                post_exec_str = "python matrix_calculator_us_ex.py " + "\'" + \
-                                json_post_data_bash + "\'"
-        elif KERNELS[self.resource]["shell"] == "bourne":
-            cu.executable = '/bin/sh'
-            pre_exec_str = "python input_file_builder.py " + "\'" + \
-                           json_pre_data_sh + "\'"
-            if self.dims[dim_str]['type'] == 'temperature':
-                if self.exchange_mpi == False:
-                    post_exec_str = "python matrix_calculator_temp_ex.py " + "\'" + \
-                                json_post_data_sh + "\'"
-                else:
-                    post_exec_str = " "
-            if self.dims[dim_str]['type'] == 'umbrella':
-                post_exec_str = "python matrix_calculator_us_ex.py " + "\'" + \
-                                json_post_data_sh + "\'"
-
         if replica.cycle == 1 or self.restart_done == False:
 
             if replica.cycle == 1:
@@ -1094,31 +1087,6 @@ class AmmAmber(object):
             # input_file_builder.py
             stage_in.append(sd_shared_list[4])
 
-            #-------------------------------------------------------------------
-            if (self.replica_mpi == False) and (self.replica_gpu == False):
-                cu.pre_exec = self.pre_exec
-                if self.dims[dim_str]['type'] != 'salt':
-                    cu.arguments = ["-c", pre_exec_str + \
-                                    "; wait; " + \
-                                    amber_str + \
-                                    argument_str + \
-                                    "; wait; " + \
-                                    post_exec_str]
-                else:
-                    cu.arguments = ["-c", pre_exec_str + \
-                                    "; wait; " + \
-                                    amber_str + \
-                                    argument_str]
-            else:
-                cu.executable = amber_str + argument_str
-                if self.dims[dim_str]['type'] != 'salt':
-                    cu.pre_exec = self.pre_exec + [pre_exec_str]
-                    cu.post_exec = [post_exec_str]
-                else:
-                    cu.pre_exec = self.pre_exec + [pre_exec_str]
-            cu.input_staging = stage_in
-            cu.output_staging = stage_out
-
         else:
             argument_str = " -O " + " -i " + new_input_file + \
                            " -o " + output_file + \
@@ -1158,33 +1126,237 @@ class AmmAmber(object):
                 'action': rp.COPY
             }
             stage_out.append(new_coor_out)
-               
-            if (self.replica_mpi == False) and (self.replica_gpu == False):
-                cu.pre_exec = self.pre_exec
-                if self.dims[dim_str]['type'] != 'salt':
-                    cu.arguments = ["-c", pre_exec_str + \
-                                    "; wait; " + \
-                                    amber_str + \
-                                    argument_str + \
-                                    "; wait; " + \
-                                    post_exec_str]
-                else:
-                    cu.arguments = ["-c", pre_exec_str + \
-                                    "; wait; " + \
-                                    amber_str + \
-                                    argument_str]
+
+        # exchange package used by RAMs
+        stage_in += self.get_exchange_stage_in(sd_shared_list)
+
+        return {'stage_in': stage_in,
+                'stage_out': stage_out,
+                'pre': pre_data,
+                'post': post,
+                'arguments': argument_str}
+
+    #---------------------------------------------------------------------------
+    #
+    def shell_json(self, data):
+        """Returns JSON string of given data, which can be passed as a single 
+        quoted argument in shell of target resource.
+        """
+
+        dump_data = json.dumps(data)
+        if KERNELS[self.resource]["shell"] == "bourne":
+            return dump_data.replace("\"", "\\\\\"")
+        return dump_data.replace("\\", "")
+
+    #---------------------------------------------------------------------------
+    #                         
+    def prepare_replica_for_md(self, 
+                               current_cycle,
+                               dim_int, 
+                               dim_str, 
+                               group, 
+                               replica, 
+                               sd_shared_list):
+
+        """Prepares RPs compute unit for a given replica to run MD simulation. 
+
+        Args:
+            current_cycle - integer representing number of the current 
+            simulation cycle
+
+            dim_int - integer representing the index of the current dimension
+
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects which are in the same group with 
+            a given replica in current dimension
+
+            replica - replica object for which we are preparing RPs compute unit
+
+            sd_shared_list - list of RPs data directives corresponding to 
+            simulation input files
+
+        Returns:
+            RPs compute unit
+        """
+
+        task = self.get_md_task(current_cycle, dim_int, dim_str, group, replica, sd_shared_list)
+
+        if (self.replica_gpu == True):
+            amber_str = self.amber_path_gpu
+        elif (self.replica_mpi == True):
+            amber_str = self.amber_path_mpi
+        else:
+            amber_str = self.amber_path
+
+        pre_exec_str = "python input_file_builder.py " + "\'" + \
+                       self.shell_json(task['pre']) + "\'"
+        if task['post'] is not None:
+            post_exec_str = "python " + task['post'][0] + " \'" + \
+                            self.shell_json(task['post'][1]) + "\'"
+        else:
+            post_exec_str = " "
+
+        cu = rp.ComputeUnitDescription()
+        cu.cores = self.replica_cores    
+        cu.mpi = self.replica_mpi
+
+        if KERNELS[self.resource]["shell"] == "bourne":
+            cu.executable = '/bin/sh'
+        else:
+            cu.executable = '/bin/bash'
+
+        if (self.replica_mpi == False) and (self.replica_gpu == False):
+            cu.pre_exec = self.pre_exec
+            if self.dims[dim_str]['type'] != 'salt':
+                cu.arguments = ["-c", pre_exec_str + \
+                                "; wait; " + \
+                                amber_str + \
+                                task['arguments'] + \
+                                "; wait; " + \
+                                post_exec_str]
             else:
-                cu.executable = amber_str + argument_str
-                if self.dims[dim_str]['type'] != 'salt':
-                    cu.pre_exec = self.pre_exec + [pre_exec_str]
-                    cu.post_exec = [post_exec_str]
-                else:
-                    cu.pre_exec = self.pre_exec + [pre_exec_str]
-            cu.input_staging = stage_in
-            cu.output_staging = stage_out
+                cu.arguments = ["-c", pre_exec_str + \
+                                "; wait; " + \
+                                amber_str + \
+                                task['arguments']]
+        else:
+            cu.executable = amber_str + task['arguments']
+            cu.pre_exec = self.pre_exec + [pre_exec_str]
+            if self.dims[dim_str]['type'] != 'salt':
+                cu.post_exec = [post_exec_str]
+
+        cu.input_staging = task['stage_in']
+        cu.output_staging = task['stage_out']
                 
         return cu
 
+    #---------------------------------------------------------------------------
+    #                         
+    def prepare_bundle_for_md(self, 
+                              current_cycle,
+                              dim_int, 
+                              dim_str, 
+                              group, 
+                              bundle, 
+                              sd_shared_list):
+
+        """Prepares a single RPs compute unit for a bundle of replicas to run 
+        MD simulation. Replicas run in one MPI call of Amber with a groupfile
+        (-ng option), input files are built and post processing is done for 
+        all replicas by md_bundle.py RAM in a single Python process. Can be 
+        used for all types of exchange. If native_remd is used in current 
+        dimension, Amber performs temperature exchanges between replicas of 
+        a bundle (-rem 1) and remlog file is transferred back.
+
+        Args:
+            current_cycle - integer representing number of the current 
+            simulation cycle
+
+            dim_int - integer representing the index of the current dimension
+
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects which are in the same group with 
+            replicas of a bundle in current dimension
+
+            bundle - list of replica objects of the same group, which run in
+            this compute unit
+
+            sd_shared_list - list of RPs data directives corresponding to 
+            simulation input files
+
+        Returns:
+            RPs compute unit
+        """
+
+        if len(bundle) == 1:
+            return self.prepare_replica_for_md(current_cycle, dim_int, dim_str, group, bundle[0], sd_shared_list)
+
+        native = self.is_native_exchange(dim_str)
+
+        stage_in = []
+        stage_out = []
+        tasks = []
+        for replica in bundle:
+            task = self.get_md_task(current_cycle, dim_int, dim_str, group, replica, sd_shared_list)
+            if native:
+                # nstlim is number of steps between exchanges
+                task['pre']['cycle_steps'] = str(self.cycle_steps / self.native_remd_exchanges)
+                task['pre']['numexchg'] = str(self.native_remd_exchanges)
+            # shared files are staged in only once
+            for sd in task['stage_in']:
+                if sd not in stage_in:
+                    stage_in.append(sd)
+            stage_out += task['stage_out']
+            tasks.append({'pre': task['pre'],
+                          'post': task['post'],
+                          'arguments': task['arguments']})
+
+        # md_bundle.py
+        stage_in.append(sd_shared_list[self.shared_files.index("md_bundle.py")])
+
+        if (self.replica_gpu == True):
+            amber_str = self.amber_path_gpu
+        else:
+            amber_str = self.amber_path_mpi
+
+        pre_exec_str = "python md_bundle.py pre " + "\'" + \
+                       self.shell_json({'tasks': tasks}) + "\'"
+
+        cu = rp.ComputeUnitDescription()
+        cu.executable = amber_str + " -ng " + str(len(bundle)) + " -groupfile groupfile"
+        cu.pre_exec = self.pre_exec + [pre_exec_str]
+        if len([t for t in tasks if t['post'] is not None]) > 0:
+            cu.post_exec = ["python md_bundle.py post"]
+
+        if native:
+            remlog = "rem_%d_%d.log" % (bundle[0].id, bundle[0].cycle-1)
+            cu.executable += " -rem 1 -remlog " + remlog
+            remlog_local = {
+                'source':   remlog,
+                'target':   remlog,
+                'action':   rp.TRANSFER
+            }
+            stage_out.append(remlog_local)
+            self.native_logs[remlog] = [r.id for r in bundle]
+        cu.input_staging = stage_in
+        cu.output_staging = stage_out
+        cu.cores = len(bundle) * self.replica_cores
+        cu.mpi = True
+
+        return cu
+
+    #---------------------------------------------------------------------------
+    #
+    def use_md_bundles(self, dim_str):
+        """Returns True if MD units of a given dimension are prepared for 
+        bundles of replicas by prepare_bundle_for_md().
+        """
+
+        return (self.md_bundle_size > 1) or self.is_native_exchange(dim_str)
+
+    #---------------------------------------------------------------------------
+    #
+    def get_md_bundles(self, dim_str, group):
+        """Splits replicas of a given group into bundles of md_bundle_size
+        replicas. If bundling is not used, every replica is a bundle. If 
+        native_remd is used in a given dimension, the whole group is a bundle.
+
+        Args:
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects
+
+        Returns:
+            list of lists of replica objects
+        """
+
+        if self.is_native_exchange(dim_str):
+            return [group]
+        size = max(self.md_bundle_size, 1)
+        return [group[i:i+size] for i in range(0, len(group), size)]
+
     #---------------------------------------------------------------------------
     #                     
     def prepare_group_for_md(self, 
@@ -1271,7 +1443,9 @@ class AmmAmber(object):
             "substr": str(substr),
             "replicas" : str(self.replicas),
             "amber_prm": str(self.amber_parameters[len_substr:]),
-            "group_id": str(group_id)
+            "group_id": str(group_id),
+            "scheme": str(self.exchange_scheme),
+            "order": self.get_exchange_order(dim_str, group)
             }
 
         for replica in group:
@@ -1282,24 +1456,11 @@ class AmmAmber(object):
                                               replica.id, \
                                               (replica.cycle))
 
-            replica.new_coor = "%s_%d_%d.rst" % (basename, \
-                                                 replica.id, \
-                                                 replica.cycle)
-            replica.new_traj = "%s_%d_%d.mdcrd" % (basename, \
-                                                   replica.id, \
-                                                   replica.cycle)
-            replica.new_info = "%s_%d_%d.mdinfo" % (basename, \
-                                                    replica.id, \
-                                                    replica.cycle)
-
-            new_coor = replica.new_coor
-            new_traj = replica.new_traj
-            new_info = replica.new_info
-
-            replica.old_coor = "%s_%d_%d.rst" % (basename, \
-                                                 replica.id, \
-                                                 (replica.cycle-1))
-            old_coor = replica.old_coor
+            new_coor = replica.name(basename) + ".rst"
+            new_traj = replica.name(basename) + ".mdcrd"
+            new_info = replica.name(basename) + ".mdinfo"
+
+            old_coor = replica.name(basename, replica.cycle-1) + ".rst"
            
             if (replica.cycle == 0):
                 first_step = 0
@@ -1453,6 +1614,9 @@ class AmmAmber(object):
             elif KERNELS[self.resource]["shell"] == "bourne":
                 cu.executable = exec_str + "\'" + json_data_sh + "\'"
 
+        # exchange package used by RAMs
+        stage_in += self.get_exchange_stage_in(sd_shared_list)
+
         cu.pre_exec = self.pre_exec
         cu.input_staging = stage_in
         cu.output_staging = stage_out
@@ -1498,17 +1662,15 @@ class AmmAmber(object):
         """
 
         basename = self.inp_basename
-        matrix_col = "matrix_column_%s_%s.dat" % (str(replica.id), \
-                                                  str(replica.cycle-1))
 
-        current_group = []
-        for repl in group:
-            current_group.append( repl.id )
+        # single point energies are calculated only at salt concentrations of
+        # replicas with which this replica may exchange
+        neighbors = self.get_exchange_neighbors(dim_str, group, replica)
         
         cu = rp.ComputeUnitDescription()
         
         current_group_tsu = {}
-        for repl in group:
+        for repl in neighbors:
             # no temperature exchange
             if self.temperature_str == '':
                 temp_str = str(self.init_temp)
@@ -1575,15 +1737,15 @@ class AmmAmber(object):
                 }
                 in_list.append(rstr_in)
   
+        # salt_conc_post_exec.py writes swap matrix column directly to
+        # swap_matrix_c.dat file in staging area
         out_list = []
-        matrix_col_out = {
-            'source': matrix_col,
-            'target': 'staging:///%s' % (matrix_col),
-            'action': rp.COPY
-        }
-        out_list.append(matrix_col_out)
 
-        gr_size = self.dims[dim_str]['replicas']
+        # one Amber call per line of groupfile
+        gr_size = len(current_group_tsu)
+
+        # exchange package used by RAMs
+        in_list += self.get_exchange_stage_in(sd_shared_list)
 
         cu.input_staging = in_list
         cu.arguments = ['-ng', str(gr_size), '-groupfile', 'groupfile']
@@ -1593,6 +1755,123 @@ class AmmAmber(object):
 
         return cu
 
+    #---------------------------------------------------------------------------
+    #
+    def prepare_group_for_exchange(self, 
+                                   current_cycle,
+                                   dim_int, 
+                                   dim_str, 
+                                   group, 
+                                   sd_shared_list,
+                                   max_cores=None):
+    
+        """Prepares RPs compute units for a given group of replicas to perform 
+        exchange calculations on remote HPC cluster. Single point energies of
+        coordinates of replicas at salt concentration of every replica of a 
+        group are calculated by a single Amber call with a groupfile per unit.
+        Replicas (rows of G x G calculations) are split between units, so 
+        that a unit uses at most max_cores cores (but at least G cores, one 
+        row). Columns of swap matrix of replicas of a unit are written by 
+        salt_group_post_exec.py.
+
+        Note: this function should be called for salt concentration exchange 
+        only! 
+
+        Args:
+            current_cycle - integer representing number of the current 
+            simulation cycle
+
+            dim_int - integer representing the index of the current dimension
+
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects which are in the same group in 
+            current dimension
+
+            sd_shared_list - list of RPs data directives corresponding to 
+            simulation input files
+
+            max_cores - maximum number of cores of a unit, if None all G x G
+            calculations are done by a single unit
+
+        Returns:
+            list of RPs compute units
+        """
+
+        basename = self.inp_basename
+
+        current_group_tsu = {}
+        for repl in group:
+            # no temperature exchange
+            if self.temperature_str == '':
+                temp_str = str(self.init_temp)
+            else:
+                temp_str = str(repl.dims[self.temperature_str]['par'])
+            current_group_tsu[str(repl.id)] = \
+                [temp_str, \
+                str(repl.dims[dim_str]['par']), \
+                str(repl.new_restraints)]
+
+        in_list = []
+        in_list.append(sd_shared_list[0])
+        in_list.append(sd_shared_list[1])
+        in_list.append(sd_shared_list[self.shared_files.index("salt_group_pre_exec.py")])
+        in_list.append(sd_shared_list[self.shared_files.index("salt_group_post_exec.py")])
+
+        if (self.umbrella == True) and (self.us_template != ''):
+            # copying .RST files from staging area to group folder
+            for k in current_group_tsu.keys():
+                rst_file = self.us_template + '.' + str(self.get_rstr_id(current_group_tsu[k][2]))
+                rstr_in = {
+                    'source': 'staging:///%s' % (rst_file),
+                    'target': rst_file,
+                    'action': rp.COPY
+                }
+                in_list.append(rstr_in)
+
+        # exchange package used by RAMs
+        in_list += self.get_exchange_stage_in(sd_shared_list)
+
+        size = len(group)
+        if max_cores is None:
+            rows_per_unit = size
+        else:
+            rows_per_unit = min(max(int(max_cores) / size, 1), size)
+
+        units = []
+        ids = [str(r.id) for r in group]
+        for start in range(0, size, rows_per_unit):
+            rows = ids[start:start+rows_per_unit]
+            data = {
+                "replica_cycle" : str(group[0].cycle-1),
+                "replicas" : str(self.replicas),
+                "base_name" : str(basename),
+                "amber_input" : str(self.amber_input),
+                "amber_parameters": str(self.amber_parameters), 
+                "current_group_tsu" : current_group_tsu,
+                "rows" : rows
+            }
+
+            dump_data = json.dumps(data)
+            json_data = dump_data.replace("\\", "")
+
+            nr_calcs = len(rows) * size
+
+            cu = rp.ComputeUnitDescription()
+            cu.pre_exec = self.pre_exec + ["python salt_group_pre_exec.py " + \
+                                           "\'" + json_data + "\'"]
+            cu.executable = self.amber_path_mpi
+            cu.post_exec = ["python salt_group_post_exec.py " + \
+                            "\'" + json_data + "\'"]
+            cu.input_staging = list(in_list)
+            cu.arguments = ['-ng', str(nr_calcs), '-groupfile', 'groupfile']
+            cu.cores = nr_calcs
+            cu.mpi = True
+            cu.output_staging = []
+            units.append(cu)
+
+        return units
+
     #---------------------------------------------------------------------------
     #
     def prepare_global_ex_calc(self, 
@@ -1655,13 +1934,22 @@ class AmmAmber(object):
 
         group_ids = self.get_all_groups_ids(dim_int, replicas)
 
+        # swap matrix files of cycles before stale_cycle can't be written or
+        # read by any replica anymore
+        if self.registry is not None:
+            stale_cycle = min([r.cycle for r in self.registry.by_id.values()]) - 2
+        else:
+            stale_cycle = 0
+
         data = {"replicas" : str(self.replicas),
                 "current_cycle" : str(current_cycle),
                 "cycle" : str(cycle),
+                "stale_cycle" : str(stale_cycle),
                 "dimension" : str(dim_int),
                 "group_nr" : str(group_nr),
                 "group_ids" : group_ids,
-                "dim_string": dims_string
+                "dim_string": dims_string,
+                "exchange_scheme": str(self.exchange_scheme)
         }
         dump_data = json.dumps(data)
         json_data_single = dump_data.replace("\\", "")
@@ -1680,10 +1968,22 @@ class AmmAmber(object):
                 # global_ex_calculator.py file
                 stage_in.append(sd_shared_list[5])
 
+        stage_in += self.get_exchange_stage_in(sd_shared_list)
+
         outfile = "pairs_for_exchange_{dim}_{cycle}.dat".format(dim=dim_int, \
                                                                 cycle=current_cycle)
         stage_out.append(outfile)
 
+        if self.exchange_agent == True:
+            if self.dims[dim_str]['type'] == 'temperature':
+                ram = "global_ex_calculator_temp_ex.py"
+            elif self.dims[dim_str]['type'] == 'umbrella':
+                ram = "global_ex_calculator_us_ex.py"
+            else:
+                ram = "global_ex_calculator.py"
+            request_name = "pairs_{dim}_{cycle}".format(dim=dim_int, cycle=current_cycle)
+            return self.prepare_exchange_request(request_name, ram, [json_data_single], stage_out)
+
         cu = rp.ComputeUnitDescription()
 
         if (self.exchange_mpi == True): 
@@ -1697,7 +1997,8 @@ class AmmAmber(object):
                 cu.arguments = ["global_ex_calculator_tex_mpi.py", \
                                  str(cycle), \
                                  str(self.replicas), \
-                                 str(self.inp_basename)]
+                                 str(self.inp_basename), \
+                                 str(self.exchange_scheme)]
 
                 if self.cores < self.replicas:
                     if self.exchange_mpi_cores != 0:
@@ -1732,7 +2033,9 @@ class AmmAmber(object):
                     "replicas" : str(self.replicas),
                     "base_name" : str(self.inp_basename),
                     "all_temperatures" : all_temperatures,
-                    "all_restraints" : all_restraints
+                    "all_restraints" : all_restraints,
+                    "exchange_scheme" : str(self.exchange_scheme),
+                    "order" : self.get_exchange_order(dim_str, replicas)
                 }
                 dump_data = json.dumps(data)
                 json_data_us = dump_data.replace("\\", "")
@@ -1798,12 +2101,320 @@ class AmmAmber(object):
 
         return cu
 
+    #---------------------------------------------------------------------------
+    #
+    def prepare_exchange_agent(self, sd_shared_list):
+        """Prepares RPs compute unit for exchange agent (exchange_agent.py 
+        RAM). This unit is submitted once and runs global exchange 
+        calculators on behalf of units prepared by prepare_exchange_request().
+
+        Args:
+            sd_shared_list - list of RPs data directives corresponding to 
+            simulation input files
+
+        Returns:
+            RPs compute unit
+        """
+
+        stage_in = []
+        for name in ["exchange_agent.py",
+                     "global_ex_calculator.py",
+                     "global_ex_calculator_temp_ex.py",
+                     "global_ex_calculator_us_ex.py"]:
+            stage_in.append(sd_shared_list[self.shared_files.index(name)])
+        stage_in += self.get_exchange_stage_in(sd_shared_list)
+
+        data = {"requests_dir" : "exchange_requests"}
+        dump_data = json.dumps(data)
+        json_data = dump_data.replace("\\", "")
+
+        cu = rp.ComputeUnitDescription()
+        cu.name = "exchange_agent"
+        cu.pre_exec = self.pre_exec
+        cu.executable = "python"
+        cu.input_staging = stage_in
+        cu.arguments = ["exchange_agent.py", json_data]
+        cu.cores = 1
+        cu.mpi = False
+
+        return cu
+
+    #---------------------------------------------------------------------------
+    #
+    def prepare_exchange_request(self, request_name, ram, arguments, stage_out):
+        """Prepares RPs compute unit which passes a request to run a given
+        global exchange calculator to exchange agent and waits until agent 
+        has finished. Unit runs only a shell, so there are no module loads
+        and no Python startup on the critical path of the cycle.
+
+        Args:
+            request_name - name of request, unique for each cycle and 
+            dimension
+
+            ram - name of global exchange calculator RAM
+
+            arguments - list of arguments of RAM
+
+            stage_out - list of files to be staged out
+
+        Returns:
+            RPs compute unit
+        """
+
+        request = json.dumps({"ram" : ram, "args" : arguments})
+        req = "../staging_area/exchange_requests/" + request_name
+
+        # unit fails, if agent does not answer in exchange_agent_timeout
+        script = request_script(req, request, self.exchange_agent_timeout)
+
+        cu = rp.ComputeUnitDescription()
+        cu.executable = "/bin/sh"
+        cu.arguments = ["-c", script]
+        cu.cores = 1
+        cu.mpi = False
+        cu.output_staging = stage_out
+
+        return cu
+
+    #---------------------------------------------------------------------------
+    #
+    def is_local_exchange(self, dim_str):
+        """Returns True if exchange in a given dimension is calculated by this
+        AMM instead of global exchange calculator unit.
+        """
+
+        return ((self.local_exchange == True) or (self.native_remd == True)) and \
+               (self.dims[dim_str]['type'] == 'temperature')
+
+    #---------------------------------------------------------------------------
+    #
+    def is_native_exchange(self, dim_str):
+        """Returns True if exchange in a given dimension is done by Amber 
+        during MD simulation (-rem 1).
+        """
+
+        return (self.native_remd == True) and \
+               (self.dims[dim_str]['type'] == 'temperature')
+
+    #---------------------------------------------------------------------------
+    #
+    def calc_local_exchange(self, current_cycle, dim_int, dim_str, replicas):
+        """Calculates temperature exchange on the client side, instead of
+        global_ex_calculator_temp_ex.py RAM. Potential energies are read from
+        .mdinfo files transferred by MD units, swap matrix is calculated for
+        each group of replicas and pairs are written to 
+        pairs_for_exchange_d_c.dat file, which is then read by do_exchange().
+
+        Args:
+            current_cycle - integer representing number of the current 
+            simulation cycle
+
+            dim_int - integer representing the index of the current dimension
+
+            dim_str - string representing the index of the current dimension
+
+            replicas - list of replica objects which finished MD in this 
+            dimension
+
+        Returns:
+            None
+        """
+
+        if self.is_native_exchange(dim_str):
+            return self.calc_native_exchange(current_cycle, dim_int, dim_str, replicas)
+
+        dim_types = ['']
+        for d in range(self.nr_dims):
+            dim_types.append(self.dims['d' + str(d+1)]['type'])
+
+        ready = set([r.id for r in replicas])
+        names = [r.name(self.inp_basename, r.cycle-1) + ".mdinfo" for r in replicas]
+        md_data = prefetch_historical_data(names)
+
+        temperatures = np.zeros(self.replicas)
+        energies     = np.zeros(self.replicas)
+        for r, data in zip(replicas, md_data):
+            if data is None:
+                self.logger.info("No .mdinfo file for replica {0}, excluding it from exchange".format(r.id))
+                ready.discard(r.id)
+                continue
+            temperatures[r.id] = r.dims[dim_str]['par']
+            energies[r.id]     = data['eptot']
+
+        acceptance = get_acceptance('temperature')
+        swap_matrix = np.zeros((self.replicas, self.replicas))
+        exchange_list = []
+        for group in self.registry.all_groups(dim_int, ready):
+            if len(group) < 2:
+                continue
+            idx = np.array([r.id for r in group], dtype=int)
+            swap_matrix[np.ix_(idx, idx)] = acceptance.swap_matrix(temperatures[idx], energies[idx])
+
+            ex_group = []
+            for r in group:
+                params = [0.0] + [r.dims['d' + str(d+1)]['par'] for d in range(self.nr_dims)]
+                ex_group.append(create_replica(r.id, dim_types, params, r.new_restraints))
+            exchange_list += exchange.engine.exchange_group(ex_group, 
+                                                            swap_matrix, 
+                                                            self.exchange_scheme, 
+                                                            dim_int, 
+                                                            current_cycle)
+
+        outfile = "pairs_for_exchange_{dim}_{cycle}.dat".format(dim=dim_int, \
+                                                                cycle=current_cycle)
+        write_pairs(outfile, exchange_list)
+
+    #---------------------------------------------------------------------------
+    #
+    def calc_native_exchange(self, current_cycle, dim_int, dim_str, replicas):
+        """Applies temperature exchanges done by Amber (-rem 1). Final 
+        temperatures of replicas are read from remlog files transferred by 
+        MD units and are converted to pairs, exchanging parameters of which 
+        one after another gives the same temperatures. Pairs are written to
+        pairs_for_exchange_d_c.dat file, which is then read by do_exchange(),
+        so group indexes, checkpoints and restart work as for other exchanges.
+
+        Args:
+            current_cycle - integer representing number of the current 
+            simulation cycle
+
+            dim_int - integer representing the index of the current dimension
+
+            dim_str - string representing the index of the current dimension
+
+            replicas - list of replica objects which finished MD in this 
+            dimension
+
+        Returns:
+            None
+        """
+
+        ready = set([r.id for r in replicas])
+        exchange_list = []
+        for remlog in sorted(self.native_logs.keys()):
+            ids = self.native_logs[remlog]
+            if len(ready.intersection(ids)) == 0:
+                continue
+            # every remlog is applied once, for all replicas of it's unit
+            del self.native_logs[remlog]
+
+            try:
+                new_temps = read_remlog(remlog)
+            except IOError:
+                new_temps = None
+            if (new_temps is None) or (len(new_temps) != len(ids)):
+                self.logger.info("No valid remlog {0}, replicas {1} keep their temperatures".format(remlog, ids))
+                continue
+
+            old_temps = [self.registry.get(rid).dims[dim_str]['par'] for rid in ids]
+            try:
+                exchange_list += exchange.engine.permutation_pairs(ids, old_temps, new_temps)
+            except ValueError:
+                self.logger.info("Temperatures in remlog {0} don't match replicas {1}".format(remlog, ids))
+
+        outfile = "pairs_for_exchange_{dim}_{cycle}.dat".format(dim=dim_int, \
+                                                                cycle=current_cycle)
+        write_pairs(outfile, exchange_list)
+
+    #---------------------------------------------------------------------------
+    #
+    def get_exchange_order(self, dim_str, group):
+
+        """Orders replicas of a group by their parameter in current dimension.
+        Neighbors in this order are exchange partners for neighbor exchange
+        schemes.
+
+        Args:
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects which are in the same group
+
+        Returns:
+            list of replica ids
+        """
+
+        ordered = sorted(group, key=lambda r: float(r.dims[dim_str]['par']))
+        return [r.id for r in ordered]
+
+    #---------------------------------------------------------------------------
+    #
+    def get_exchange_neighbors(self, dim_str, group, replica):
+
+        """Returns replicas of a group with which a given replica may exchange.
+        For gibbs exchange scheme this is the whole group, for neighbor
+        schemes only the replica itself and its two neighbors, so RAMs 
+        evaluate O(1) instead of O(N) states per replica.
+
+        Args:
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects which are in the same group with 
+            a given replica in current dimension
+
+            replica - replica object
+
+        Returns:
+            list of replica objects
+        """
+
+        if self.exchange_scheme == 'gibbs':
+            return group
+
+        ids = exchange.engine.neighbors(self.get_exchange_order(dim_str, group), replica.id)
+        return [r for r in group if r.id in ids]
+
+    #---------------------------------------------------------------------------
+    #
+    def get_exchange_stage_in(self, sd_shared_list):
+        """Returns data directives for files of exchange package, which must be
+        staged in for every CU running a global exchange calculator.
+
+        Args:
+            sd_shared_list - list of RPs data directives corresponding to 
+            simulation input files
+
+        Returns:
+            list of RPs data directives
+        """
+
+        stage_in = []
+        for i, name in enumerate(self.shared_files):
+            if name.startswith('exchange/'):
+                stage_in.append(sd_shared_list[i])
+        return stage_in
+
+    #---------------------------------------------------------------------------
+    #
+    def get_unit_dependencies(self, dim_str, group, replica):
+        """Returns replicas, state of which determines MD unit of a given 
+        replica. MD unit prepared in advance can be used if state of these
+        replicas has not changed.
+
+        Args:
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects which are in the same group with 
+            a given replica in current dimension
+
+            replica - replica object
+
+        Returns:
+            list of replica objects
+        """
+
+        if self.dims[dim_str]['type'] == 'temperature':
+            return [replica]
+        return self.get_exchange_neighbors(dim_str, group, replica)
+
     #---------------------------------------------------------------------------
     #
     def exchange_params(self, dim_str, replica_1, replica_2):
         """Exchanges parameters of the two given replicas in the given 
         dimension. 
 
+        Group indexes of replicas in other dimensions are exchanged as well
+        and replica registry is updated accordingly.
+
         Args:
             dim_str - string representing the index of the current dimension
 
@@ -1829,6 +2440,8 @@ class AmmAmber(object):
             replica_1.dims[dim_str]['par'] = temp
 
         # exchange group indexes
+        old_idx_1 = list(replica_1.group_idx)
+        old_idx_2 = list(replica_2.group_idx)
         dim_int = int(dim_str[1])-1
         for i,j in enumerate(replica_1.group_idx):
             if (i != dim_int):
@@ -1836,6 +2449,9 @@ class AmmAmber(object):
                 replica_1.group_idx[i] = replica_2.group_idx[i]
                 replica_2.group_idx[i] = tmp
 
+        self.registry.update(replica_1, old_idx_1)
+        self.registry.update(replica_2, old_idx_2)
+
     #---------------------------------------------------------------------------
     #
     def do_exchange(self, current_cycle, dim_int, dim_str, replicas):
@@ -1861,6 +2477,8 @@ class AmmAmber(object):
 
         r1 = None
         r2 = None
+        # only replicas which were passed can exchange parameters
+        ids = self.replica_ids(replicas)
 
         infile = "pairs_for_exchange_{dim}_{cycle}.dat".format(dim=dim_int, \
                                                                cycle=current_cycle)
@@ -1871,13 +2489,8 @@ class AmmAmber(object):
             for l in lines:
                 pair = l.split()
                 if pair[0].isdigit() and pair[1].isdigit():
-                    r1_id = int(pair[0])
-                    r2_id = int(pair[1])
-                    for r in replicas:
-                        if r.id == r1_id:
-                            r1 = r
-                        if r.id == r2_id:
-                            r2 = r
+                    r1 = self.registry.get(pair[0]) if int(pair[0]) in ids else None
+                    r2 = self.registry.get(pair[1]) if int(pair[1]) in ids else None
                     #-----------------------------------------------------------
                     # swap parameters
                     if r1 is not None and r2 is not None and self.exchange_off[dim_int-1] == False:
@@ -1893,6 +2506,16 @@ class AmmAmber(object):
         except:
             raise
 
+    #---------------------------------------------------------------------------
+    #
+    def replica_ids(self, replicas):
+        """Returns set of ids of given replicas. Registry is used only as an
+        index, groups are restricted to replicas passed by EMM (e.g. replicas
+        which finished MD).
+        """
+
+        return set([r.id for r in replicas])
+
     #---------------------------------------------------------------------------
     #
     def get_current_group_ids(self, dim_int, replicas, replica):
@@ -1913,40 +2536,8 @@ class AmmAmber(object):
             group with a given replica
         """
 
-        current_group = []
-
-        if self.nr_dims == 3:
-            for r1 in replicas:
-                if dim_int == 1:
-                    r1_pair = [r1.dims['d2']['par'], r1.dims['d3']['par']]
-                    my_pair = [replica.dims['d2']['par'], replica.dims['d3']['par']]  
-                    if r1_pair == my_pair:
-                        current_group.append(str(r1.id))
-
-                elif dim_int == 2:
-                    r1_pair = [r1.dims['d1']['par'], r1.dims['d3']['par']]
-                    my_pair = [replica.dims['d1']['par'], replica.dims['d3']['par']]
-                    if r1_pair == my_pair:
-                        current_group.append(str(r1.id))
-
-                elif dim_int == 3:
-                    r1_pair = [r1.dims['d1']['par'], r1.dims['d2']['par']]
-                    my_pair = [replica.dims['d1']['par'], replica.dims['d2']['par']]
-                    if r1_pair == my_pair:
-                        current_group.append(str(r1.id))
-        elif self.nr_dims == 2:
-            for r1 in replicas:
-                if dim_int == 1:
-                    r1_par = r1.dims['d2']['par']
-                    my_par = replica.dims['d2']['par'] 
-                    if r1_par == my_par:
-                        current_group.append(str(r1.id))
-
-                elif dim_int == 2:
-                    r1_par = r1.dims['d1']['par']
-                    my_par = replica.dims['d1']['par']
-                    if r1_par == my_par:
-                        current_group.append(str(r1.id))
+        group = self.registry.replica_group(dim_int, replica, self.replica_ids(replicas))
+        current_group = [str(r.id) for r in group]
 
         return current_group
 
@@ -1967,24 +2558,11 @@ class AmmAmber(object):
             together based on their group index in the current dimension 
         """
 
-        dim = dim_int-1
-
         all_groups = []
-        for i in range(self.groups_numbers[dim]):
-            all_groups.append([None])
-        for r in replicas:
-            all_groups[r.group_idx[dim]].append(r.id)
+        for group in self.registry.all_groups(dim_int, self.replica_ids(replicas)):
+            all_groups.append([r.id for r in group])
 
-        self.logger.info("all groups ids before: {0}".format( all_groups ) )
-
-        for gr in all_groups:
-            gr.pop(0) 
-
-        for i,v in enumerate(all_groups):
-            if len(all_groups[i]) == 0:
-                all_groups.pop(i)
-
-        self.logger.info("all groups ids after: {0}".format( all_groups ) )
+        self.logger.info("all groups ids: {0}".format( all_groups ) )
 
         return all_groups
 
@@ -2005,13 +2583,10 @@ class AmmAmber(object):
             on their group index in the current dimension 
         """
 
-        dim = dim_int-1
-
+        # EMMs expect None as the first item of each group
         all_groups = []
-        for i in range(self.groups_numbers[dim]):
-            all_groups.append([None])
-        for r in replicas:
-            all_groups[r.group_idx[dim]].append(r)
+        for group in self.registry.all_groups(dim_int, self.replica_ids(replicas)):
+            all_groups.append([None] + group)
 
         return all_groups
 
@@ -2034,12 +2609,7 @@ class AmmAmber(object):
             given replica 
         """
 
-        dim = dim_int-1
-        group = list()
-
-        for r in replicas:
-            if r.group_idx[dim] == replica.group_idx[dim]:
-                group.append(r)
+        group = self.registry.replica_group(dim_int, replica, self.replica_ids(replicas))
 
         return group
 
@@ -16,9 +16,13 @@ from os import path
 import radical.pilot as rp
 import radical.utils.logger as rul
 from kernels.kernels import KERNELS
+import exchange.engine
 import ram_namd.input_file_builder
-from replicas.replica import Replica
+from replicas.replica import ReplicaStore
 from repex_utils.simulation_restart import Restart
+from repex_utils.checkpoint import JOURNAL_FILE
+from repex_utils.checkpoint import CheckpointJournal
+from repex_utils.checkpoint import replay_journal
 
 #-------------------------------------------------------------------------------
 
@@ -55,6 +59,7 @@ class AmmNamd(object):
         # hardcoded for 1d
         self.nr_dims = 1
         self.groups_numbers = [1]
+        self.store = None
 
         self.dims = {}
         self.dims['d1'] = {'replicas' : None, 'type' : None} 
@@ -76,6 +81,21 @@ class AmmNamd(object):
             self.restart = False
             self.restart_done = True
 
+        # restart from the last checkpoint of a given cycle and dimension
+        self.restart_cycle     = inp_file['remd.input'].get('restart_cycle')
+        self.restart_dimension = inp_file['remd.input'].get('restart_dimension')
+        if self.restart_cycle is not None:
+            self.restart_cycle = int(self.restart_cycle)
+        if self.restart_dimension is not None:
+            self.restart_dimension = int(self.restart_dimension)
+
+        # full snapshot of replicas is written every checkpoint_interval steps
+        self.checkpoint_interval = int(inp_file['remd.input'].get('checkpoint_interval', '10'))
+        if self.checkpoint_interval < 1:
+            self.logger.info("checkpoint_interval must be a positive integer, exiting...")
+            sys.exit(1)
+        self.journal = CheckpointJournal(JOURNAL_FILE, self.checkpoint_interval)
+
         if inp_file['remd.input'].get('exchange_mpi') == "True":
             self.exchange_mpi = True
         else:
@@ -116,11 +136,13 @@ class AmmNamd(object):
                       dim_int, 
                       dim_str, 
                       replicas):
-        """Saves the state of the simulation and state of replicas to .pkl file. 
-        Method is called after every simulation cycle and for each dimension in 
-        the current simulation. Method first updates restart object, writes 
-        state of replicas to .pkl file and then writes restart object (which 
-        represents simulation state) to .pkl file
+        """Saves the state of the simulation and state of replicas to checkpoint
+        journal. Method is called after every simulation cycle and for each 
+        dimension in the current simulation. Method first updates restart 
+        object, then appends to the journal changes of replicas since the last 
+        call together with restart object (which represents simulation state). 
+        Every checkpoint_interval calls a full snapshot of replicas is appended
+        instead.
 
         Args:
             current_cycle - current simulation cycle
@@ -139,18 +161,14 @@ class AmmNamd(object):
         self.restart_object.current_cycle =  current_cycle
         self.restart_object.old_sandbox   = self.restart_object.new_sandbox
 
-        self.restart_file = 'simulation_objects_{0}_{1}.pkl'.format( dim_int, current_cycle )
-        with open(self.restart_file, 'wb') as output:
-            for replica in replicas:
-                pickle.dump(replica, output, pickle.HIGHEST_PROTOCOL)
-
-            pickle.dump(self.restart_object, output, pickle.HIGHEST_PROTOCOL)
+        self.journal.commit(dim_int, current_cycle, self.store, self.restart_object)
 
     #---------------------------------------------------------------------------
     #
     def recover_replicas(self):
-        """Recovers the state of the failed simulation from .pkl file. Updates 
-        restart_object of this AMM. Updates groups_numbers attribute of this 
+        """Recovers the state of the failed simulation by replaying checkpoint 
+        journal up to restart_cycle and restart_dimension (by default up to the
+        last checkpoint). Updates restart_object of this AMM. Updates groups_numbers attribute of this 
         AMM.  
 
         Args:
@@ -160,14 +178,16 @@ class AmmNamd(object):
             list of recovered replica objects
         """
 
-        replicas = []
-        with open(self.restart_file, 'rb') as input:
-            for i in range(self.replicas):
-                r_temp = pickle.load(input)
-                replicas.append( r_temp )
-            self.restart_object = pickle.load(input)
-            self.groups_numbers = self.restart_object.groups_numbers
-        return replicas
+        state = replay_journal(self.restart_file, 
+                               self.restart_cycle, 
+                               self.restart_dimension)
+        if state is None:
+            self.logger.info("No checkpoint for cycle {0} in restart file {1}, exiting...".format(self.restart_cycle, self.restart_file))
+            sys.exit(1)
+
+        self.store, self.restart_object = state
+        self.groups_numbers = self.restart_object.groups_numbers
+        return self.store.replicas()
 
     #---------------------------------------------------------------------------
     #
@@ -236,6 +256,16 @@ class AmmNamd(object):
         ind_calc_url = 'file://%s' % (ind_calc_path)
         self.shared_urls.append(ind_calc_url)
 
+        #-----------------------------------------------------------------------
+        # exchange package is used by global exchange calculators, files are 
+        # staged as exchange/<name> so it is importable in CU sandbox
+        exchange_path = os.path.dirname(exchange.engine.__file__)
+        for ex_file in sorted(os.listdir(exchange_path)):
+            if ex_file.endswith('.py'):
+                self.shared_files.append('exchange/' + ex_file)
+                ex_url = 'file://%s' % (os.path.join(exchange_path, ex_file))
+                self.shared_urls.append(ex_url)
+
     #---------------------------------------------------------------------------
     #
     def initialize_replicas(self):
@@ -252,13 +282,15 @@ class AmmNamd(object):
         """
 
         self.restart_object = Restart()
+        self.journal.reset()
         
         replicas = []
         N = self.replicas
+        self.store = ReplicaStore(N)
         factor = (self.max_temp/self.min_temp)**(1./(N-1))
         for k in range(N):
             new_temp = self.min_temp * (factor**k)
-            r = Replica(k, d1_param=new_temp)
+            r = self.store.set_replica(k, k, [new_temp])
             replicas.append(r)
 
         # hardcoded for 1d
@@ -305,11 +337,11 @@ class AmmNamd(object):
         basename = self.inp_basename
         template = self.inp_basename + ".namd"
             
-        outputname = "%s_%d_%d" % (basename, replica.id, replica.cycle)
-        replica.new_coor = outputname + ".coor"
-        replica.new_vel = outputname + ".vel"
-        replica.new_history = outputname + ".history"
-        replica.new_ext_system = outputname + ".xsc" 
+        outputname = replica.name(basename)
+        new_coor = outputname + ".coor"
+        new_vel = outputname + ".vel"
+        new_history = outputname + ".history"
+        new_ext_system = outputname + ".xsc" 
 
         old_name = "%s_%d_%d" % (basename, replica.id, (replica.cycle-1))
         old_coor = old_name + ".coor"
@@ -320,11 +352,6 @@ class AmmNamd(object):
 
         input_file = "%s_%d_%d.namd" % (self.inp_basename, replica.id, (replica.cycle))
 
-        new_coor = replica.new_coor
-        new_vel = replica.new_vel
-        new_history = replica.new_history
-        new_ext_system = replica.new_ext_system
-
         stage_out = []
         stage_in = []
  
@@ -392,15 +419,8 @@ class AmmNamd(object):
                 stage_in.append(sd_shared_list[i])
             stage_in.append(sd_shared_list[7])
 
-            matrix_col = "matrix_column_%s_%s.dat" % (str(replica.id), 
-                                                      str(replica.cycle))
-            matrix_col_out = {
-                'source': matrix_col,
-                'target': 'staging:///%s' % (matrix_col),
-                'action': rp.COPY
-            }
-            stage_out.append(matrix_col_out)
-
+            # ind_ex_calculator.py writes swap matrix column directly to
+            # swap_matrix_c.dat file in staging area
             temperatures = ""
             for r in group:
                 temperatures += " " + str(r.dims['d1']['par'])
@@ -413,6 +433,9 @@ class AmmNamd(object):
                 "temperatures": temperatures
             }
 
+            # exchange package used by ind_ex_calculator.py
+            stage_in += self.get_exchange_stage_in(sd_shared_list)
+
             dump_post_data = json.dumps(data)
             json_post_data = dump_post_data.replace("\\", "")
 
@@ -471,6 +494,8 @@ class AmmNamd(object):
         outfile = "pairs_for_exchange_{cycle}.dat".format(cycle=cycle)
         stage_out.append(outfile)
 
+        stage_in += self.get_exchange_stage_in(sd_shared_list)
+
         if self.exchange_mpi == True:
             # global_ex_calculator_mpi.py file
             stage_in.append(sd_shared_list[5])
@@ -524,6 +549,48 @@ class AmmNamd(object):
 
         return cu
 
+    #---------------------------------------------------------------------------
+    #
+    def get_exchange_stage_in(self, sd_shared_list):
+        """Returns data directives for files of exchange package, which must be
+        staged in for every CU running a global exchange calculator.
+
+        Args:
+            sd_shared_list - list of RPs data directives corresponding to 
+            simulation input files
+
+        Returns:
+            list of RPs data directives
+        """
+
+        stage_in = []
+        for i, name in enumerate(self.shared_files):
+            if name.startswith('exchange/'):
+                stage_in.append(sd_shared_list[i])
+        return stage_in
+
+    #---------------------------------------------------------------------------
+    #
+    def get_unit_dependencies(self, dim_str, group, replica):
+        """Returns replicas, state of which determines MD unit of a given 
+        replica. MD unit prepared in advance can be used if state of these
+        replicas has not changed.
+
+        Args:
+            dim_str - string representing the index of the current dimension
+
+            group - list of replica objects which are in the same group with 
+            a given replica in current dimension
+
+            replica - replica object
+
+        Returns:
+            list of replica objects
+        """
+
+        # MD units include temperatures of the whole group
+        return group
+
     #---------------------------------------------------------------------------
     #
     def exchange_params(self, replica_i, replica_j):
@@ -0,0 +1,230 @@
+"""
+.. module:: radical.repex.exchange.acceptance
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import numpy as np
+
+KB = 0.0019872041    #boltzmann const in kcal/mol
+
+#-------------------------------------------------------------------------------
+#
+def beta(temperatures):
+    """Calculates inverse temperature(s). For zero temperature 1/kb is used, as
+    it was done by all RAMs.
+
+    Args:
+        temperatures - temperature or array of temperatures
+
+    Returns:
+        NumPy array (or scalar) of inverse temperatures
+    """
+
+    t = np.asarray(temperatures, dtype=np.float64)
+    t = np.where(t != 0.0, t, 1.0)
+    return 1.0 / (KB * t)
+
+#-------------------------------------------------------------------------------
+#
+def reduced_energy(temperature, potential):
+    """Calculates reduced energy.
+
+    Args:
+        temperature - replica temperature
+
+        potential - replica potential energy
+
+    Returns:
+        reduced enery of replica
+    """
+
+    return float(beta(temperature) * potential)
+
+#-------------------------------------------------------------------------------
+#
+def reduced_energies(temperatures, potentials):
+    """Vectorized version of reduced_energy().
+
+    Args:
+        temperatures - array of temperatures
+
+        potentials - array of potential energies
+
+    Returns:
+        NumPy array of reduced energies
+    """
+
+    return beta(temperatures) * np.asarray(potentials, dtype=np.float64)
+
+#-------------------------------------------------------------------------------
+#
+def parse_temperatures(temps, replicas):
+    """Parses temperatures of replicas, which are passed to a RAM as a single
+    argument with whitespace separated values.
+
+    Args:
+        temps - string with temperatures, ordered by replica id
+
+        replicas - number of replicas
+
+    Returns:
+        NumPy array of temperatures
+    """
+
+    temperatures = np.array(temps.split()[:replicas], dtype=np.float64)
+    if len(temperatures) != replicas:
+        raise ValueError("Expected {0} temperatures, got {1}".format(replicas, 
+                                                                    len(temperatures)))
+    return temperatures
+
+#-------------------------------------------------------------------------------
+#
+def state_terms_matrix(rows, replicas):
+    """Assembles state dependent energy terms of replicas into a matrix, which
+    can be passed as state_terms to Acceptance.swap_matrix().
+
+    Args:
+        rows - dictionary, where rows[i][j] is energy term of configuration of
+        replica i evaluated in state of replica j, e.g. restraint energy 
+        U_j(x_i)
+
+        replicas - number of replicas
+
+    Returns:
+        2d NumPy array, where element [i][j] is rows[i][j], missing terms are
+        set to zero
+    """
+
+    terms = np.zeros((replicas, replicas))
+    for i in rows:
+        for j in rows[i]:
+            terms[int(i)][int(j)] = float(rows[i][j])
+    return terms
+
+#-------------------------------------------------------------------------------
+#
+class Acceptance(object):
+    """Base class for acceptance criteria. An acceptance criterion defines
+    potential energy of configuration of replica i evaluated in every state j.
+    Element [j][i] of a swap matrix is then beta_j * state_energies[i][j].
+
+    Attributes:
+        name - exchange type, as specified in simulation input file
+    """
+
+    name = None
+
+    def state_energies(self, energy, state_terms=None):
+        """Returns potential energies of configuration(s) in every state.
+
+        Args:
+            energy - potential energy of replica (or array of energies)
+
+            state_terms - energy terms which depend on state, specific to
+            a given exchange type
+
+        Returns:
+            NumPy array
+        """
+        raise NotImplementedError
+
+    def swap_column(self, temperatures, energy, state_terms=None):
+        """Calculates swap matrix column for a single replica.
+
+        Args:
+            temperatures - array with temperatures of all states
+
+            energy - potential energy of this replica
+
+            state_terms - see state_energies()
+
+        Returns:
+            1d NumPy array
+        """
+
+        e = self.state_energies(energy, state_terms)
+        return reduced_energies(temperatures, e) * np.ones(len(temperatures))
+
+    def swap_matrix(self, temperatures, energies, state_terms=None):
+        """Calculates swap matrix for all replicas at once.
+
+        Args:
+            temperatures - array with temperatures of all states
+
+            energies - array with potential energies of all replicas
+
+            state_terms - see state_energies(), first index is replica
+
+        Returns:
+            2d NumPy array, where each column is a replica and each row is
+            a state
+        """
+
+        n = len(temperatures)
+        e = self.state_energies(np.asarray(energies, dtype=np.float64)[:, np.newaxis],
+                                state_terms)
+        return beta(temperatures)[:, np.newaxis] * (e * np.ones((n, n))).T
+
+#-------------------------------------------------------------------------------
+#
+class TemperatureAcceptance(Acceptance):
+    """Temperature exchange: potential energy doesn't depend on state.
+    """
+
+    name = 'temperature'
+
+    def state_energies(self, energy, state_terms=None):
+        return np.asarray(energy, dtype=np.float64)
+
+#-------------------------------------------------------------------------------
+#
+class UmbrellaAcceptance(Acceptance):
+    """Umbrella exchange: state_terms are restraint energies of replica
+    configuration evaluated with restraints of every state.
+    """
+
+    name = 'umbrella'
+
+    def state_energies(self, energy, state_terms=None):
+        return np.asarray(energy, dtype=np.float64) + \
+               np.asarray(state_terms, dtype=np.float64)
+
+#-------------------------------------------------------------------------------
+#
+class SaltAcceptance(Acceptance):
+    """Salt concentration exchange: state_terms are single point energies of
+    replica configuration evaluated at salt concentration of every state.
+    """
+
+    name = 'salt'
+
+    def state_energies(self, energy, state_terms=None):
+        return np.asarray(state_terms, dtype=np.float64)
+
+#-------------------------------------------------------------------------------
+
+ACCEPTANCE = {
+    TemperatureAcceptance.name : TemperatureAcceptance,
+    UmbrellaAcceptance.name    : UmbrellaAcceptance,
+    SaltAcceptance.name        : SaltAcceptance
+}
+
+#-------------------------------------------------------------------------------
+#
+def get_acceptance(d_type):
+    """Returns acceptance criterion for a given exchange type.
+
+    Args:
+        d_type - exchange type, e.g. 'temperature', 'umbrella' or 'salt'
+
+    Returns:
+        instance of Acceptance subclass
+    """
+
+    try:
+        return ACCEPTANCE[d_type]()
+    except KeyError:
+        raise ValueError("Unknown exchange type: {0}".format(d_type))
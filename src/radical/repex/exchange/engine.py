@@ -0,0 +1,329 @@
+"""
+.. module:: radical.repex.exchange.engine
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import numpy as np
+
+# exchange schemes which can be specified in simulation input file:
+# gibbs    - independence sampling over all replicas of a group
+# neighbor - pairs of neighbors, even or odd pairs are chosen at random
+# deo      - deterministic even-odd, even pairs on even cycles and odd pairs
+#            on odd cycles
+SCHEMES = ['gibbs', 'neighbor', 'deo']
+
+#-------------------------------------------------------------------------------
+#
+def log_sum_exp(log_ps, axis=-1):
+    """Numerically stable log(sum(exp(log_ps))) along a given axis. Replaces
+    clamping of exponents to sys.float_info limits.
+
+    Args:
+        log_ps - array of log-probabilities
+
+        axis - axis along which we sum
+
+    Returns:
+        array with one dimension less than log_ps
+    """
+
+    log_ps = np.asarray(log_ps, dtype=np.float64)
+    m = np.max(log_ps, axis=axis, keepdims=True)
+    m = np.where(np.isfinite(m), m, 0.0)
+    with np.errstate(divide='ignore'):
+        s = np.log(np.sum(np.exp(log_ps - m), axis=axis, keepdims=True)) + m
+    return np.squeeze(s, axis=axis)
+
+#-------------------------------------------------------------------------------
+#
+def swap_log_probabilities(swap_matrix, ids, sids=None):
+    """Evaluates log-acceptance terms of all i-j swaps within a group of
+    replicas with a single broadcast. Element [a][b] of the returned matrix is:
+
+        -(u[sid_a][id_b] + u[sid_b][id_a] - u[sid_a][id_a] - u[sid_b][id_b])
+
+    which is the exponent used by asyncre-bigjob [1] independence sampling.
+
+    Args:
+        swap_matrix - matrix of dimension-less energies, where each column is
+        a replica and each row is a state
+
+        ids - list of replica ids in this group
+
+        sids - list of state ids in this group, defaults to ids
+
+    Returns:
+        2d NumPy array of size len(ids) x len(ids)
+    """
+
+    swap_matrix = np.asarray(swap_matrix, dtype=np.float64)
+    ids = np.asarray(ids, dtype=np.intp)
+    if sids is None:
+        sids = ids
+    else:
+        sids = np.asarray(sids, dtype=np.intp)
+
+    # u[a][b] = swap_matrix[sid_a][id_b]
+    u = swap_matrix[np.ix_(sids, ids)]
+    d = np.diag(u)
+    log_ps = -(u + u.T - d[:, np.newaxis] - d[np.newaxis, :])
+
+    # failed replicas may leave NaN's in the swap matrix
+    log_ps[np.isnan(log_ps)] = -np.inf
+
+    return log_ps
+
+#-------------------------------------------------------------------------------
+#
+def sample_partners(log_ps, rng=None):
+    """For every row of log_ps samples a column index from the discrete
+    distribution given by this row. All rows are sampled at once: cumulative
+    sums of rows are shifted by row index, which makes the flattened array
+    monotonic, so a single searchsorted() call finds all partners.
+
+    Args:
+        log_ps - square matrix of (unnormalized) log-probabilities
+
+        rng - instance of numpy.random.RandomState, defaults to global state
+
+    Returns:
+        1d NumPy array with index of the partner for each row
+    """
+
+    if rng is None:
+        rng = np.random
+
+    log_ps = np.asarray(log_ps, dtype=np.float64)
+    n = log_ps.shape[0]
+    rows = np.arange(n)
+
+    norm = log_sum_exp(log_ps, axis=1)
+    bad = ~np.isfinite(norm)
+    norm[bad] = 0.0
+    with np.errstate(invalid='ignore'):
+        ps = np.exp(log_ps - norm[:, np.newaxis])
+    # rows without a single finite entry don't exchange
+    ps[bad] = 0.0
+    ps[bad, rows[bad]] = 1.0
+
+    cdf = np.cumsum(ps, axis=1)
+    cdf[:, -1] = 1.0
+
+    offsets = rows.astype(np.float64)
+    flat = (cdf + offsets[:, np.newaxis]).ravel()
+    rnd = rng.random_sample(n) + offsets
+    partners = np.searchsorted(flat, rnd, side='right') - rows * n
+
+    return np.clip(partners, 0, n-1)
+
+#-------------------------------------------------------------------------------
+#
+def exchange_pairs(swap_matrix, ids, sids=None, rng=None):
+    """Determines exchange pairs in a group of replicas identified by ids.
+
+    Args:
+        swap_matrix - matrix with reduced energies
+
+        ids - list of replica ids in this group
+
+        sids - list of state ids in this group, defaults to ids
+
+        rng - instance of numpy.random.RandomState, defaults to global state
+
+    Returns:
+        list with pairs of replica ids
+    """
+
+    if len(ids) < 2:
+        return []
+
+    log_ps = swap_log_probabilities(swap_matrix, ids, sids)
+    partners = sample_partners(log_ps, rng)
+
+    pairs = []
+    for a, b in enumerate(partners):
+        if a != b:
+            pairs.append( [int(ids[a]), int(ids[b])] )
+    return pairs
+
+#-------------------------------------------------------------------------------
+#
+def do_exchange(replicas, swap_matrix, rng=None):
+    """Determines exchange pairs in current group of replicas. Drop-in
+    replacement for per-replica gibbs_exchange() loops of RAMs.
+
+    Args:
+        replicas - list of replica objects (replicas in same group), each must
+        have id and sid attributes
+
+        swap_matrix - matrix with reduced energies
+
+        rng - instance of numpy.random.RandomState, defaults to global state
+
+    Returns:
+        exchanged_pairs - list with pairs of replica ids
+    """
+
+    ids  = [int(r.id) for r in replicas]
+    sids = [int(r.sid) for r in replicas]
+
+    return exchange_pairs(swap_matrix, ids, sids, rng)
+
+#-------------------------------------------------------------------------------
+#
+def neighbor_exchange(replicas, swap_matrix, parity=0, rng=None):
+    """Metropolis exchange between neighbors. Replicas must be ordered by
+    parameter of current dimension. Only swap matrix elements of adjacent 
+    replicas are evaluated, so only these need to be populated.
+
+    Args:
+        replicas - list of replica objects ordered by parameter, each must
+        have id and sid attributes
+
+        swap_matrix - matrix with reduced energies
+
+        parity - 0 for pairs (0,1), (2,3), ... and 1 for pairs (1,2), (3,4), ...
+
+        rng - instance of numpy.random.RandomState, defaults to global state
+
+    Returns:
+        list with pairs of replica ids
+    """
+
+    if rng is None:
+        rng = np.random
+
+    ids  = np.array([int(r.id) for r in replicas], dtype=np.intp)
+    sids = np.array([int(r.sid) for r in replicas], dtype=np.intp)
+
+    a = np.arange(int(parity), len(ids)-1, 2)
+    if len(a) == 0:
+        return []
+    b = a + 1
+
+    m = np.asarray(swap_matrix, dtype=np.float64)
+    delta = m[sids[a], ids[b]] + m[sids[b], ids[a]] - \
+            m[sids[a], ids[a]] - m[sids[b], ids[b]]
+
+    # failed replicas may leave NaN's in the swap matrix, these don't exchange
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accept = np.log(rng.random_sample(len(a))) < -delta
+
+    pairs = []
+    for k in np.nonzero(accept)[0]:
+        pairs.append( [int(ids[a[k]]), int(ids[b[k]])] )
+    return pairs
+
+#-------------------------------------------------------------------------------
+#
+def exchange_parity(scheme, cycle, rng=None):
+    """Returns parity of neighbor pairs for a given exchange scheme.
+
+    Args:
+        scheme - 'neighbor' or 'deo'
+
+        cycle - current simulation cycle
+
+        rng - instance of numpy.random.RandomState, defaults to global state
+
+    Returns:
+        0 or 1
+    """
+
+    if scheme == 'deo':
+        return int(cycle) % 2
+    if rng is None:
+        rng = np.random
+    return int(rng.randint(2))
+
+#-------------------------------------------------------------------------------
+#
+def neighbors(order, rid):
+    """Returns ids of replicas which must be evaluated by a given replica for
+    neighbor exchange: the replica itself and its left and right neighbors.
+
+    Args:
+        order - list of replica ids ordered by parameter of current dimension
+
+        rid - replica id
+
+    Returns:
+        list of replica ids
+    """
+
+    order = [int(i) for i in order]
+    k = order.index(int(rid))
+    return order[max(0, k-1):k+2]
+
+#-------------------------------------------------------------------------------
+#
+def exchange_group(replicas, swap_matrix, scheme='gibbs', dim_int=1, cycle=0, rng=None):
+    """Determines exchange pairs in current group of replicas using a given
+    exchange scheme.
+
+    Args:
+        replicas - list of exchange.replica.Replica objects (same group)
+
+        swap_matrix - matrix with reduced energies
+
+        scheme - one of SCHEMES
+
+        dim_int - index of current dimension, replicas are ordered by their 
+        parameter in this dimension for neighbor schemes
+
+        cycle - current simulation cycle
+
+        rng - instance of numpy.random.RandomState, defaults to global state
+
+    Returns:
+        list with pairs of replica ids
+    """
+
+    if scheme == 'gibbs':
+        return do_exchange(replicas, swap_matrix, rng)
+    if scheme not in SCHEMES:
+        raise ValueError("Unknown exchange scheme: {0}".format(scheme))
+
+    ordered = sorted(replicas, key=lambda r: float(r.param(dim_int)))
+    return neighbor_exchange(ordered, swap_matrix, exchange_parity(scheme, cycle, rng), rng)
+
+#-------------------------------------------------------------------------------
+#
+def permutation_pairs(ids, old_params, new_params):
+    """Determines pairs of replicas, such that exchanging parameters of these
+    pairs one after another moves parameters from old to new assignment. Used
+    for exchanges which were already done by MD engine (e.g. Amber's native
+    REMD), where only final parameters of replicas are known.
+
+    Args:
+        ids - list of replica ids
+
+        old_params - list of parameters of replicas before exchanges
+
+        new_params - list of parameters of replicas after exchanges, each 
+        is matched to the closest of old parameters
+
+    Returns:
+        list with pairs of replica ids
+    """
+
+    old_params = [float(p) for p in old_params]
+    target = []
+    for p in new_params:
+        diff = [abs(float(p) - o) for o in old_params]
+        target.append(diff.index(min(diff)))
+    if sorted(target) != range(len(old_params)):
+        raise ValueError("New parameters are not a permutation of old parameters")
+
+    # current[i] - index of old parameter, which replica i has now
+    current = range(len(old_params))
+    pairs = []
+    for i in range(len(ids)):
+        if current[i] != target[i]:
+            j = current.index(target[i])
+            pairs.append([ids[i], ids[j]])
+            current[i], current[j] = current[j], current[i]
+    return pairs
@@ -0,0 +1,97 @@
+"""
+.. module:: radical.repex.exchange.history
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+
+#-------------------------------------------------------------------------------
+#
+def history_shard(path, rid):
+    """Returns path to the file with record of a given replica.
+
+    Args:
+        path - path to history_info_x directory
+
+        rid - replica id
+    """
+
+    return os.path.join(path, "%s.dat" % rid)
+
+#-------------------------------------------------------------------------------
+#
+def append_history(path, fields):
+    """Writes a single record to history_info_x directory in staging_area.
+    Each CU associated with some replica is writing to it, so each replica
+    has its own shard file. Record is written under temporary name and
+    renamed, so no locks are needed and readers never see incomplete record.
+
+    Args:
+        path - path to history_info_x directory
+
+        fields - list of record fields, first field is replica id
+    """
+
+    history_str = ""
+    for field in fields:
+        history_str += str(field) + " "
+    history_str += "\n"
+
+    try:
+        os.makedirs(path)
+    except OSError:
+        # created by other replica
+        if not os.path.isdir(path):
+            raise
+
+    shard = history_shard(path, fields[0])
+    tmp_shard = "%s.%d.tmp" % (shard, os.getpid())
+    with open(tmp_shard, "w") as f:
+        f.write(history_str)
+    os.rename(tmp_shard, shard)
+
+#-------------------------------------------------------------------------------
+#
+def is_int(s):
+    try:
+        int(s)
+        return True
+    except ValueError:
+        return False
+
+#-------------------------------------------------------------------------------
+#
+def consume_history(path, replica_ids, min_fields=1):
+    """Reads records of given replicas from history_info_x directory and
+    removes them. Only shards of given replicas are accessed, records of
+    other replicas are not touched.
+
+    Args:
+        path - path to history_info_x directory
+
+        replica_ids - list of replica ids to consume
+
+        min_fields - records with less fields are considered incomplete and
+        are discarded
+
+    Returns:
+        dictionary where key is replica id and value is a list of record fields
+    """
+
+    records = {}
+    for rid in replica_ids:
+        shard = history_shard(path, int(rid))
+        try:
+            with open(shard, "r") as f:
+                tmp = f.read().split()
+            os.remove(shard)
+        except (IOError, OSError):
+            continue
+        if len(tmp) < min_fields or not is_int(tmp[0]):
+            continue
+        records[int(tmp[0])] = tmp
+
+    return records
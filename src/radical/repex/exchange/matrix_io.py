@@ -0,0 +1,305 @@
+"""
+.. module:: radical.repex.exchange.matrix_io
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import time
+import numpy as np
+
+STAGING_AREA = "../staging_area/"
+
+#-------------------------------------------------------------------------------
+#
+def staging_area(name=''):
+    """Returns absolute path to a file in staging_area of this pilot. Assumes
+    that we are in CU sandbox.
+
+    Args:
+        name - name of the file
+
+    Returns:
+        path to the file
+    """
+
+    pwd = os.getcwd()
+    return os.path.join(os.path.dirname(pwd), "staging_area", name)
+
+#-------------------------------------------------------------------------------
+#
+def format_row(items):
+    """Joins items with a single whitespace.
+    """
+
+    return " ".join([str(item) for item in items])
+
+#-------------------------------------------------------------------------------
+#
+def merge_rank_records(rank_records, replicas, fields):
+    """Merges records gathered from MPI ranks into arrays indexed by replica
+    id. Ranks hold replicas in round robin order, so values are placed by
+    replica id and not in order in which they were gathered.
+
+    Args:
+        rank_records - list with a list of records for each rank, where each
+        record is [rid, value_1, ..., value_n]
+
+        replicas - number of replicas
+
+        fields - number of values n in each record
+
+    Returns:
+        list with n NumPy arrays, element rid of array k is value_k+1 of
+        replica rid (zero for replicas without a record)
+    """
+
+    values = [np.zeros(replicas) for k in range(fields)]
+    for records in rank_records:
+        for record in records:
+            for k, value in enumerate(record[1:]):
+                values[k][int(record[0])] = float(value)
+    return values
+
+#-------------------------------------------------------------------------------
+
+# matrix_column_x_x.dat files are binary:
+#   magic string (8 bytes)
+#   header: number of columns, length of column, size of info (3 x int64)
+#   replica ids (int64 x number of columns)
+#   columns of swap matrix (float64 x number of columns x length of column)
+#   info: data associated with each replica, one text line per column
+COLUMNS_MAGIC  = b'REPEXMC1'
+HEADER_SIZE    = 32
+
+#-------------------------------------------------------------------------------
+#
+def write_columns(outfile, ids, columns, infos):
+    """Writes binary matrix_column_x_x.dat file with a given columns of swap
+    matrix. File is written under temporary name and renamed, so that readers
+    never see incomplete file.
+
+    Args:
+        outfile - name of the file
+
+        ids - list of replica ids, one per column
+
+        columns - 2d array-like, where each row is a column of swap matrix
+
+        infos - list of replica data lists, one per column
+    """
+
+    ids = np.asarray(ids, dtype=np.int64)
+    columns = np.ascontiguousarray(columns, dtype=np.float64)
+    columns = columns.reshape(len(ids), -1)
+    info = "".join([format_row(i) + '\n' for i in infos]).encode('utf-8')
+
+    header = np.array([len(ids), columns.shape[1], len(info)], dtype=np.int64)
+
+    tmp_file = outfile + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(COLUMNS_MAGIC)
+        f.write(header.tobytes())
+        f.write(ids.tobytes())
+        f.write(columns.tobytes())
+        f.write(info)
+    os.rename(tmp_file, outfile)
+
+#-------------------------------------------------------------------------------
+#
+def read_columns(path, replicas, attempts=10, delay=1):
+    """Reads file written by write_columns(). Columns are not copied, those
+    are memory-mapped from the file. File might not be transferred yet, so we
+    retry a given number of times.
+
+    Args:
+        path - path to the file
+
+        replicas - number of replicas (length of column)
+
+        attempts - number of retries
+
+        delay - time between retries in seconds
+
+    Returns:
+        ids - NumPy array of replica ids
+
+        columns - read-only 2d NumPy array, where each row is a column of swap
+        matrix
+
+        infos - list of lists with replica data
+
+        or None if file is not available
+    """
+
+    attempt = 0
+    while attempt <= attempts:
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(COLUMNS_MAGIC)) != COLUMNS_MAGIC:
+                    raise ValueError("Not a matrix column file %s" % path)
+                header = np.fromfile(f, dtype=np.int64, count=3)
+                n, length, info_size = [int(i) for i in header]
+                if length != replicas:
+                    raise ValueError("Incomplete column in file %s" % path)
+                ids = np.fromfile(f, dtype=np.int64, count=n)
+                data_offset = HEADER_SIZE + 8*n
+                info_offset = data_offset + 8*n*length
+                f.seek(info_offset)
+                info = f.read(info_size).decode('utf-8')
+                if (len(ids) != n) or (len(info) != info_size):
+                    raise ValueError("Incomplete file %s" % path)
+            columns = np.memmap(path, 
+                                dtype=np.float64, 
+                                mode='r', 
+                                offset=data_offset, 
+                                shape=(n, length))
+            infos = [line.split() for line in info.splitlines()]
+            return ids, columns, infos
+        except (IOError, IndexError, ValueError):
+            print "Waiting for file: %s" % path
+            time.sleep(delay)
+            attempt += 1
+    return None
+
+#-------------------------------------------------------------------------------
+#
+def write_column(outfile, column, info):
+    """Writes matrix_column_x_x.dat file with a single column of swap matrix
+    and data associated with replica.
+
+    Args:
+        outfile - name of the file
+
+        column - list of reduced energies
+
+        info - list of replica data, first item is replica id
+    """
+
+    write_columns(outfile, [int(info[0])], [column], [info])
+
+#-------------------------------------------------------------------------------
+#
+def read_column(path, replicas, attempts=10, delay=1):
+    """Reads matrix_column_x_x.dat file written by write_column().
+
+    Args:
+        path - path to the file
+
+        replicas - number of replicas (length of column)
+
+        attempts - number of retries
+
+        delay - time between retries in seconds
+
+    Returns:
+        column - NumPy array of reduced energies
+
+        info - list of strings with replica data
+
+        or None if file is not available
+    """
+
+    result = read_columns(path, replicas, attempts, delay)
+    if result is None:
+        return None
+    ids, columns, infos = result
+    return columns[0], infos[0]
+
+#-------------------------------------------------------------------------------
+#
+def write_group_columns(outfile, columns, infos):
+    """Writes a single matrix_column_x_x.dat file for a group of replicas.
+
+    Args:
+        outfile - name of the file
+
+        columns - list of columns, first item of each column is replica id
+
+        infos - list of replica data lists
+    """
+
+    ids = [int(column[0]) for column in columns]
+    write_columns(outfile, ids, [column[1:] for column in columns], infos)
+
+#-------------------------------------------------------------------------------
+#
+def read_group_columns(path, group_size, replicas, attempts=10, delay=1):
+    """Reads file written by write_group_columns().
+
+    Args:
+        path - path to the file
+
+        group_size - number of replicas in group
+
+        replicas - total number of replicas (length of column)
+
+        attempts - number of retries
+
+        delay - time between retries in seconds
+
+    Returns:
+        columns - dictionary where key is replica id and value is a NumPy
+        array with a column of swap matrix
+
+        infos - list of lists with replica data
+
+        or None if file is not available
+    """
+
+    result = read_columns(path, replicas, attempts, delay)
+    if result is None:
+        return None
+    ids, columns, infos = result
+    return dict([(int(rid), columns[i]) for i, rid in enumerate(ids)]), infos
+
+#-------------------------------------------------------------------------------
+#
+def write_pairs(outfile, exchange_list, sandbox=None):
+    """Writes pairs_for_exchange_x_x.dat file.
+
+    Args:
+        outfile - name of the file
+
+        exchange_list - list with pairs of replica ids
+
+        sandbox - path to be written after pairs, usually CU sandbox
+    """
+
+    with open(outfile, 'w+') as f:
+        for pair in exchange_list:
+            if pair:
+                f.write(str(pair[0]) + " " + str(pair[1]))
+                f.write('\n')
+        if sandbox is not None:
+            f.write(sandbox)
+            f.write('\n')
+
+#-------------------------------------------------------------------------------
+#
+def read_pairs(path):
+    """Reads pairs_for_exchange_x_x.dat file written by write_pairs().
+
+    Args:
+        path - path to the file
+
+    Returns:
+        pairs - list with pairs of replica ids
+
+        sandbox - path written after pairs or None
+    """
+
+    pairs = []
+    sandbox = None
+    f = open(path)
+    for line in f:
+        data = line.split()
+        if len(data) == 2:
+            pairs.append([int(data[0]), int(data[1])])
+        elif len(data) == 1:
+            sandbox = data[0]
+    f.close()
+
+    return pairs, sandbox
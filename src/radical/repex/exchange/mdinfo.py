@@ -0,0 +1,300 @@
+"""
+.. module:: radical.repex.exchange.mdinfo
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import re
+import time
+import threading
+from collections import namedtuple
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+# energy terms of Amber .mdinfo (or .mdout) file, the last value of each term
+# in the file is used
+MdRecord = namedtuple('MdRecord', ['temp', 'eptot', 'eamber'])
+
+FIELD_PATTERNS = [
+    ('temp',   re.compile(r'TEMP\(K\)\s*=\s*(\S+)')),
+    ('eptot',  re.compile(r'EPtot\s*=\s*(\S+)')),
+    #this is the real potential energy without restraints!
+    ('eamber', re.compile(r'EAMBER \(non-restraint\)\s*=\s*(\S+)'))
+]
+
+BLOCK_SIZE  = 4096
+MAX_RECORDS = 1024
+
+# parsed records of this process, where key is absolute path to the file and
+# value is (stamp, record)
+_records = OrderedDict()
+_records_lock = threading.Lock()
+
+#-------------------------------------------------------------------------------
+#
+def replica_folder(replica_path=None):
+    """Returns path to directory where history files of a replica are located.
+
+    Args:
+        replica_path - path to replica directory in RP's staging_area, e.g.
+        "/replica_0/", if None current directory is used
+
+    Returns:
+        absolute path
+    """
+
+    if replica_path is None:
+        return os.getcwd()
+    return os.path.abspath("../staging_area" + replica_path)
+
+#-------------------------------------------------------------------------------
+#
+def _match_lines(lines, values):
+    # lines are matched from the last one, so the first match is the last 
+    # value of the term in the file
+    for line in reversed(lines.splitlines()):
+        for key, pattern in FIELD_PATTERNS:
+            if key not in values:
+                m = pattern.search(line)
+                if m:
+                    values[key] = float(m.group(1))
+
+#-------------------------------------------------------------------------------
+#
+def parse_mdinfo(path):
+    """Reads energy terms from Amber .mdinfo or .mdout file. File is read
+    backwards block by block, until all terms are found, so for .mdout files
+    usually only the last block is read.
+
+    Args:
+        path - path to the file
+
+    Returns:
+        MdRecord, terms which are not present in the file are set to 0.0
+    """
+
+    values = {}
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        rest = ''
+        while (pos > 0) and (len(values) < len(FIELD_PATTERNS)):
+            start = max(0, pos - BLOCK_SIZE)
+            f.seek(start)
+            buf = f.read(pos - start) + rest
+            pos = start
+            if start > 0:
+                # first line of the block may be incomplete, it is matched 
+                # together with the next block
+                nl = buf.find('\n')
+                if nl < 0:
+                    rest = buf
+                    continue
+                rest = buf[:nl]
+                buf = buf[nl+1:]
+            _match_lines(buf, values)
+
+    return MdRecord(values.get('temp', 0.0), 
+                    values.get('eptot', 0.0), 
+                    values.get('eamber', 0.0))
+
+#-------------------------------------------------------------------------------
+#
+def read_mdinfo(path):
+    """Returns parsed record of a given .mdinfo file. Records are cached in 
+    this process, so file which did not change since it was parsed is not 
+    read again.
+
+    Args:
+        path - path to the file
+
+    Returns:
+        MdRecord
+    """
+
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+
+    with _records_lock:
+        entry = _records.pop(path, None)
+    if (entry is not None) and (entry[0] == stamp):
+        record = entry[1]
+    else:
+        record = parse_mdinfo(path)
+
+    with _records_lock:
+        _records[path] = (stamp, record)
+        while len(_records) > MAX_RECORDS:
+            _records.popitem(last=False)
+
+    return record
+
+#-------------------------------------------------------------------------------
+#
+def get_historical_data(history_name, replica_path=None):
+    """Reads temperature and energies from a given Amber .mdinfo file.
+
+    Args:
+        history_name - name of .mdinfo file
+
+        replica_path - path to replica directory in RP's staging_area
+
+    Returns:
+        dictionary with keys:
+        'temp' - temperature
+
+        'eptot' - potential energy
+
+        'eamber' - potential energy without restraints (if present in file)
+
+        'path' - path to folder where .mdinfo file resides
+    """
+
+    folder = replica_folder(replica_path)
+
+    data = read_mdinfo(os.path.join(folder, history_name))._asdict()
+    data['path'] = folder
+
+    return data
+
+#-------------------------------------------------------------------------------
+#
+def _try_historical_data(args):
+    try:
+        return get_historical_data(*args)
+    except (IOError, OSError, ValueError):
+        return None
+
+#-------------------------------------------------------------------------------
+#
+def prefetch_historical_data(history_names, replica_paths=None, workers=8):
+    """Reads given .mdinfo files concurrently with a pool of threads. Parsed
+    records are cached, so following calls to get_historical_data() for 
+    these files do not read them again.
+
+    Args:
+        history_names - list of names of .mdinfo files
+
+        replica_paths - list of paths to replica directories in RP's 
+        staging_area, if None current directory is used for all files
+
+        workers - number of threads
+
+    Returns:
+        list of dictionaries, as returned by get_historical_data(), None for
+        files which could not be read
+    """
+
+    if replica_paths is None:
+        replica_paths = [None] * len(history_names)
+    args = zip(history_names, replica_paths)
+    if len(args) < 2:
+        return [_try_historical_data(a) for a in args]
+
+    pool = ThreadPool(min(workers, len(args)))
+    try:
+        return pool.map(_try_historical_data, args)
+    finally:
+        pool.close()
+        pool.join()
+
+#-------------------------------------------------------------------------------
+#
+def wait_for_history(read, args, attempts=3, delay=1):
+    """Reads history file of a replica, retrying while it is not available. 
+    If MD run of replica failed, the file never appears, so after a given 
+    number of attempts we give up instead of waiting forever. Ranks of MPI 
+    calculators must still reach collective calls.
+
+    Args:
+        read - function reading the file, e.g. get_historical_data()
+
+        args - list of arguments of read
+
+        attempts - number of attempts
+
+        delay - number of seconds between attempts
+
+    Returns:
+        value returned by read or None if file could not be read
+    """
+
+    for attempt in range(attempts):
+        try:
+            return read(*args)
+        except (IOError, OSError, ValueError, IndexError):
+            if attempt < attempts - 1:
+                time.sleep(delay)
+    return None
+
+#-------------------------------------------------------------------------------
+#
+def get_namd_historical_data(history_name, replica_path=None):
+    """Reads temperature and potential energy from a given NAMD .history file,
+    generated by RepEx NAMD input template.
+
+    Args:
+        history_name - name of .history file
+
+        replica_path - path to replica directory in RP's staging_area
+
+    Returns:
+        temp - temperature
+
+        eptot - potential energy
+
+        path_to_replica_folder - path to folder where .history file resides
+    """
+
+    folder = replica_folder(replica_path)
+
+    f = open(os.path.join(folder, history_name))
+    lines = f.readlines()
+    f.close()
+    data = lines[0].split()
+
+    return float(data[0]), float(data[1]), folder
+
+#-------------------------------------------------------------------------------
+#
+def read_remlog(path, column=6):
+    """Reads final parameters of replicas from remlog file written by Amber 
+    in native replica exchange mode (-rem 1). Each exchange is a block which
+    starts with '# exchange' line and has a line per replica: Replica#, 
+    Neighbor#, Velocity Scaling, T, Eptot, Temp0, NewTemp0, ...
+
+    Args:
+        path - path to remlog file
+
+        column - index of column with new parameter (NewTemp0)
+
+    Returns:
+        list of new parameters ordered by Replica# (groupfile line) of the 
+        last complete exchange or None if there is no complete exchange
+    """
+
+    blocks = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('#'):
+                if line[1:].split()[:1] == ['exchange']:
+                    blocks.append({})
+                continue
+            data = line.split()
+            if (len(blocks) == 0) or (len(data) <= column):
+                continue
+            try:
+                blocks[-1][int(data[0])] = float(data[column])
+            except ValueError:
+                continue
+
+    # the last block may be incomplete if Amber was interrupted
+    size = max([len(b) for b in blocks] + [0])
+    for block in reversed(blocks):
+        if (size > 0) and (sorted(block.keys()) == range(1, size+1)):
+            return [block[k] for k in range(1, size+1)]
+    return None
@@ -0,0 +1,129 @@
+"""
+.. module:: radical.repex.exchange.replica
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+from collections import OrderedDict
+
+#-------------------------------------------------------------------------------
+#
+class Replica(object):
+    """Holds data associated with a given replica, which is needed by RAMs to
+    perform exchange. Not to be confused with replicas.replica.Replica which is
+    used by AMMs.
+    """
+
+    def __init__(self,
+                 my_id,
+                 d1_param=0.0,
+                 d2_param=0.0,
+                 d3_param=0.0,
+                 d1_type = None,
+                 d2_type = None,
+                 d3_type = None,
+                 new_restraints=None):
+
+        self.id = int(my_id)
+        self.sid = int(my_id)
+
+        self.d1_param = d1_param
+        self.d2_param = d2_param
+        self.d3_param = d3_param
+
+        self.d1_type = d1_type
+        self.d2_type = d2_type
+        self.d3_type = d3_type
+
+        if new_restraints is None:
+            self.new_restraints = ''
+        else:
+            self.new_restraints = new_restraints
+        self.potential_1 = 0
+
+    def param(self, dim_int):
+        """Returns parameter of this replica in a given dimension.
+        """
+        return getattr(self, 'd%d_param' % dim_int)
+
+#-------------------------------------------------------------------------------
+#
+def create_replica(rid, dim_types, params, new_restraints=None):
+    """Creates a replica object for 1D, 2D or 3D simulation.
+
+    Args:
+        rid - replica id
+
+        dim_types - list of dimension types, first item is '' so that index
+        of item equals to dimension index
+
+        params - list of parameters, indexed same as dim_types
+
+        new_restraints - name of restraint file of this replica
+
+    Returns:
+        Replica object
+    """
+
+    nr_dims = len(dim_types) - 1
+    kwargs = {}
+    for d in range(1, nr_dims+1):
+        kwargs['d%d_param' % d] = params[d]
+        kwargs['d%d_type' % d] = dim_types[d]
+
+    return Replica(rid, new_restraints=new_restraints, **kwargs)
+
+#-------------------------------------------------------------------------------
+#
+def group_replicas(replicas, dimension, nr_dims):
+    """Splits replicas into groups for exchange in a given dimension. Replicas
+    are in the same group if their parameters are equal in all other
+    dimensions.
+
+    Args:
+        replicas - list of Replica objects
+
+        dimension - index of current dimension
+
+        nr_dims - number of dimensions
+
+    Returns:
+        list of groups, each group is a list of Replica objects
+    """
+
+    groups = OrderedDict()
+    for r in replicas:
+        key = tuple([r.param(d) for d in range(1, nr_dims+1) if d != dimension])
+        groups.setdefault(key, []).append(r)
+
+    return groups.values()
+
+#-------------------------------------------------------------------------------
+#
+def parse_rstr_vals(rstr_path):
+    """Reads values of r2 parameter from a given restraint file, one value per
+    restraint entry.
+
+    contents of rts file:
+    umbrella sampling restraints on phi/psi torsions
+     &rst iat=49,55,57,59 r1=30.0 r2=120.0 r3=120.0 r4=210.0 rk2=100 rk3=100 /
+
+    Args:
+        rstr_path - path to restraint file
+
+    Returns:
+        list of r2 values
+    """
+
+    r_file = open(rstr_path, "r")
+    tbuffer = r_file.read()
+    r_file.close()
+
+    rstr_vals = []
+    for word in tbuffer.split():
+        if word.startswith("r2="):
+            rstr_vals.append( float(word.split('=')[1]) )
+
+    return rstr_vals
@@ -0,0 +1,162 @@
+"""
+.. module:: radical.repex.exchange.restraint_cache
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+from exchange.restraints import read_rstr_entries
+from exchange.restraints import parse_rstr_entries
+from exchange.restraints import RestraintSet
+from exchange.matrix_io import staging_area
+
+CACHE_DIR = "restraint_cache"
+
+#-------------------------------------------------------------------------------
+
+class RestraintCache(object):
+    """Cache of parsed restraint files. Restraint files change only when
+    window of a replica changes, so parsed restraints are kept in memory of
+    this process and in cache_dir on disk, which is shared by all CUs.
+    Entry is valid as long as SHA1 digest of content of restraint file is the
+    same as when it was parsed, so a file rewritten with the same size within
+    resolution of modification time is parsed again. Both caches are bounded,
+    least recently used entries are evicted first.
+
+    Attributes:
+        maxsize - max number of entries kept in memory
+
+        cache_dir - directory for on-disk entries, if None only memory is used
+
+        max_files - max number of entries in cache_dir
+
+        entries - ordered dictionary where key is absolute path to restraint
+        file and value is (digest, parsed restraints)
+    """
+
+    def __init__(self, maxsize=256, cache_dir=None, max_files=1024):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.entries = OrderedDict()
+
+    def _digest(self, path):
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _disk_name(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(path).hexdigest() + ".pkl")
+
+    def _load(self, path, stamp):
+        try:
+            name = self._disk_name(path)
+            with open(name, 'rb') as f:
+                d_path, d_stamp, parsed = pickle.load(f)
+            if (d_path != path) or (d_stamp != stamp):
+                return None
+            # modification time of entry is used for eviction
+            os.utime(name, None)
+            return parsed
+        except Exception:
+            return None
+
+    def _store(self, path, stamp, parsed):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+        except OSError:
+            # created by other CU
+            if not os.path.isdir(self.cache_dir):
+                return
+
+        name = self._disk_name(path)
+        tmp_name = "%s.%d.tmp" % (name, os.getpid())
+        try:
+            with open(tmp_name, 'wb') as f:
+                pickle.dump((path, stamp, parsed), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_name, name)
+            self._evict_files()
+        except (IOError, OSError):
+            print "Warning: unable to write restraint cache entry for {0}".format(path)
+
+    def _evict_files(self):
+        names = [n for n in os.listdir(self.cache_dir) if n.endswith(".pkl")]
+        if len(names) <= self.max_files:
+            return
+        aged = []
+        for n in names:
+            try:
+                aged.append((os.path.getmtime(os.path.join(self.cache_dir, n)), n))
+            except OSError:
+                # removed by other CU
+                pass
+        aged.sort()
+        for mtime, n in aged[:len(aged)-self.max_files]:
+            try:
+                os.remove(os.path.join(self.cache_dir, n))
+            except OSError:
+                pass
+
+    def get(self, rstr_path):
+        """Returns parsed restraints of a given restraint file. Restraint file
+        is read and parsed only if it is not in cache or has changed.
+
+        Args:
+            rstr_path - path to restraint file
+
+        Returns:
+            list of parsed restraints, as returned by parse_rstr_entries()
+        """
+
+        path = os.path.abspath(rstr_path)
+        stamp = self._digest(path)
+
+        entry = self.entries.pop(path, None)
+        if (entry is not None) and (entry[0] == stamp):
+            parsed = entry[1]
+        else:
+            parsed = None
+            if self.cache_dir is not None:
+                parsed = self._load(path, stamp)
+            if parsed is None:
+                parsed = parse_rstr_entries(read_rstr_entries(path))
+                if self.cache_dir is not None:
+                    self._store(path, stamp, parsed)
+
+        self.entries[path] = (stamp, parsed)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return parsed
+
+    def restraint_set(self, rstr_paths):
+        """Returns RestraintSet with restraints of given restraint files.
+
+        Args:
+            rstr_paths - list of paths to restraint files
+
+        Returns:
+            RestraintSet object
+        """
+
+        return RestraintSet(parsed_list=[self.get(p) for p in rstr_paths])
+
+#-------------------------------------------------------------------------------
+
+_cache = None
+
+def restraint_cache():
+    """Returns restraint cache of this process, on-disk entries are kept in
+    restraint_cache directory in staging_area. Assumes that we are in CU
+    sandbox.
+    """
+
+    global _cache
+    if _cache is None:
+        _cache = RestraintCache(cache_dir=staging_area(CACHE_DIR))
+    return _cache
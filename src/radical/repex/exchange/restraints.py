@@ -0,0 +1,379 @@
+"""
+.. module:: radical.repex.exchange.restraints
+.. moduleauthor::  <antons.treikalis@gmail.com>
+.. moduleauthor::  <haoyuan.chen@rutgers.edu>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import re
+import math
+import numpy as np
+
+# restraint type codes
+BOND     = 0
+ANGLE    = 1
+DIHEDRAL = 2
+GENCRD   = 3
+
+# conversion of force constants of angle and dihedral restraints to degrees
+DEG2 = (180.0/math.pi)**2
+
+# Amber ASCII restart: six coordinates of width 12 and a newline per line
+CRD_FIELD = 12
+CRD_LINE  = 6*CRD_FIELD + 1
+
+#-------------------------------------------------------------------------------
+#
+def parse_rstr_entry(rstr_entry):
+    """Parses a single &rst entry of restraint file.
+
+    Args:
+        rstr_entry - string with parameters of a single restraint
+
+    Returns:
+        dictionary where key is parameter name (iat, r1, ..., rstwt) and value
+        is a list of strings
+    """
+
+    # text between "key=" and the next "key=" is the value of that key
+    tokens = re.split(r'(\w+)\s*=', rstr_entry.replace('&end', ' ').replace('/', ' '))
+    fields = {}
+    for key, value in zip(tokens[1::2], tokens[2::2]):
+        fields[key.strip().lower()] = value.replace(',', ' ').split()
+
+    return fields
+
+#-------------------------------------------------------------------------------
+#
+def parse_rstr_entries(rstr_entries):
+    """Parses restraint entries of a single restraint file.
+
+    Args:
+        rstr_entries - list of restraint entries, as returned by
+        read_rstr_entries()
+
+    Returns:
+        list of parsed restraints, one per entry, each is a tuple of
+        type code, (one based) atom indexes, [r1, r2, r3, r4, rk2, rk3] and
+        rstwt weights
+    """
+
+    parsed = []
+    for rstr_entry in rstr_entries:
+        fields = parse_rstr_entry(rstr_entry)
+        iat = [int(a) for a in fields['iat']]
+        if len(iat) == 2:
+            r_type = BOND
+        elif len(iat) == 3:
+            r_type = ANGLE
+        elif 'rstwt' in fields:
+            r_type = GENCRD
+        else:
+            r_type = DIHEDRAL
+        bounds  = [float(fields[k][0]) for k in ['r1', 'r2', 'r3', 'r4', 'rk2', 'rk3']]
+        weights = [float(w) for w in fields.get('rstwt', [0.0, 0.0])[:2]]
+        parsed.append((r_type, iat, bounds, weights))
+
+    return parsed
+
+#-------------------------------------------------------------------------------
+
+class RestraintSet(object):
+    """Restraints of one or more restraint files parsed into flat arrays, one
+    item per restraint. Restraint energies of any number of configurations
+    are then calculated with energy_matrix() without parsing restraint files 
+    again.
+
+    Attributes:
+        size - number of restraint files (sets of restraint entries)
+
+        owner - array with index of set each restraint belongs to
+
+        types - array with restraint type codes (BOND, ANGLE, DIHEDRAL, GENCRD)
+
+        atom_ids - sorted array with (zero based) indexes of restrained atoms,
+        only coordinates of these atoms are needed
+
+        atoms - 2d array with indexes of four atoms of each restraint into
+        atom_ids, unused atoms are set to the first atom of the restraint
+
+        r1, r2, r3, r4 - arrays with flat-bottom well boundaries
+
+        rk2, rk3 - arrays with force constants, converted to degrees for angle
+        and dihedral restraints
+
+        weights - 2d array with rstwt weights of generalized coordinate 
+        restraints
+    """
+
+    def __init__(self, rstr_entries_list=None, parsed_list=None):
+        """
+        Args:
+            rstr_entries_list - list of lists of restraint entries, as returned
+            by read_rstr_entries()
+
+            parsed_list - list of lists of parsed restraints, as returned by
+            parse_rstr_entries(), used instead of rstr_entries_list
+        """
+
+        if parsed_list is None:
+            parsed_list = [parse_rstr_entries(e) for e in rstr_entries_list]
+        self.size = len(parsed_list)
+
+        owner = []; types = []; atoms = []; bounds = []; weights = []
+        for i, parsed in enumerate(parsed_list):
+            for r_type, iat, r_bounds, r_weights in parsed:
+                owner.append(i)
+                types.append(r_type)
+                atoms.append([a-1 for a in iat] + [iat[0]-1]*(4-len(iat)))
+                bounds.append(r_bounds)
+                weights.append(r_weights)
+
+        self.owner   = np.array(owner, dtype=int)
+        self.types   = np.array(types, dtype=int)
+        self.weights = np.array(weights, dtype=np.float64).reshape(-1, 2)
+
+        atoms = np.array(atoms, dtype=int).reshape(-1, 4)
+        self.atom_ids, inverse = np.unique(atoms, return_inverse=True)
+        self.atoms = inverse.reshape(atoms.shape)
+
+        bounds = np.array(bounds, dtype=np.float64).reshape(-1, 6)
+        self.r1, self.r2, self.r3, self.r4, self.rk2, self.rk3 = bounds.T.copy()
+
+        angular = (self.types == ANGLE) | (self.types == DIHEDRAL)
+        self.rk2[angular] /= DEG2
+        self.rk3[angular] /= DEG2
+
+#-------------------------------------------------------------------------------
+#
+def read_coordinates(crd_file):
+    """Reads atom coordinates from Amber ASCII restart (.rst) file.
+
+    Args:
+        crd_file - name of coordinates file
+
+    Returns:
+        natoms x 3 NumPy array
+    """
+
+    with open(crd_file, 'r') as crd:
+        crd.readline()
+        natoms = int(crd.readline().split()[0])
+        # coordinates are written in fields of width 12, six per line
+        values = []
+        for k in range((natoms+1)/2):
+            line = crd.readline().rstrip('\n')
+            values.extend([float(line[f:f+12]) for f in range(0, len(line), 12)])
+
+    if len(values) < natoms*3:
+        raise IOError("File %s is truncated" % crd_file)
+
+    return np.array(values[:natoms*3], dtype=np.float64).reshape(natoms, 3)
+
+#-------------------------------------------------------------------------------
+#
+def read_atom_coordinates(crd_file, atom_ids):
+    """Reads coordinates of given atoms from Amber ASCII restart (.rst or 
+    .inpcrd) file. Coordinate lines have fixed width, so we seek directly to
+    the record of each atom instead of reading the whole file. If file does 
+    not have the expected layout (e.g. has a single atom or Windows line 
+    endings), the whole file is read instead.
+
+    Args:
+        crd_file - name of coordinates file
+
+        atom_ids - zero based indexes of atoms
+
+    Returns:
+        len(atom_ids) x 3 NumPy array
+    """
+
+    atom_ids = np.asarray(atom_ids, dtype=int)
+    crds = np.empty((len(atom_ids), 3), dtype=np.float64)
+
+    with open(crd_file, 'rb') as crd:
+        crd.readline()
+        natoms = int(crd.readline().split()[0])
+        start = crd.tell()
+        if len(crd.readline()) != CRD_LINE:
+            return read_coordinates(crd_file)[atom_ids]
+        if len(atom_ids) and atom_ids.max() >= natoms:
+            raise IOError("File %s has only %d atoms" % (crd_file, natoms))
+
+        # two atoms per line
+        for k, atom in enumerate(atom_ids):
+            crd.seek(start + (atom/2)*CRD_LINE + (atom%2)*3*CRD_FIELD)
+            record = crd.read(3*CRD_FIELD)
+            if len(record) < 3*CRD_FIELD:
+                raise IOError("File %s is truncated" % crd_file)
+            crds[k] = [float(record[f:f+CRD_FIELD]) for f in range(0, 3*CRD_FIELD, CRD_FIELD)]
+
+    return crds
+
+#-------------------------------------------------------------------------------
+#
+def _norm(v):
+    return np.sqrt((v*v).sum(axis=-1))
+
+#-------------------------------------------------------------------------------
+#
+def _angle(x1, x2, x3):
+    v1 = x1 - x2
+    v2 = x3 - x2
+    c = (v1*v2).sum(axis=-1) / _norm(v1) / _norm(v2)
+    return np.degrees(np.arccos(np.clip(c, -1.0, 1.0)))
+
+#-------------------------------------------------------------------------------
+#
+def _dihedral(x1, x2, x3, x4):
+    v21 = x2 - x1
+    v32 = x3 - x2
+    v43 = x4 - x3
+    n1 = np.cross(v21, v32)
+    n2 = np.cross(v32, v43)
+    c = (n1*n2).sum(axis=-1) / _norm(n1) / _norm(n2)
+    dih = np.degrees(np.arccos(np.clip(c, -1.0, 1.0)))
+    det = (n1*v43).sum(axis=-1)
+    return np.where(det >= 0.0, dih, 360.0-dih)
+
+#-------------------------------------------------------------------------------
+#
+def energy_matrix(coordinates, restraint_set):
+    """Calculates flat-bottom Amber restraint energies (see page 414 in amber 
+    14 manual) of each configuration evaluated with each set of restraints.
+    All restraints are evaluated for all configurations at once.
+
+    Args:
+        coordinates - list of arrays (or a 3d array) with coordinates of 
+        restrained atoms (restraint_set.atom_ids) of C configurations, as 
+        returned by read_atom_coordinates()
+
+        restraint_set - RestraintSet object with S sets of restraints
+
+    Returns:
+        C x S NumPy array with restraint energies
+    """
+
+    crds = np.asarray(coordinates, dtype=np.float64)
+    rs = restraint_set
+
+    # C x R x 4 x 3 coordinates of atoms of every restraint
+    x = crds[:, rs.atoms]
+    r = np.zeros(x.shape[:2])
+
+    for r_type in [BOND, ANGLE, DIHEDRAL, GENCRD]:
+        m = (rs.types == r_type)
+        if not m.any():
+            continue
+        xm = x[:, m]
+        if r_type == BOND:
+            r[:, m] = _norm(xm[:,:,0] - xm[:,:,1])
+        elif r_type == ANGLE:
+            r[:, m] = _angle(xm[:,:,0], xm[:,:,1], xm[:,:,2])
+        elif r_type == DIHEDRAL:
+            d = _dihedral(xm[:,:,0], xm[:,:,1], xm[:,:,2], xm[:,:,3])
+            # dihedral is shifted by 360 degrees towards r2, assuming r2=r3
+            r2 = rs.r2[m]
+            d = np.where(np.abs(d-360.0-r2) < np.abs(d-r2), d-360.0, 
+                         np.where(np.abs(d+360.0-r2) < np.abs(d-r2), d+360.0, d))
+            r[:, m] = d
+        elif r_type == GENCRD:
+            w = rs.weights[m]
+            r[:, m] = w[:,0]*_norm(xm[:,:,0] - xm[:,:,1]) + \
+                      w[:,1]*_norm(xm[:,:,2] - xm[:,:,3])
+
+    r1, r2, r3, r4, rk2, rk3 = rs.r1, rs.r2, rs.r3, rs.r4, rs.rk2, rs.rk3
+    energy = np.select([r < r1,
+                        r < r2,
+                        r <= r3,
+                        r <= r4],
+                       [rk2*(r1-r2)**2 - 2.0*rk2*(r1-r2)*(r-r1),
+                        rk2*(r-r2)**2,
+                        0.0,
+                        rk3*(r-r3)**2],
+                       rk3*(r4-r3)**2 - 2.0*rk3*(r4-r3)*(r-r4))
+
+    # summing restraint energies of each set
+    owners = np.zeros((len(rs.owner), rs.size))
+    owners[np.arange(len(rs.owner)), rs.owner] = 1.0
+
+    return energy.dot(owners)
+
+#-------------------------------------------------------------------------------
+#
+def read_rstr_entries(rstr_path):
+    """Reads restraint file and splits it into &rst entries.
+
+    Args:
+        rstr_path - path to restraint file
+
+    Returns:
+        list of strings, one per restraint entry
+    """
+
+    rstr_file = open(rstr_path,'r')
+    rstr_lines = rstr_file.readlines()
+    rstr_file.close()
+
+    return ''.join(rstr_lines).split('&rst')[1:]
+
+#-------------------------------------------------------------------------------
+#
+def set_energies(crd_file, restraint_set):
+    """Calculates restraint energies of a single configuration evaluated with
+    each set of restraints of a given restraint set. Only coordinates of 
+    restrained atoms are read.
+
+    Args:
+        crd_file - name of coordinates (.rst) file
+
+        restraint_set - RestraintSet object
+
+    Returns:
+        list of restraint energies, one per set of restraints
+    """
+
+    crds = read_atom_coordinates(crd_file, restraint_set.atom_ids)
+    return energy_matrix([crds], restraint_set)[0].tolist()
+
+#-------------------------------------------------------------------------------
+#
+def entries_energies(crd_file, rstr_entries_list):
+    """Calculates restraint energies of a single configuration evaluated with
+    each of given sets of restraint entries.
+
+    Args:
+        crd_file - name of coordinates (.rst) file
+
+        rstr_entries_list - list of lists of restraint entries, as returned by
+        read_rstr_entries()
+
+    Returns:
+        list of restraint energies, one per set of restraint entries
+    """
+
+    return set_energies(crd_file, RestraintSet(rstr_entries_list))
+
+#-------------------------------------------------------------------------------
+#
+def restraint_energies(crd_file, rstr_paths, cache=None):
+    """Calculates restraint energies of a single configuration evaluated with
+    restraints from each of given restraint files.
+
+    Args:
+        crd_file - name of coordinates (.rst) file
+
+        rstr_paths - list of paths to restraint files
+
+        cache - RestraintCache object, restraint files which did not change
+        since they were parsed are not read again
+
+    Returns:
+        list of restraint energies, one per restraint file
+    """
+
+    if cache is not None:
+        return set_energies(crd_file, cache.restraint_set(rstr_paths))
+    return entries_energies(crd_file, [read_rstr_entries(p) for p in rstr_paths])
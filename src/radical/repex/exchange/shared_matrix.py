@@ -0,0 +1,237 @@
+"""
+.. module:: radical.repex.exchange.shared_matrix
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import re
+import time
+import fcntl
+import numpy as np
+
+# swap_matrix_x.dat file is a single file in staging_area, shared by all
+# matrix calculators of a given cycle:
+#   magic string (8 bytes)
+#   header: number of replicas, width of info record (2 x int64)
+#   completion bitmap: one byte per replica, set when column is written
+#   info records: data associated with each replica, fixed width text
+#   swap matrix: float64 N x N, stored transposed, so that column of
+#   replica rid is a contiguous row at offset rid
+MATRIX_MAGIC = b'REPEXSM1'
+HEADER_SIZE  = 24
+INFO_WIDTH   = 256
+
+#-------------------------------------------------------------------------------
+#
+def shared_matrix_name(cycle):
+    """Returns name of shared swap matrix file for a given cycle.
+    """
+
+    return "swap_matrix_{cycle}.dat".format(cycle=cycle)
+
+#-------------------------------------------------------------------------------
+#
+def _align(size):
+    return (size + 7) // 8 * 8
+
+#-------------------------------------------------------------------------------
+#
+def layout(replicas, info_width=INFO_WIDTH):
+    """Returns offsets of sections of shared swap matrix file.
+
+    Args:
+        replicas - number of replicas
+
+        info_width - width of info record in bytes
+
+    Returns:
+        bitmap_offset, info_offset, matrix_offset, file_size
+    """
+
+    bitmap_offset = HEADER_SIZE
+    info_offset   = _align(bitmap_offset + replicas)
+    matrix_offset = _align(info_offset + replicas * info_width)
+    file_size     = matrix_offset + replicas * replicas * 8
+
+    return bitmap_offset, info_offset, matrix_offset, file_size
+
+#-------------------------------------------------------------------------------
+#
+def write_shared_column(path, replicas, rid, column, info, info_width=INFO_WIDTH):
+    """Writes column of swap matrix of a given replica to shared swap matrix
+    file. First writer preallocates the file, file is locked while header is
+    checked. Column and info record are written before completion flag of
+    this replica is set.
+
+    Args:
+        path - path to shared swap matrix file
+
+        replicas - number of replicas
+
+        rid - replica id (index of column)
+
+        column - list of reduced energies
+
+        info - list of replica data, first item is replica id
+    """
+
+    bitmap_offset, info_offset, matrix_offset, file_size = layout(replicas, info_width)
+
+    column = np.ascontiguousarray(column, dtype=np.float64)
+    if len(column) != replicas:
+        raise ValueError("Column of replica %s has wrong length" % rid)
+
+    record = " ".join([str(item) for item in info]).encode('utf-8')
+    if len(record) > info_width:
+        raise ValueError("Info of replica %s does not fit into record" % rid)
+    record = record.ljust(info_width, b' ')
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, 'r+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            # file is extended before header is written, so readers never
+            # map a file which is too short
+            f.truncate(file_size)
+            header = np.array([replicas, info_width], dtype=np.int64)
+            f.seek(0)
+            f.write(MATRIX_MAGIC)
+            f.write(header.tobytes())
+            f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+        f.seek(matrix_offset + rid * replicas * 8)
+        f.write(column.tobytes())
+        f.seek(info_offset + rid * info_width)
+        f.write(record)
+        f.flush()
+        os.fsync(f.fileno())
+
+        f.seek(bitmap_offset + rid)
+        f.write(b'\x01')
+        f.flush()
+
+#-------------------------------------------------------------------------------
+#
+def read_shared_matrix(path, replicas, replica_ids, attempts=10, delay=1):
+    """Reads shared swap matrix file. Waits until columns of all given replicas
+    are written or given number of retries is exhausted.
+
+    Args:
+        path - path to shared swap matrix file
+
+        replicas - number of replicas
+
+        replica_ids - ids of replicas, columns of which we need
+
+        attempts - number of retries
+
+        delay - time between retries in seconds
+
+    Returns:
+        swap_matrix - read-only N x N NumPy array, a view of memory-mapped
+        file
+
+        infos - dictionary where key is replica id and value is a list of
+        strings with replica data, only replicas with written columns are
+        included
+
+        or None if file is not available
+    """
+
+    ids = np.array([int(i) for i in replica_ids], dtype=int)
+
+    attempt = 0
+    while True:
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(MATRIX_MAGIC)) != MATRIX_MAGIC:
+                    raise ValueError("Not a swap matrix file %s" % path)
+                header = np.fromfile(f, dtype=np.int64, count=2)
+                if (len(header) != 2) or (int(header[0]) != replicas):
+                    raise ValueError("Wrong number of replicas in file %s" % path)
+                info_width = int(header[1])
+            bitmap_offset, info_offset, matrix_offset, file_size = layout(replicas, info_width)
+
+            data = np.memmap(path, dtype=np.uint8, mode='r', shape=(file_size,))
+            ready = data[bitmap_offset:bitmap_offset+replicas]
+            if ready[ids].all() or attempt >= attempts:
+                matrix = np.memmap(path,
+                                   dtype=np.float64,
+                                   mode='r',
+                                   offset=matrix_offset,
+                                   shape=(replicas, replicas))
+                infos = {}
+                for rid in ids[ready[ids] == 1]:
+                    start = info_offset + rid * info_width
+                    record = data[start:start+info_width].tobytes()
+                    infos[int(rid)] = record.decode('utf-8').split()
+                return matrix.T, infos
+            print "Waiting for columns: %s" % list(ids[ready[ids] == 0])
+        except (IOError, ValueError):
+            if attempt >= attempts:
+                return None
+            print "Waiting for file: %s" % path
+        time.sleep(delay)
+        attempt += 1
+
+#-------------------------------------------------------------------------------
+#
+def release_shared_columns(path, replicas, replica_ids):
+    """Clears completion flags of given replicas in shared swap matrix file,
+    after their columns were used for exchange. Columns of other replicas
+    (which may be written at this moment) are not touched, file is not
+    removed.
+
+    Args:
+        path - path to shared swap matrix file
+
+        replicas - number of replicas
+
+        replica_ids - ids of replicas, columns of which were used
+    """
+
+    with open(path, 'r+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(len(MATRIX_MAGIC))
+            header = np.fromfile(f, dtype=np.int64, count=2)
+            bitmap_offset, info_offset, matrix_offset, file_size = layout(replicas, int(header[1]))
+            for rid in replica_ids:
+                f.seek(bitmap_offset + int(rid))
+                f.write(b'\x00')
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+#-------------------------------------------------------------------------------
+#
+def remove_stale_matrices(folder, before_cycle):
+    """Removes shared swap matrix files of cycles before a given cycle. 
+    Should be called only with a cycle, before which no replica can write 
+    or read swap matrix columns anymore.
+
+    Args:
+        folder - path to directory with shared swap matrix files
+
+        before_cycle - files of cycles smaller than this are removed
+
+    Returns:
+        list of removed files
+    """
+
+    removed = []
+    pattern = re.compile(r'^swap_matrix_(\d+)\.dat$')
+    for name in os.listdir(folder):
+        match = pattern.match(name)
+        if (match is not None) and (int(match.group(1)) < before_cycle):
+            try:
+                os.remove(os.path.join(folder, name))
+                removed.append(name)
+            except OSError:
+                pass
+    return removed
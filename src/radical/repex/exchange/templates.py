@@ -0,0 +1,193 @@
+"""
+.. module:: radical.repex.exchange.templates
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import re
+
+# placeholders used in Amber input (.mdin) and restraint (.RST) templates,
+# other @...@ strings are left as they are
+PLACEHOLDERS = ['nstlim', 'disang', 'temp', 'irest', 'ntx', 'salt',
+                'val1', 'val1l', 'val1h', 'val2', 'val2l', 'val2h']
+
+#-------------------------------------------------------------------------------
+
+class Template(object):
+    """Template compiled into literal segments and placeholders. Rendering
+    joins segments with values of placeholders, so template text is scanned
+    only once.
+
+    Attributes:
+        segments - list of literal strings, one more than placeholders
+
+        names - list of names of placeholders between segments
+    """
+
+    def __init__(self, text, placeholders=PLACEHOLDERS):
+        # longer names first, so that @val1l@ is not matched as @val1@
+        names = sorted(placeholders, key=len, reverse=True)
+        pattern = re.compile('@(' + '|'.join([re.escape(n) for n in names]) + ')@')
+        parts = pattern.split(text)
+        self.segments = parts[0::2]
+        self.names = parts[1::2]
+
+    def render(self, values):
+        """Returns template text with placeholders replaced by given values.
+        Placeholders which are not in values are left unchanged.
+
+        Args:
+            values - dictionary where key is name of placeholder
+
+        Returns:
+            string
+        """
+
+        out = [self.segments[0]]
+        for name, segment in zip(self.names, self.segments[1:]):
+            if name in values:
+                out.append(str(values[name]))
+            else:
+                out.append('@' + name + '@')
+            out.append(segment)
+        return ''.join(out)
+
+#-------------------------------------------------------------------------------
+
+_templates = {}
+
+def load_template(path):
+    """Returns compiled template of a given file. Compiled templates are kept
+    in memory of this process while file is not modified.
+
+    Args:
+        path - path to template file
+
+    Returns:
+        Template object
+    """
+
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+    entry = _templates.get(path)
+    if (entry is None) or (entry[0] != stamp):
+        with open(path, 'r') as f:
+            entry = (stamp, Template(f.read()))
+        _templates[path] = entry
+    return entry[1]
+
+#-------------------------------------------------------------------------------
+#
+def mdin_values(nstlim, temp, first_cycle, disang=None, salt=None):
+    """Returns values of placeholders of Amber input template.
+
+    Args:
+        nstlim - number of MD steps
+
+        temp - temperature
+
+        first_cycle - True if MD starts from initial coordinates
+
+        disang - name of restraint file or None
+
+        salt - salt concentration or None
+
+    Returns:
+        dictionary
+    """
+
+    values = {'nstlim': nstlim, 'temp': temp}
+    if first_cycle:
+        values['irest'] = '0'
+        values['ntx'] = '1'
+    else:
+        values['irest'] = '1'
+        values['ntx'] = '5'
+    if disang is not None:
+        values['disang'] = disang
+    if salt is not None:
+        values['salt'] = salt
+    return values
+
+#-------------------------------------------------------------------------------
+#
+def rstr_values(rstr_vals):
+    """Returns values of placeholders of restraint template for given values
+    of umbrella dimensions (one or two).
+    """
+
+    values = {}
+    for i, val in enumerate(rstr_vals):
+        n = str(i+1)
+        values['val' + n] = str(val)
+        values['val' + n + 'l'] = str(val-90)
+        values['val' + n + 'h'] = str(val+90)
+    return values
+
+#-------------------------------------------------------------------------------
+#
+def write_if_changed(path, content):
+    """Writes content to a given file, unless file already has exactly this
+    content.
+
+    Returns:
+        True if file was written
+    """
+
+    try:
+        if os.path.getsize(path) == len(content):
+            with open(path, 'rb') as f:
+                if f.read() == content:
+                    return False
+    except (IOError, OSError):
+        pass
+
+    with open(path, 'wb') as f:
+        f.write(content)
+    return True
+
+#-------------------------------------------------------------------------------
+#
+def render_file(template_path, path, values):
+    """Renders a given template to a file, file is not written if it already
+    has the rendered content.
+
+    Args:
+        template_path - path to template file
+
+        path - path to output file
+
+        values - dictionary with values of placeholders
+
+    Returns:
+        True if file was written
+    """
+
+    return write_if_changed(path, load_template(template_path).render(values))
+
+#-------------------------------------------------------------------------------
+#
+def set_cntrl(text, name, value):
+    """Returns Amber input with a given variable added to &cntrl namelist,
+    unless this variable is already set in the input.
+
+    Args:
+        text - content of Amber input
+
+        name - name of variable, e.g. numexchg
+
+        value - value of variable
+
+    Returns:
+        string
+    """
+
+    if re.search(r'\b' + re.escape(name) + r'\s*=', text, re.IGNORECASE):
+        return text
+    line = "  {0} = {1},\n".format(name, value)
+    return re.sub(r'(&cntrl[^\n]*\n)', lambda m: m.group(1) + line, text, 
+                  count=1, flags=re.IGNORECASE)
@@ -18,6 +18,9 @@ import radical.pilot as rp
 import radical.utils as ru
 from random import randint
 from kernels.kernels import KERNELS
+from repex_utils.runtime_model import RuntimeModel
+from repex_utils.calc_amber_execution_time import read_mdinfo
+from repex_utils import shared_staging
 
 #-------------------------------------------------------------------------------
 
@@ -55,6 +58,15 @@ class ExecutionManagementModule(object):
 
         self.cycletime = float(rconfig.get('cycletime', 10.0))
 
+        # if True, shared input files are transferred as a single archive,
+        # staging_cache is a directory on the target resource, where content
+        # of shared files is kept between simulations
+        if inp_file['remd.input'].get('archive_staging', 'False') == "True":
+            self.archive_staging = True
+        else:
+            self.archive_staging = False
+        self.staging_cache = rconfig.get('staging_cache')
+
         # check if was set in rconfig
         if self.dburl is None:
             # check if was set as environment variable
@@ -74,6 +86,9 @@ class ExecutionManagementModule(object):
         self.pilot_manager = None
         self.pilot_object = None
 
+        # predicts runtimes of MD and exchange units of replicas
+        self.runtime_model = RuntimeModel()
+
     #---------------------------------------------------------------------------
     #
     def launch_pilot(self):
@@ -149,3 +164,178 @@ class ExecutionManagementModule(object):
 
         self._prof.prof('launch_pilot_end')
 
+    #---------------------------------------------------------------------------
+    #
+    def observe_runtime(self, kind, replica, runtime, basename=None):
+        """Feeds runtime of a completed unit of a given replica to runtime
+        model. For MD units, if .mdinfo file of a replica was transferred to
+        the current directory, MD time is read from it.
+
+        Args:
+            kind - kind of unit, 'md' or 'ex'
+
+            replica - Replica object
+
+            runtime - runtime of a unit in seconds
+
+            basename - base name of simulation input files
+        """
+
+        md_time = None
+        if (kind == 'md') and (basename is not None):
+            name = replica.name(basename, replica.cycle-1) + ".mdinfo"
+            if os.path.isfile(name):
+                try:
+                    sim_speed, exec_time = read_mdinfo(name)
+                    if exec_time > 0.0:
+                        md_time = exec_time
+                except Exception:
+                    self.logger.info("Unable to read MD time from {0}".format(name))
+        self.runtime_model.observe(kind, replica, runtime, md_time)
+
+    #---------------------------------------------------------------------------
+    #
+    def check_exchange_agent(self, md_kernel, unit_manager, agent_cu):
+        """Resubmits exchange agent if it's unit is in a final state, so that
+        requests of global exchange calculators are not left without answer.
+        Should be called before request unit is submitted.
+
+        Args:
+            md_kernel - AMM object
+
+            unit_manager - RP's unit manager
+
+            agent_cu - unit of exchange agent or None
+
+        Returns:
+            unit of exchange agent or None
+        """
+
+        if agent_cu is None:
+            return None
+        if agent_cu.state in [rp.states.DONE, rp.states.FAILED, rp.states.CANCELED]:
+            self.logger.info("Exchange agent {0} is in state {1}, resubmitting".format(agent_cu.uid, agent_cu.state))
+            agent_cu = unit_manager.submit_units(md_kernel.prepare_exchange_agent(self.sd_shared_list))
+        return agent_cu
+
+    #---------------------------------------------------------------------------
+    #
+    def stage_shared_data(self, md_kernel, unit_manager):
+        """Transfers shared input files of AMM (shared_files and shared_urls)
+        to staging area of the pilot and populates sd_shared_list with data
+        directives for units. If archive_staging is True, files are 
+        transferred as a single archive, which is unpacked on the target 
+        resource by a single unit. Files which could not be unpacked are 
+        transferred one by one.
+
+        Args:
+            md_kernel - AMM object
+
+            unit_manager - RP's unit manager
+        """
+
+        shared_input_files = md_kernel.shared_files
+        shared_input_file_urls = md_kernel.shared_urls
+
+        if self.archive_staging == True:
+            missing = set(self.stage_shared_archive(md_kernel, unit_manager))
+        else:
+            missing = set(shared_input_files)
+
+        for i in range(len(shared_input_files)):
+
+            if shared_input_files[i] in missing:
+                sd_pilot = {'source': shared_input_file_urls[i],
+                            'target': 'staging:///%s' % shared_input_files[i],
+                            'action': rp.TRANSFER
+                }
+                self.pilot_object.stage_in(sd_pilot)
+
+            sd_shared = {'source': 'staging:///%s' % shared_input_files[i],
+                         'target': shared_input_files[i],
+                         'action': rp.COPY
+            }
+            self.sd_shared_list.append(sd_shared)
+
+    #---------------------------------------------------------------------------
+    #
+    def stage_shared_archive(self, md_kernel, unit_manager):
+        """Packs shared input files into a single archive, transfers it to
+        staging area of the pilot and runs a unit which unpacks it. Content 
+        of each file is transferred once, files which are already in 
+        staging_cache (according to local manifest) are not transferred.
+
+        Args:
+            md_kernel - AMM object
+
+            unit_manager - RP's unit manager
+
+        Returns:
+            list with names of files, which were not placed to staging area
+        """
+
+        names = md_kernel.shared_files
+        paths = [shared_staging.url_path(url) for url in md_kernel.shared_urls]
+
+        manifest = "staging_manifest.json"
+        key = "{0}:{1}".format(self.resource, self.staging_cache)
+        if self.staging_cache is not None:
+            cached = shared_staging.load_manifest(manifest, key)
+        else:
+            cached = set()
+
+        try:
+            digests, packed = shared_staging.build_archive(names, paths,
+                                                           shared_staging.ARCHIVE,
+                                                           shared_staging.INDEX,
+                                                           cached)
+        except (IOError, OSError) as e:
+            self.logger.info("Unable to pack shared data: {0}, transferring files one by one".format(e))
+            return names
+        self.logger.info("Shared data: {0} files, {1} packed, {2} cached".format(len(names), 
+                                                                               len(packed), 
+                                                                               len(set(digests) & cached)))
+
+        stage_in = []
+        for name, path in [(shared_staging.ARCHIVE, os.path.abspath(shared_staging.ARCHIVE)),
+                           (shared_staging.INDEX, os.path.abspath(shared_staging.INDEX)),
+                           ("shared_staging.py", os.path.join(os.path.dirname(os.path.abspath(shared_staging.__file__)), "shared_staging.py"))]:
+            self.pilot_object.stage_in({'source': 'file://%s' % path,
+                                        'target': 'staging:///%s' % name,
+                                        'action': rp.TRANSFER})
+            stage_in.append({'source': 'staging:///%s' % name,
+                             'target': name,
+                             'action': rp.LINK})
+
+        cu = rp.ComputeUnitDescription()
+        cu.name = "shared_data_unpack"
+        cu.pre_exec = getattr(md_kernel, 'pre_exec', [])
+        cu.executable = "python"
+        cu.arguments = ["shared_staging.py", shared_staging.ARCHIVE, shared_staging.INDEX]
+        if self.staging_cache is not None:
+            cu.arguments.append(self.staging_cache)
+        cu.input_staging = stage_in
+        cu.output_staging = [{'source': shared_staging.MISSING,
+                              'target': shared_staging.MISSING,
+                              'action': rp.TRANSFER}]
+        cu.cores = 1
+        cu.mpi = False
+
+        unit = unit_manager.submit_units(cu)
+        unit_manager.wait_units(unit_ids=unit.uid)
+
+        missing = names
+        if unit.state == rp.states.DONE:
+            try:
+                with open(shared_staging.MISSING, 'r') as f:
+                    missing = json.load(f)
+            except (IOError, ValueError):
+                self.logger.info("Unable to read {0}".format(shared_staging.MISSING))
+        if len(missing) > 0:
+            self.logger.info("{0} shared files were not unpacked, transferring them one by one".format(len(missing)))
+
+        if self.staging_cache is not None:
+            present = set([d for n, d in zip(names, digests) if n not in missing])
+            shared_staging.save_manifest(manifest, key, present)
+
+        return missing
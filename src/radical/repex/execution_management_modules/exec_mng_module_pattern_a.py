@@ -11,11 +11,17 @@ import sys
 import time
 import math
 import json
+import Queue
 import datetime
 from os import path
 import radical.pilot as rp
+import radical.utils as ru
 import radical.utils.logger as rul
 from execution_management_modules.exec_mng_module import *
+from repex_utils.wait_controller import OBJECTIVES
+from repex_utils.wait_controller import WaitRatioController
+from repex_utils.wait_controller import wait_size_limit
+from repex_utils.md_tracker import MdTracker
 
 #-------------------------------------------------------------------------------
 #
@@ -34,6 +40,9 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
 
         sd_shared_list - list with RP's data directoves for staging of 
         simulation input files, from staging area to CU's workdir
+
+        wait_controller - WaitRatioController, which tunes wait_ratio, if 
+        wait_ratio_mode is adaptive, otherwise None
     """
 
     def __init__(self, inp_file, rconfig, md_logger):
@@ -55,6 +64,74 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
         self.name = 'EmmPatternA'
         self.sd_shared_list = []
 
+        # fixed - wait_ratio is used for the whole simulation
+        # adaptive - wait_ratio is tuned online by WaitRatioController
+        self.wait_ratio_mode      = inp_file['remd.input'].get('wait_ratio_mode', 'fixed')
+        self.wait_ratio_objective = inp_file['remd.input'].get('wait_ratio_objective', 'throughput')
+        self.wait_ratio_min       = float(inp_file['remd.input'].get('wait_ratio_min', 0.05))
+        self.wait_ratio_max       = float(inp_file['remd.input'].get('wait_ratio_max', 1.0))
+        if self.wait_ratio_mode not in ['fixed', 'adaptive']:
+            self.logger.info("wait_ratio_mode must be fixed or adaptive, exiting...")
+            sys.exit(1)
+        if self.wait_ratio_objective not in OBJECTIVES:
+            self.logger.info("wait_ratio_objective must be one of: {0}, exiting...".format(OBJECTIVES))
+            sys.exit(1)
+        self.wait_controller = None
+        # duration of the last exchange round in seconds
+        self.ex_latency = 0.0
+
+    #---------------------------------------------------------------------------
+    #
+    def prepare_md_units(self, md_kernel, current_cycle, dim_str, md_replicas, replicas):
+        """Prepares MD units for given replicas. If AMM uses bundles in 
+        dimension of a replica (md_bundle_size or native_remd), replicas of 
+        the same group and dimension are bundled into a single unit.
+
+        Args:
+            current_cycle - number of current simulation cycle
+
+            dim_str - list of strings representing indexes of dimensions
+
+            md_replicas - list of Replica objects, which are ready for MD
+
+            replicas - list of all Replica objects
+
+        Returns:
+            list of compute unit descriptions and list of bundles (lists of 
+            Replica objects) of these units
+        """
+
+        members = dict()
+        order = []
+        bundles = []
+        for r in md_replicas:
+            if hasattr(md_kernel, 'use_md_bundles') and md_kernel.use_md_bundles(dim_str[r.cur_dim]):
+                key = (r.group_idx[r.cur_dim-1], r.cur_dim)
+                if key not in members:
+                    members[key] = []
+                    order.append(key)
+                members[key].append(r)
+            else:
+                bundles.append([r])
+        for key in order:
+            bundles += md_kernel.get_md_bundles(dim_str[key[1]], members[key])
+
+        c_replicas = []
+        for bundle in bundles:
+            replica = bundle[0]
+            r_dim = replica.cur_dim
+            group = md_kernel.get_replica_group(r_dim, replicas, replica)
+            ids = '-'.join([str(r.id) for r in bundle])
+            cu_name = 'id_' + ids + '_gr_' + str(replica.group_idx[r_dim-1]) + '_c_' + str(current_cycle) + '_d_' + str(r_dim)
+            if len(bundle) > 1:
+                compute_replica = md_kernel.prepare_bundle_for_md(current_cycle, r_dim, dim_str[r_dim], group, bundle, self.sd_shared_list)
+            else:
+                compute_replica = md_kernel.prepare_replica_for_md(current_cycle, r_dim, dim_str[r_dim], group, replica, self.sd_shared_list)
+            compute_replica.name = cu_name
+            c_replicas.append( compute_replica )
+
+        return c_replicas, bundles
+
     #---------------------------------------------------------------------------
     #
     def run_simulation(self, replicas, md_kernel):
@@ -68,12 +145,24 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
         """
 
         self.nr_replicas = md_kernel.replicas
+
+        if self.wait_ratio_mode == 'adaptive':
+            self.wait_controller = WaitRatioController(self.wait_ratio,
+                                                       self.nr_replicas,
+                                                       objective=self.wait_ratio_objective,
+                                                       min_ratio=self.wait_ratio_min,
+                                                       max_ratio=self.wait_ratio_max)
+            self.wait_ratio = self.wait_controller.wait_ratio
+
+        # MD units which reached final state, fed by unit_state_change_cb
+        done_queue = Queue.Queue()
         
         #-----------------------------------------------------------------------
         #
         def unit_state_change_cb(unit, state):
             """Callback function. It gets called every time a CU changes its 
-            state.
+            state. Completed units are put to done_queue, which is consumed
+            by the main loop.
             """
             if unit:
                 self.logger.info("ComputeUnit '{0:s}' state changed to {1:s}.".format(unit.uid, state) )
@@ -81,6 +170,9 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
                 if state == rp.states.FAILED:
                     self.logger.error("Log: {0:s}".format( unit.as_dict() ) )
 
+                if state in [rp.states.DONE, rp.states.FAILED, rp.states.CANCELED]:
+                    done_queue.put(unit)
+
         #-----------------------------------------------------------------------
         
         self._prof.prof('run_simulation_start')
@@ -103,26 +195,16 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
         # staging shared input data in
         md_kernel.prepare_shared_data(replicas)
 
-        shared_input_file_urls = md_kernel.shared_urls
-        shared_input_files = md_kernel.shared_files
-
-        for i in range(len(shared_input_files)):
-
-            sd_pilot = {'source': shared_input_file_urls[i],
-                        'target': 'staging:///%s' % shared_input_files[i],
-                        'action': rp.TRANSFER
-            }
-
-            self.pilot_object.stage_in(sd_pilot)
-
-            sd_shared = {'source': 'staging:///%s' % shared_input_files[i],
-                         'target': shared_input_files[i],
-                         'action': rp.COPY
-            }
-            self.sd_shared_list.append(sd_shared)
+        self.stage_shared_data(md_kernel, unit_manager)
         
         self._prof.prof('initial_stagein_end')
 
+        # exchange agent is submitted once and runs global exchange 
+        # calculators until the end of simulation
+        agent_cu = None
+        if getattr(md_kernel, 'exchange_agent', False) == True:
+            agent_cu = unit_manager.submit_units(md_kernel.prepare_exchange_agent(self.sd_shared_list))
+
         #-----------------------------------------------------------------------
         # GL = 0: submit global calculator before
         # GL = 1: submit global calculator after
@@ -148,8 +230,9 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
         md_replicas = list()
         exchange_replicas  = list()
 
-        completed_md_tasks = list()
-        submitted_md_tasks = list()
+        # submitted MD units and replicas which finished MD
+        md_tracker = MdTracker()
+        basename = getattr(md_kernel, 'inp_basename', None)
 
         self.logger.info("cycle_time: {0}".format( self.cycletime) )
         c_start = datetime.datetime.utcnow()
@@ -192,29 +275,33 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
                     # have reached this stage
                     for r_dim_list in replicas_by_dim:
                         c_str = '_c_' + str(current_cycle) + '_d_' + str(r_dim_list[0].cur_dim)
-                        self._prof.prof('prepare_global_ex_calc_start__' + c_str)
                         gl_dim = r_dim_list[0].cur_dim
                         cur_cycle = r_dim_list[0].sim_cycle
-                        cu_name = 'gl_ex' + c_str
-                        ex_calculator = md_kernel.prepare_global_ex_calc(c, gl_dim, dim_str[gl_dim], r_dim_list , self.sd_shared_list)   
-                        self._prof.prof('prepare_global_ex_calc_end__' + c_str)
-                        ex_calculator.name = cu_name
-                        self._prof.prof('submit_gl_unit_start__' + c_str)
-                        global_ex_cu = unit_manager.submit_units(ex_calculator)
-                        self._prof.prof('submit_gl_unit_end__' + c_str)
-
-                        # wait for exchange to finish
-                        self._prof.prof('wait_gl_unit_start__' + c_str)
-                        unit_manager.wait_units( unit_ids=global_ex_cu.uid )
-                        self._prof.prof('wait_gl_unit_end__' + c_str)
-                        sleep = 0
-                        gl_state = 'None'
-                        while (gl_state != 'Done'):
-                            gl_state = global_ex_cu.state
-                            time.sleep(1)
-                            sleep += 1
-                            if ( sleep > 60 ):
-                                gl_state = 'Done'
+                        ex_start = time.time()
+                        old_pars = [r.dims[dim_str[gl_dim]]['par'] for r in r_dim_list]
+                        if hasattr(md_kernel, 'is_local_exchange') and md_kernel.is_local_exchange(dim_str[gl_dim]):
+                            # exchange is calculated here, no global calculator unit
+                            self._prof.prof('local_exchange_start__' + c_str)
+                            md_kernel.calc_local_exchange(c, gl_dim, dim_str[gl_dim], r_dim_list)
+                            md_kernel.restart_object.new_sandbox = ru.Url(self.pilot_object.sandbox).path
+                            self._prof.prof('local_exchange_end__' + c_str)
+                        else:
+                            self._prof.prof('prepare_global_ex_calc_start__' + c_str)
+                            cu_name = 'gl_ex' + c_str
+                            agent_cu = self.check_exchange_agent(md_kernel, unit_manager, agent_cu)
+                            ex_calculator = md_kernel.prepare_global_ex_calc(c, gl_dim, dim_str[gl_dim], r_dim_list , self.sd_shared_list)   
+                            self._prof.prof('prepare_global_ex_calc_end__' + c_str)
+                            ex_calculator.name = cu_name
+                            self._prof.prof('submit_gl_unit_start__' + c_str)
+                            global_ex_cu = unit_manager.submit_units(ex_calculator)
+                            self._prof.prof('submit_gl_unit_end__' + c_str)
+
+                            # wait for exchange to finish
+                            self._prof.prof('wait_gl_unit_start__' + c_str)
+                            unit_manager.wait_units( unit_ids=global_ex_cu.uid )
+                            self._prof.prof('wait_gl_unit_end__' + c_str)
+                            if global_ex_cu.state != rp.states.DONE:
+                                self.logger.error("Global exchange unit {0} finished in state {1}".format(global_ex_cu.uid, global_ex_cu.state))
                         #-------------------------------------------------------
                         # update dimension count and set state to 'I'
                         for r in r_dim_list:
@@ -228,11 +315,22 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
                         self._prof.prof('do_exchange_start__' + c_str)
                         md_kernel.do_exchange(c, gl_dim, dim_str[gl_dim], r_dim_list)
                         self._prof.prof('do_exchange_end__' + c_str)
+                        self.ex_latency = time.time() - ex_start
+                        if self.wait_controller is not None:
+                            accepted = 0
+                            for r, par in zip(r_dim_list, old_pars):
+                                if r.dims[dim_str[gl_dim]]['par'] != par:
+                                    accepted += 1
+                            self.wait_controller.observe_exchange(len(r_dim_list), accepted, self.ex_latency)
                         #write replica objects out
                         self._prof.prof('save_replicas_start__' + c_str)
                         md_kernel.save_replicas(c, gl_dim, dim_str[gl_dim], replicas)
                         self._prof.prof('save_replicas_end__' + c_str)
 
+                    if self.wait_controller is not None:
+                        self.wait_ratio = self.wait_controller.update(time.time())
+                        self.logger.info("wait_ratio: {0:.3f}".format(self.wait_ratio))
+
                     #-----------------------------------------------------------
                     # submit for MD replicas which finished exchange
                     md_replicas = list()
@@ -240,21 +338,15 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
                         if r.state == 'I':
                             md_replicas.append(r)
 
-                    c_replicas = []
                     self._prof.prof('prepare_replica_for_md_start')
-                    for replica in md_replicas:
-                        r_dim = replica.cur_dim
-                        group = md_kernel.get_replica_group(r_dim, replicas, replica)
-                        cu_name = 'id_' + str(replica.id) + '_gr_' + str(replica.group_idx[r_dim-1]) + '_c_' + str(current_cycle) + '_d_' + str(r_dim)
-                        cu_tuple = cu_name.split('_')
-                        compute_replica = md_kernel.prepare_replica_for_md(current_cycle, r_dim, dim_str[r_dim], group, replica, self.sd_shared_list)
-                        compute_replica.name = cu_name
-                        c_replicas.append( compute_replica )
+                    c_replicas, bundles = self.prepare_md_units(md_kernel, current_cycle, dim_str, md_replicas, replicas)
                     self._prof.prof('prepare_replica_for_md_end')
                     self._prof.prof('submit_md_units_start')
                     sub_replicas = unit_manager.submit_units(c_replicas)
                     self._prof.prof('submit_md_units_end')
-                    submitted_md_tasks += sub_replicas
+                    now = time.time()
+                    for cu, bundle in zip(sub_replicas, bundles):
+                        md_tracker.add(cu.uid, bundle, now)
 
                     for r in md_replicas:
                         r.state = 'MD'
@@ -267,155 +359,80 @@ class ExecutionManagementModulePatternA(ExecutionManagementModule):
                         md_replicas.append(r)
 
                 if md_replicas:
-                    c_replicas = []
                     self._prof.prof('prepare_replica_for_md_start')
-                    for replica in md_replicas:
-                        r_dim = replica.cur_dim
-                        group = md_kernel.get_replica_group(r_dim, replicas, replica)
-                        cu_name = 'id_' + str(replica.id) + '_gr_' + str(replica.group_idx[r_dim-1]) + '_c_' + str(current_cycle) + '_d_' + str(r_dim)
-                        cu_tuple = cu_name.split('_')
-                        compute_replica = md_kernel.prepare_replica_for_md(current_cycle, r_dim, dim_str[r_dim], group, replica, self.sd_shared_list)
-                        compute_replica.name = cu_name
-                        c_replicas.append( compute_replica )
+                    c_replicas, bundles = self.prepare_md_units(md_kernel, current_cycle, dim_str, md_replicas, replicas)
                     self._prof.prof('prepare_replica_for_md_end')
                     self._prof.prof('submit_md_units_start')
                     sub_replicas = unit_manager.submit_units(c_replicas)
                     self._prof.prof('submit_md_units_end')
-                    submitted_md_tasks += sub_replicas
+                    now = time.time()
+                    for cu, bundle in zip(sub_replicas, bundles):
+                        md_tracker.add(cu.uid, bundle, now)
                     for r in md_replicas:
                         r.state = 'MD'
                     # for the case when we were restarting previous simulation
                     md_kernel.restart_done = True
 
                 #---------------------------------------------------------------
-                # wait loop
+                # wait loop: completed MD units are delivered by 
+                # unit_state_change_cb, so each completion is processed once 
+                # and we don't poll states of all submitted units
                 self._prof.prof('wait_md_start')
-                wait_size = int(self.nr_replicas * self.wait_ratio)
-                if wait_size == 0:
-                    wait_size = 2
-                wait_time = 0
-                count_of_completed = 0
+                # wait size can't exceed number of replicas, which can still
+                # complete MD and be paired within their groups
+                sizes = md_tracker.group_sizes()
+                running = md_tracker.running()
+                wait_size = wait_size_limit(self.wait_ratio, self.nr_replicas, sizes)
+
+                # replicas, which are predicted to complete MD while exchange
+                # of waited replicas would be running, are waited for too,
+                # since they would have to wait for the next exchange anyway
+                now = time.time()
+                needed = wait_size - md_tracker.completed + 1
+                expected = self.runtime_model.expected_wait(running, needed, now)
+                if (expected is not None) and (self.ex_latency > 0.0):
+                    extra = self.runtime_model.completed_by(running, now + expected + self.ex_latency) - needed
+                    if extra > 0:
+                        wait_size = min(wait_size + extra, wait_size_limit(1.0, self.nr_replicas, sizes))
+                    self.logger.info("expected wait for {0} replicas: {1:.1f} s, wait size: {2}".format(needed, expected, wait_size))
                 #---------------------------------------------------------------
                 # start of while loop (waiting for MD tasks to finish)
-                while (count_of_completed <= wait_size):
-                    # update completed_md_tasks
-                    for cu in submitted_md_tasks:
-                        if cu.state == 'Done':
-                            if cu not in completed_md_tasks:
-                                completed_md_tasks.append(cu)
-
-                    # enter this loop only of there are enough CUs
-                    if (len(completed_md_tasks) > wait_size):
-                        all_gr_list = list()
-                        for idx, cunit in enumerate(completed_md_tasks):
-                            cu = completed_md_tasks[idx]
-                            r_tuple_1 = cu.name.split('_')
-                            # check if replicas from same group are finished
-                            add = 0
-                            add_to_sublist = None
-                            for sublist in all_gr_list:
-                                for item in sublist:
-                                    r_tuple_2 = item.split('_')
-                                    # if in same group and in same dimension
-                                    if r_tuple_1[3] == r_tuple_2[3] and r_tuple_1[7] == r_tuple_2[7]:
-                                        add_to_sublist = sublist
-                                        add = 1
-                            # in all_gr_list already are replicas from the same 
-                            # group and dimension as current cu, so we add to 
-                            # existing gr_list
-                            if add == 1:
-                                index = all_gr_list.index(add_to_sublist)
-                                all_gr_list[index].append(cu.name)
-                            # in all_gr_list there are no replicas from the same 
-                            # group and dimension as current cu, so we add new 
-                            # gr_list
-                            if add == 0:     
-                                gr_list = list()
-                                gr_list.append(cu.name)
-                                all_gr_list.append(gr_list)
-
-                        # updating count_of_completed
-                        count_of_completed = 0
-                        cus_to_exchange_names = list()
-                        for item in all_gr_list:
-                            # we only count groups with 2 or more replicas 
-                            # because each replica must have a partner
-                            group_size = len(item)
-                            if group_size > 1:
-                                # in each group must be even number of replicas
-                                if ((group_size % 2) != 0):
-                                    item.pop()
-                                cus_to_exchange_names += item
-                        for item in cus_to_exchange_names:
-                            count_of_completed += 1
-                        if count_of_completed < wait_size:
-                            time.sleep(1)
-                            wait_time += 1
-                    else:
-                        time.sleep(1)
-                        wait_time += 1
+                while (md_tracker.completed <= wait_size) and len(md_tracker):
+                    try:
+                        # timeout only keeps this thread interruptible
+                        cu = done_queue.get(True, 60)
+                    except Queue.Empty:
+                        continue
+                    failed = (cu.state != rp.states.DONE)
+                    for r, runtime in md_tracker.complete(cu.uid, time.time(), failed):
+                        self.observe_runtime('md', r, runtime, basename)
+                        if self.wait_controller is not None:
+                            self.wait_controller.observe_md()
 
                 self._prof.prof('wait_md_end')
                 # end of while loop   
                 #---------------------------------------------------------------
-                # updating submitted_md_tasks: we remove all cus which are in
-                # completed_md_tasks, regardless if they proceed to exchange 
-                # or not
-                self._prof.prof('updating submitted_md_tasks_start')
-                idx_list = list()
-                for i,cu1 in enumerate(completed_md_tasks): 
-                    for j,cu2 in enumerate(submitted_md_tasks):
-                        if cu1.name == cu2.name:
-                            idx_list.append(j)
-                # must sort to maintain the order
-                idx_list.sort(reverse=True)
-                for i,j in enumerate(idx_list):
-                    submitted_md_tasks.pop(j)
-                self._prof.prof('updating submitted_md_tasks_end')
-
-                self._prof.prof('populating_cus_to_exchange_start')
-                # populating cus_to_exchange
-                cus_to_exchange = list()
-                for item in cus_to_exchange_names:
-                    for idx, cunit in enumerate(completed_md_tasks):
-                        cu = completed_md_tasks[idx]
-                        if item == cu.name:
-                            cus_to_exchange.append(cu)
-                self._prof.prof('populating_cus_to_exchange_end')
-
-                # updating completed_md_tasks: removing tasks which proceed to
-                # exchange
-                self._prof.prof('updating_completed_md_tasks_start')
-                idx_list = list()
-                for i,cu1 in enumerate(cus_to_exchange): 
-                    for j,cu2 in enumerate(completed_md_tasks):
-                        if cu1.name == cu2.name:
-                            idx_list.append(j)
-                # must sort to maintain the order
-                idx_list.sort(reverse=True)
-                for i,j in enumerate(idx_list):
-                    completed_md_tasks.pop(j)
-                self._prof.prof('updating_completed_md_tasks_end')
+                # populating exchange_replicas: replicas which are not taken
+                # stay in md_tracker until next exchange
+                self._prof.prof('populating_exchange_replicas_start')
+                exchange_replicas = md_tracker.take()
+
+                for r in exchange_replicas:
+                    r.state = 'EX'
+                self._prof.prof('populating_exchange_replicas_end')
 
                 # update simulation time
                 c_end = datetime.datetime.utcnow()
                 simulation_time = (c_end - c_start).total_seconds()
                 c += 1
-
-                self._prof.prof('populating_exchange_replicas_start')
-                # populating exchange_replicas
-                exchange_replicas = list()
-                for cu in cus_to_exchange:
-                    if cu.state == 'Done':
-                        for r in replicas:
-                            cu_name = cu.name.split('_')
-                            if str(r.id) == cu_name[1]:
-                                exchange_replicas.append(r)
-                                r.state = 'EX'
-                self._prof.prof('populating_exchange_replicas_end')
                 
         #-----------------------------------------------------------------------
         # end of loop
+        if agent_cu is not None:
+            unit_manager.cancel_units(agent_cu.uid)
+
+        if self.wait_controller is not None:
+            self.wait_controller.write_history("wait_ratio_history.csv")
 
         self._prof.prof('main_simulation_loop_end')
         self._prof.prof('run_simulation_end')
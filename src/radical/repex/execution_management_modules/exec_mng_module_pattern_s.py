@@ -11,12 +11,14 @@ import sys
 import time
 import math
 import json
+import Queue
 import datetime
 from os import path
 import radical.pilot as rp
 import radical.utils as ru
 import radical.utils.logger as rul
 from execution_management_modules.exec_mng_module import *
+from repex_utils.unit_packer import UnitPacker
 
 #-------------------------------------------------------------------------------
 
@@ -29,6 +31,20 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
 
         sd_shared_list - list with RP's data directoves for staging of 
         simulation input files, from staging area to CU's workdir
+
+        pipelined_cycles - if True, MD units of the next dimension step are
+        prepared while exchange unit is running and replicas are saved by
+        background thread
+
+        prebuilt_units - dictionary where key is replica id and value is
+        (key, compute unit, cycle, sim_cycle) for a compute unit prepared in
+        advance
+
+        replica_map - dictionary where key is replica id and value is
+        Replica object
+
+        bundles - dictionary where key is key of MD unit of a bundle and value
+        is list of Replica objects, which run in this unit
     """
 
     def __init__(self, inp_file, rconfig, md_logger):
@@ -46,6 +62,147 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
         self.name   = 'EMMpatternS'
         self.sd_shared_list = []
 
+        if inp_file['remd.input'].get('pipelined_cycles', 'False') == "True":
+            self.pipelined_cycles = True
+        else:
+            self.pipelined_cycles = False
+        self.prebuilt_units = {}
+        self.replica_map = {}
+        self.bundles = {}
+        self.basename = None
+
+#-------------------------------------------------------------------------------
+
+    def run_units(self, unit_manager, packer, done_queue, prepare_unit, group_done=None):
+        """Submits units of a given packer and waits until all are done.
+        Units are submitted as soon as cores are freed by completed units, 
+        not batch by batch.
+
+        Args:
+            unit_manager - RP's unit manager
+
+            packer - UnitPacker object with units of this step
+
+            done_queue - queue with units in final state
+
+            prepare_unit - function, which takes key and item of released unit
+            and returns compute unit description
+
+            group_done - function, which is called with group index when all
+            units of this group are done, it may add units to packer
+
+        Returns:
+            list of (key, compute unit) of all submitted units
+        """
+
+        units = []
+        uid_keys = {}
+        started = {}
+        finished = {}
+        while len(packer):
+            released = packer.next_units()
+            if len(released):
+                descriptions = []
+                for key, item in released:
+                    descriptions.append(prepare_unit(key, item))
+                submitted = unit_manager.submit_units(descriptions)
+                now = time.time()
+                for (key, item), cu in zip(released, submitted):
+                    uid_keys[cu.uid] = key
+                    started[key] = now
+                    units.append((key, cu))
+
+            # callback may be called before submit_units() returns, so
+            # completed units are matched after registration
+            ready = [uid for uid in finished if uid in uid_keys]
+            if len(ready) == 0:
+                try:
+                    # timeout only keeps this thread interruptible
+                    cu = done_queue.get(True, 60)
+                except Queue.Empty:
+                    continue
+                finished[cu.uid] = (cu, time.time())
+                continue
+
+            for uid in ready:
+                cu, stop = finished.pop(uid)
+                key = uid_keys.pop(uid)
+                if cu.state == rp.states.DONE:
+                    for replica in self.bundles.get(key, [self.replica_map[key[1]]]):
+                        self.observe_runtime(key[0], replica, stop - started[key], self.basename)
+                del started[key]
+                g = packer.release(key)
+                if (g is not None) and (group_done is not None):
+                    group_done(g)
+
+        return units
+
+#-------------------------------------------------------------------------------
+
+    def unit_key(self, md_kernel, current_cycle, dim_int, dim_str, group, replica):
+        """Returns key of compute unit of a given replica. Compute unit
+        depends only on state of this replica and of replicas returned by
+        get_unit_dependencies() of AMM, so unit prepared in advance can be 
+        used if key is the same.
+        """
+
+        deps = md_kernel.get_unit_dependencies(dim_str, group, replica)
+        return (current_cycle,
+                dim_int,
+                md_kernel.restart_done,
+                replica.store.signature(replica.idx),
+                tuple([r.store.signature(r.idx) for r in deps]))
+
+#-------------------------------------------------------------------------------
+
+    def prebuild_md_units(self, md_kernel, current_cycle, dim_int, dim_str, replicas):
+        """Prepares MD units of all replicas for a given dimension step using
+        current state of replicas. Is called while exchange unit of the
+        previous step is running. Only units of replicas, which are not 
+        affected by exchange, are used later. Counters of replicas are not 
+        changed.
+
+        Args:
+            current_cycle - number of simulation cycle of the step
+
+            dim_int - index of dimension of the step
+
+            dim_str - string representing index of dimension of the step
+
+            replicas - list of Replica objects
+        """
+
+        self.prebuilt_units = {}
+        if hasattr(md_kernel, 'use_md_bundles') and md_kernel.use_md_bundles(dim_str):
+            # units of bundles are prepared when they are submitted
+            return
+        all_groups = md_kernel.get_all_groups(dim_int, replicas)
+        for group in all_groups:
+            group.pop(0)
+            for replica in group:
+                key = self.unit_key(md_kernel, current_cycle, dim_int, dim_str, group, replica)
+                cycle = replica.cycle
+                sim_cycle = replica.sim_cycle
+                cu = md_kernel.prepare_replica_for_md(current_cycle, dim_int, dim_str, group, replica, self.sd_shared_list)
+                self.prebuilt_units[replica.id] = (key, cu, replica.cycle, replica.sim_cycle)
+                replica.cycle = cycle
+                replica.sim_cycle = sim_cycle
+
+#-------------------------------------------------------------------------------
+
+    def get_md_unit(self, md_kernel, current_cycle, dim_int, dim_str, group, replica):
+        """Returns MD unit of a given replica. Unit prepared in advance by
+        prebuild_md_units() is used if state of replica and of it's group has
+        not changed, otherwise unit is prepared by AMM.
+        """
+
+        item = self.prebuilt_units.pop(replica.id, None)
+        if (item is not None) and (item[0] == self.unit_key(md_kernel, current_cycle, dim_int, dim_str, group, replica)):
+            replica.cycle = item[2]
+            replica.sim_cycle = item[3]
+            return item[1]
+        return md_kernel.prepare_replica_for_md(current_cycle, dim_int, dim_str, group, replica, self.sd_shared_list)
+
 #-------------------------------------------------------------------------------
 
     def run_simulation(self, replicas, md_kernel):
@@ -58,11 +215,14 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
             md_kernel - an instance of AMM
         """
 
+        # units which reached final state, fed by unit_state_change_cb
+        done_queue = Queue.Queue()
+
         #-----------------------------------------------------------------------
         #
         def unit_state_change_cb(unit, state):
             """Callback function. It gets called every time a CU changes its 
-            state.
+            state. Units in final state are put to done_queue.
             """
             if unit:            
                 self.logger.info("ComputeUnit '{0:s}' state changed to {1:s}.".format(unit.uid, state) )
@@ -70,12 +230,18 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
                 if state == rp.states.FAILED:
                     self.logger.info("Log: {0:s}".format( unit.as_dict() ) )
                     # restar replica here
+
+                if state in [rp.states.DONE, rp.states.FAILED, rp.states.CANCELED]:
+                    done_queue.put(unit)
                     
         #-----------------------------------------------------------------------
 
         self._prof.prof('run_simulation_start')
 
         cycles = md_kernel.nr_cycles
+
+        self.replica_map = dict([(r.id, r) for r in replicas])
+        self.basename = getattr(md_kernel, 'inp_basename', None)
                 
         unit_manager = rp.UnitManager(self.session, scheduler=rp.SCHED_DIRECT_SUBMISSION)
         unit_manager.register_callback(unit_state_change_cb)
@@ -86,25 +252,18 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
         # staging shared input data in
         md_kernel.prepare_shared_data(replicas)
 
-        shared_input_file_urls = md_kernel.shared_urls
-        shared_input_files = md_kernel.shared_files
-
-        for i,j in enumerate(shared_input_files):
-
-            sd_pilot = {'source': shared_input_file_urls[i],
-                        'target': 'staging:///%s' % shared_input_files[i],
-                        'action': rp.TRANSFER
-            }
+        self.stage_shared_data(md_kernel, unit_manager)
 
-            self.pilot_object.stage_in(sd_pilot)
+        self._prof.prof('initial_stagein_end')
 
-            sd_shared = {'source': 'staging:///%s' % shared_input_files[i],
-                         'target': shared_input_files[i],
-                         'action': rp.COPY
-            }
-            self.sd_shared_list.append(sd_shared)
+        # exchange agent is submitted once and runs global exchange 
+        # calculators until the end of simulation
+        agent_cu = None
+        if getattr(md_kernel, 'exchange_agent', False) == True:
+            agent_cu = unit_manager.submit_units(md_kernel.prepare_exchange_agent(self.sd_shared_list))
 
-        self._prof.prof('initial_stagein_end')
+        if self.pipelined_cycles == True:
+            md_kernel.journal.start_writer()
 
         #-----------------------------------------------------------------------
         # bulk_submission = 0: do sequential submission
@@ -149,157 +308,117 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
             #
             if bulk_submission:
                 
-                md_prep_timing = 0.0
-                md_sub_timing  = 0.0
-                md_exec_timing = 0.0
                 self._prof.prof('get_all_groups_start__' + c_str)
                 all_groups = md_kernel.get_all_groups(dim_int, replicas)
-
                 for group in all_groups:
                     group.pop(0)
                 self._prof.prof('get_all_groups_end__' + c_str)
 
-                batch = []
-                r_cores = md_kernel.replica_cores
-                for group in all_groups:
-                    # assumes uniform distribution of cores
-                    if ( (len(batch)+len(group))*r_cores ) <= self.cores:
-                        batch.append(group)
-                    else:
-                        # we have more replicas than cores in a single group
-                        if len(batch) == 0 and len(group) > self.cores:
-                            batch.append(group)
-                        elif len(batch) == 0:
-                            self.logger.info('ERROR: batch is empty, no replicas to prepare!')
-                            sys.exit(1)
-
-                        c_replicas = []
-                        self._prof.prof('prepare_replica_for_md_start__' + c_str )
-                        for group in batch:
-                            for replica in group:
-                                compute_replica = md_kernel.prepare_replica_for_md(current_cycle, dim_int, dim_str[dim_int], group, replica, self.sd_shared_list)
-                                c_replicas.append(compute_replica)
-                        self._prof.prof('prepare_replica_for_md_end__' + c_str )
-
-                        self._prof.prof('submit_md_units_start__' + c_str )
-                        submitted_batch = unit_manager.submit_units(c_replicas)
-                        self._prof.prof('submit_md_units_end__' + c_str )
-
-                        submitted_replicas += submitted_batch
-
-                        unit_ids = []
-                        for item in submitted_batch:
-                            unit_ids.append( item.uid )
-
-                        self._prof.prof('wait_md_units_start__' + c_str )
-                        unit_manager.wait_units( unit_ids=unit_ids)
-                        self._prof.prof('wait_md_units_end__' + c_str )
-
-                        if len(group) < self.cores:
-                            batch = []
-                            batch.append(group)
-                        else:
-                            batch = []
-
-                if len(batch) != 0:
-                    c_replicas = []
-                    self._prof.prof('prepare_replica_for_md_start__' + c_str )
-                    for group in batch:
-                        for replica in group:
-                            compute_replica = md_kernel.prepare_replica_for_md(current_cycle, dim_int, dim_str[dim_int], group, replica, self.sd_shared_list)
-                            c_replicas.append(compute_replica)
-                    self._prof.prof('prepare_replica_for_md_end__' + c_str )
-
-                    self._prof.prof('submit_md_units_start__' + c_str )
-                    submitted_batch = unit_manager.submit_units(c_replicas)
-                    self._prof.prof('submit_md_units_end__' + c_str )
-
-                    submitted_replicas += submitted_batch
-
-                    unit_ids = []
-                    for item in submitted_batch:
-                        unit_ids.append( item.uid )    
-
-                    self._prof.prof('wait_md_units_start__' + c_str )
-                    unit_manager.wait_units( unit_ids=unit_ids)
-                    self._prof.prof('wait_md_units_end__' + c_str )
-                    
+                # MD units of all groups are packed on the pilot, for salt 
+                # concentration exchange units of a group are added as soon 
+                # as MD units of that group are done
+                salt_ex = (md_kernel.dims[dim_str[dim_int]]['type'] == 'salt')
+                packer = UnitPacker(self.cores)
+                self.bundles = {}
+                for g, group in enumerate(all_groups):
+                    if hasattr(md_kernel, 'use_md_bundles') and md_kernel.use_md_bundles(dim_str[dim_int]):
+                        # replicas of a bundle run in a single MPI unit
+                        for bundle in md_kernel.get_md_bundles(dim_str[dim_int], group):
+                            key = ('md', bundle[0].id)
+                            self.bundles[key] = bundle
+                            estimate = max([self.runtime_model.predict('md', r) for r in bundle])
+                            packer.add(key, len(bundle)*md_kernel.replica_cores, estimate, (group, bundle), group=g)
+                        continue
+                    for replica in group:
+                        key = ('md', replica.id)
+                        packer.add(key, md_kernel.replica_cores, self.runtime_model.predict('md', replica), (group, replica), group=g)
+
                 #---------------------------------------------------------------
                 #
-                if (md_kernel.dims[dim_str[dim_int]]['type'] == 'salt'):
-
-                    ex_prep_timing = 0.0
-                    ex_sub_timing  = 0.0
-                    ex_exec_timing = 0.0
-
-                    self._prof.prof('get_all_groups_start__' + c_str)
-                    all_groups = md_kernel.get_all_groups(dim_int, replicas)
-                    for group in all_groups:
-                        group.pop(0)
-                    self._prof.prof('get_all_groups_end__' + c_str)
-
-                    batch = []
-                    r_cores = md_kernel.dims[dim_str[dim_int]]['replicas']
-                    for group in all_groups:
-                        if ( (len(batch)+len(group))*r_cores ) <= self.cores:
-                            batch.append(group)
-                        else:
-                            if len(batch) == 0:
-                                self.logger.info('ERROR: batch is empty, no replicas to prepare!')
-                                sys.exit(1)
-
-                            e_replicas = []
-                            self._prof.prof('prepare_replica_for_exchange_start__' + c_str)
-                            for group in batch:
-                                for replica in group:
-                                    ex_replica = md_kernel.prepare_replica_for_exchange(current_cycle, dim_int, dim_str[dim_int], group, replica, self.sd_shared_list)
-                                    e_replicas.append(ex_replica)
-                            self._prof.prof('prepare_replica_for_exchange_end__' + c_str)
-
-                            self._prof.prof('submit_ex_units_start__' + c_str )
-                            exchange_replicas += unit_manager.submit_units(e_replicas) 
-                            self._prof.prof('submit_ex_units_end__' + c_str )
- 
-                            self._prof.prof('wait_ex_units_start__' + c_str )
-                            unit_manager.wait_units()
-                            self._prof.prof('wait_ex_units_end__' + c_str )
- 
-                            batch = []
-                            batch.append(group)
-                    if len(batch) != 0:
-                        e_replicas = []
-                        self._prof.prof('prepare_replica_for_exchange_start__' + c_str)
-                        for group in batch:
-                            for replica in group:
-                                ex_replica = md_kernel.prepare_replica_for_exchange(current_cycle, dim_int, dim_str[dim_int], group, replica, self.sd_shared_list)
-                                e_replicas.append(ex_replica)
-                        self._prof.prof('prepare_replica_for_exchange_end__' + c_str)
-
-                        self._prof.prof('submit_ex_units_start__' + c_str )
-                        exchange_replicas += unit_manager.submit_units(e_replicas) 
-                        self._prof.prof('submit_ex_units_end__' + c_str )
-
-                        self._prof.prof('wait_ex_units_start__' + c_str )
-                        unit_manager.wait_units()
-                        self._prof.prof('wait_ex_units_end__' + c_str )
+                def prepare_unit(key, item):
+                    if key in self.bundles:
+                        group, bundle = item
+                        return md_kernel.prepare_bundle_for_md(current_cycle, dim_int, dim_str[dim_int], group, bundle, self.sd_shared_list)
+                    if key[0] == 'md':
+                        group, replica = item
+                        return self.get_md_unit(md_kernel, current_cycle, dim_int, dim_str[dim_int], group, replica)
+                    return item
+
+                #---------------------------------------------------------------
+                #
+                def group_done(g):
+                    if salt_ex == False:
+                        return
+                    group = all_groups[g]
+                    if getattr(md_kernel, 'salt_group_exchange', False) == True:
+                        # energies of the whole group are calculated by as
+                        # few units as fit into the pilot
+                        self._prof.prof('prepare_group_for_exchange_start__' + c_str)
+                        ex_units = md_kernel.prepare_group_for_exchange(current_cycle, dim_int, dim_str[dim_int], group, self.sd_shared_list, self.cores)
+                        start = 0
+                        for ex_unit in ex_units:
+                            key = ('ex', group[start].id)
+                            packer.add(key, ex_unit.cores, self.runtime_model.predict('ex', group[start]), ex_unit)
+                            start += ex_unit.cores / len(group)
+                        self._prof.prof('prepare_group_for_exchange_end__' + c_str)
+                        return
+                    self._prof.prof('prepare_replica_for_exchange_start__' + c_str)
+                    for replica in group:
+                        ex_replica = md_kernel.prepare_replica_for_exchange(current_cycle, dim_int, dim_str[dim_int], group, replica, self.sd_shared_list)
+                        key = ('ex', replica.id)
+                        packer.add(key, ex_replica.cores, self.runtime_model.predict('ex', replica), ex_replica)
+                    self._prof.prof('prepare_replica_for_exchange_end__' + c_str)
+
+                #---------------------------------------------------------------
+
+                self._prof.prof('wait_md_units_start__' + c_str )
+                units = self.run_units(unit_manager, packer, done_queue, prepare_unit, group_done)
+                self._prof.prof('wait_md_units_end__' + c_str )
+
+                for key, cu in units:
+                    if key[0] == 'md':
+                        submitted_replicas.append(cu)
+                    else:
+                        exchange_replicas.append(cu)
 
+                #---------------------------------------------------------------
+                #
+                if salt_ex == True:
                     #-----------------------------------------------------------
                     # submitting unit which determines exchanges between replicas
                   
                     self._prof.prof('prepare_global_ex_calc_start__' + c_str )
+                    agent_cu = self.check_exchange_agent(md_kernel, unit_manager, agent_cu)
                     ex_calculator = md_kernel.prepare_global_ex_calc(current_cycle, dim_int, dim_str[dim_int], replicas, self.sd_shared_list)
                     self._prof.prof('prepare_global_ex_calc_end__' + c_str )
 
                     self._prof.prof('submit_gl_unit_start__' + c_str )
                     global_ex_cu = unit_manager.submit_units(ex_calculator)
                     self._prof.prof('submit_gl_unit_end__' + c_str )
+
+                    if self.pipelined_cycles == True and c < cycles*dim_count:
+                        self._prof.prof('prebuild_md_units_start__' + c_str )
+                        if dim_int < dim_count:
+                            self.prebuild_md_units(md_kernel, current_cycle, dim_int+1, dim_str[dim_int+1], replicas)
+                        else:
+                            self.prebuild_md_units(md_kernel, current_cycle+1, 1, dim_str[1], replicas)
+                        self._prof.prof('prebuild_md_units_end__' + c_str )
                     
                     self._prof.prof('wait_gl_unit_start__' + c_str )
-                    unit_manager.wait_units()
+                    unit_manager.wait_units( unit_ids=global_ex_cu.uid )
                     self._prof.prof('wait_gl_unit_end__' + c_str )
 
+                elif hasattr(md_kernel, 'is_local_exchange') and md_kernel.is_local_exchange(dim_str[dim_int]):
+                    # exchange is calculated here, no global calculator unit
+                    self._prof.prof('local_exchange_start__' + c_str )
+                    md_kernel.calc_local_exchange(current_cycle, dim_int, dim_str[dim_int], replicas)
+                    md_kernel.restart_object.new_sandbox = ru.Url(self.pilot_object.sandbox).path
+                    global_ex_cu = None
+                    self._prof.prof('local_exchange_end__' + c_str )
+
                 else:
                     self._prof.prof('prepare_global_ex_calc_start__' + c_str )
+                    agent_cu = self.check_exchange_agent(md_kernel, unit_manager, agent_cu)
                     ex_calculator = md_kernel.prepare_global_ex_calc(current_cycle, dim_int, dim_str[dim_int], replicas, self.sd_shared_list)
                     self._prof.prof('prepare_global_ex_calc_end__' + c_str )
 
@@ -307,6 +426,14 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
                     global_ex_cu = unit_manager.submit_units(ex_calculator)
                     self._prof.prof('submit_gl_unit_end__' + c_str )
 
+                    if self.pipelined_cycles == True and c < cycles*dim_count:
+                        self._prof.prof('prebuild_md_units_start__' + c_str )
+                        if dim_int < dim_count:
+                            self.prebuild_md_units(md_kernel, current_cycle, dim_int+1, dim_str[dim_int+1], replicas)
+                        else:
+                            self.prebuild_md_units(md_kernel, current_cycle+1, 1, dim_str[1], replicas)
+                        self._prof.prof('prebuild_md_units_end__' + c_str )
+
                     self._prof.prof('wait_gl_unit_start__' + c_str )
                     unit_manager.wait_units( unit_ids=global_ex_cu.uid )
                     self._prof.prof('wait_gl_unit_end__' + c_str )
@@ -325,7 +452,7 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
                         self.logger.info('ERROR: In D%d Exchange-step failed for unit:  %s' % (dim_int, r.uid))
                         failed_cus.append( r.uid )
 
-            if global_ex_cu.state != rp.DONE:
+            if (global_ex_cu is not None) and (global_ex_cu.state != rp.DONE):
                 self.logger.info('ERROR: In D%d Global-Exchange-step failed for unit:  %s' % (dim_int, global_ex_cu.uid))
                 failed_cus.append( global_ex_cu.uid )
 
@@ -347,6 +474,10 @@ class ExecutionManagementModulePatternS(ExecutionManagementModule):
 
         #-----------------------------------------------------------------------
         # end of loop
+        if agent_cu is not None:
+            unit_manager.cancel_units(agent_cu.uid)
+        if self.pipelined_cycles == True:
+            md_kernel.journal.stop_writer()
         self._prof.prof('main_simulation_loop_end')
         self._prof.prof('run_simulation_end')
 
@@ -85,23 +85,7 @@ class ExecutionManagementModulePatternSgroup(ExecutionManagementModule):
         # staging shared input data in
         md_kernel.prepare_shared_data(replicas)
 
-        shared_input_file_urls = md_kernel.shared_urls
-        shared_input_files = md_kernel.shared_files
-
-        for i,j in enumerate(shared_input_files):
-
-            sd_pilot = {'source': shared_input_file_urls[i],
-                        'target': 'staging:///%s' % shared_input_files[i],
-                        'action': rp.TRANSFER
-            }
-
-            self.pilot_object.stage_in(sd_pilot)
-
-            sd_shared = {'source': 'staging:///%s' % shared_input_files[i],
-                         'target': shared_input_files[i],
-                         'action': rp.COPY
-            }
-            self.sd_shared_list.append(sd_shared)
+        self.stage_shared_data(md_kernel, unit_manager)
 
         self._prof.prof('initial_stagein_end')
 
@@ -0,0 +1,158 @@
+"""
+.. module:: radical.repex.remote_application_modules.ram_amber.exchange_agent
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import sys
+import json
+import time
+import runpy
+import traceback
+
+#-------------------------------------------------------------------------------
+#
+def request_script(req, request, timeout):
+    """Returns shell script of requesting CU. Script writes request file 
+    (written under temporary name and renamed, so agent never reads an 
+    incomplete request) and waits until agent writes done file. If done file
+    does not appear within timeout seconds (e.g. agent is not running), 
+    request is withdrawn and script exits with non-zero status.
+
+    Args:
+        req - path to request without extension, e.g. 
+        ../staging_area/exchange_requests/pairs_1_2
+
+        request - JSON string with name of RAM and it's arguments
+
+        timeout - number of seconds to wait for agent
+
+    Returns:
+        string
+    """
+
+    polls = int(float(timeout) * 10)
+
+    script  = "mkdir -p {0} && ".format(os.path.dirname(req))
+    script += "pwd > {0}.tmp && ".format(req)
+    script += "printf '%s\\n' '{0}' >> {1}.tmp && ".format(request.replace("'", "'\\''"), req)
+    script += "mv {0}.tmp {0}.req && ".format(req)
+    script += "n=0; while [ ! -f {0}.done ]; do ".format(req)
+    script += "n=$((n+1)); if [ $n -gt {0} ]; then ".format(polls)
+    script += "rm -f {0}.req; echo 'No response from exchange agent' >&2; exit 1; fi; ".format(req)
+    script += "sleep 0.1; done; "
+    script += "status=`cat {0}.done`; rm -f {0}.done; exit $status".format(req)
+    return script
+
+#-------------------------------------------------------------------------------
+#
+def handle_request(req_path, agent_dir):
+    """Runs global calculator of a given request in sandbox of requesting CU
+    and writes <name>.done file with exit status of calculator.
+
+    Args:
+        req_path - path to request file
+
+        agent_dir - directory of the agent, where RAMs are
+
+    Returns:
+        exit status of calculator
+    """
+
+    with open(req_path, 'r') as f:
+        lines = f.readlines()
+    os.remove(req_path)
+
+    cu_sandbox = lines[0].strip()
+    request = json.loads(lines[1])
+    script = os.path.join(agent_dir, request["ram"])
+    print "Running {0} in {1}".format(request["ram"], cu_sandbox)
+
+    t_start = time.time()
+    argv = sys.argv
+    status = 0
+    try:
+        os.chdir(cu_sandbox)
+        sys.argv = [script] + request.get("args", [])
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code is not None:
+            status = 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.argv = argv
+        os.chdir(agent_dir)
+        sys.stdout.flush()
+    print "Finished {0} with status {1} in {2:.3f} s".format(request["ram"], status, time.time()-t_start)
+
+    # done file is renamed into place, so requesting CU never reads an 
+    # empty file
+    done_path = req_path[:-len('.req')] + '.done'
+    with open(done_path + '.tmp', 'w') as f:
+        f.write(str(status))
+    os.rename(done_path + '.tmp', done_path)
+
+    return status
+
+#-------------------------------------------------------------------------------
+#
+def serve(requests_dir, agent_dir, poll_interval=0.1, max_requests=None):
+    """Handles requests in a given directory until max_requests requests 
+    are handled. If max_requests is None, runs until it's unit is canceled.
+
+    Returns:
+        number of handled requests
+    """
+
+    handled = 0
+    while (max_requests is None) or (handled < max_requests):
+        requests = sorted([n for n in os.listdir(requests_dir) if n.endswith('.req')])
+        if len(requests) == 0:
+            time.sleep(poll_interval)
+            continue
+        for name in requests:
+            handle_request(os.path.join(requests_dir, name), agent_dir)
+            handled += 1
+    return handled
+
+#-------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    """This RAM is launched once per pilot and runs until it's unit is 
+    canceled at the end of simulation. It runs global exchange calculators on
+    behalf of light-weight CUs, which are submitted every cycle instead of a
+    new Python CU with a global calculator.
+
+    Request is a file <name>.req in staging_area/exchange_requests directory.
+    First line of request file is path to sandbox of requesting CU, second
+    line is a JSON object with name of global calculator RAM and it's
+    arguments. Global calculator is run in this process, in sandbox of
+    requesting CU, so output files are staged out by that CU. Modules and
+    caches (restraints, .mdinfo records) imported by calculators stay in
+    memory between cycles. When calculator finishes, we write <name>.done
+    file with exit status of calculator.
+    """
+
+    json_data = sys.argv[1]
+    data=json.loads(json_data)
+
+    poll_interval = float(data.get("poll_interval", 0.1))
+
+    agent_dir = os.getcwd()
+    requests_dir = os.path.abspath("../staging_area/" + data.get("requests_dir", "exchange_requests"))
+    try:
+        os.makedirs(requests_dir)
+    except OSError:
+        # created by requesting CU
+        if not os.path.isdir(requests_dir):
+            raise
+
+    print "Exchange agent is waiting for requests in: {0}".format(requests_dir)
+    serve(requests_dir, agent_dir, poll_interval)
@@ -12,6 +12,12 @@ import json
 import math
 import time
 import shutil
+from exchange.templates import mdin_values
+from exchange.templates import rstr_values
+from exchange.templates import render_file
+from exchange.templates import load_template
+from exchange.templates import set_cntrl
+from exchange.templates import write_if_changed
 
 #-------------------------------------------------------------------------------
 
@@ -69,68 +75,31 @@ if __name__ == '__main__':
         new_temperature = init_temp
     #---------------------------------------------------------------------------
     # this is for every cycle
-    try:
-        r_file = open(amber_input, "r")
-    except IOError:
-        print "Warning: unable to access template file: {0}".format(amber_input) 
-
-    tbuffer = r_file.read()
-    r_file.close()
-
     if (umbrellas > 0):
-        tbuffer = tbuffer.replace("@disang@",new_restraints)
-
-    tbuffer = tbuffer.replace("@nstlim@",cycle_steps)
-    tbuffer = tbuffer.replace("@temp@", str(new_temperature))
-
-    if replica_cycle == 1:
-        tbuffer = tbuffer.replace("@irest@","0")
-        tbuffer = tbuffer.replace("@ntx@","1")
+        disang = new_restraints
     else:
-        tbuffer = tbuffer.replace("@irest@","1")
-        tbuffer = tbuffer.replace("@ntx@","5")
-    if new_salt is not None:
-        tbuffer = tbuffer.replace("@salt@",str(new_salt) )
+        disang = None
+    values = mdin_values(cycle_steps, new_temperature, (replica_cycle == 1), disang, new_salt)
     try:
-        w_file = open(new_input_file, "w")
-        w_file.write(tbuffer)
-        w_file.close()
-    except IOError:
+        content = load_template(amber_input).render(values)
+        # number of exchanges for Amber's native replica exchange
+        if data.get("numexchg") is not None:
+            content = set_cntrl(content, "numexchg", data["numexchg"])
+        write_if_changed(new_input_file, content)
+    except (IOError, OSError):
         print "Warning: unable to access file: {0}".format(new_input_file)
 
     #---------------------------------------------------------------------------
     # this is for first cycle only, if we have umbrella dimension
     if (replica_cycle == 1) and (umbrellas > 0):
-        try:
-            r_file = open(us_template, "r")
-            tbuffer = r_file.read()
-            r_file.close()
-        except IOError:
-            print "Warning: unable to access file: {0}".format(us_template) 
-
         if umbrellas == 2:
-            try:
-                w_file = open(new_restraints, "w")
-                tbuffer = tbuffer.replace("@val1@", str(rstr_val_1))
-                tbuffer = tbuffer.replace("@val1l@", str(rstr_val_1-90))
-                tbuffer = tbuffer.replace("@val1h@", str(rstr_val_1+90))
-                tbuffer = tbuffer.replace("@val2@", str(rstr_val_2))
-                tbuffer = tbuffer.replace("@val2l@", str(rstr_val_2-90))
-                tbuffer = tbuffer.replace("@val2h@", str(rstr_val_2+90))
-                w_file.write(tbuffer)
-                w_file.close()
-            except IOError:
-                print "Warning: unable to access file: {0}".format(new_restraints)
-        if umbrellas == 1:
-            try:
-                w_file = open(new_restraints, "w")
-                tbuffer = tbuffer.replace("@val1@", str(rstr_val_1))
-                tbuffer = tbuffer.replace("@val1l@", str(rstr_val_1-90))
-                tbuffer = tbuffer.replace("@val1h@", str(rstr_val_1+90))
-                w_file.write(tbuffer)
-                w_file.close()
-            except IOError:
-                print "Warning: unable to access file: {0}".format(new_restraints)
+            rstr_vals = [rstr_val_1, rstr_val_2]
+        else:
+            rstr_vals = [rstr_val_1]
+        try:
+            render_file(us_template, new_restraints, rstr_values(rstr_vals))
+        except (IOError, OSError):
+            print "Warning: unable to access file: {0}".format(new_restraints)
  
         #-----------------------------------------------------------------------
         # copy to staging area
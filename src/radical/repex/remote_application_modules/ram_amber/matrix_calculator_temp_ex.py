@@ -10,54 +10,11 @@ __license__ = "MIT"
 import os
 import sys
 import json
-import math
 import time
-import fcntl
-import shutil
-
-#-------------------------------------------------------------------------------
-
-def get_historical_data(replica_path, history_name):
-    """reads potential energy from a given .mdinfo file
-
-    Args:
-        replica_path - path to replica directory in RP's staging_area
-
-        history_name - name of .mdinfo file
-
-    Returns:
-        temp - temperature
-        
-        eptot - potential energy
-    """
-
-    home_dir = os.getcwd()
-    if replica_path is not None:
-        path = "../staging_area" + replica_path
-        try:
-            os.chdir(path)
-        except:
-            raise
-
-    temp = 0.0    #temperature
-    eptot = 0.0   #potential
-
-    try:
-        f = open(history_name)
-        lines = f.readlines()
-        f.close()
-        for i,j in enumerate(lines):
-            if "TEMP(K)" in lines[i]:
-                temp = float(lines[i].split()[8])
-            elif "EPtot" in lines[i]:
-                eptot = float(lines[i].split()[8])
-    except:
-        os.chdir(home_dir)
-        raise 
-
-    os.chdir(home_dir)
-    
-    return temp, eptot
+from exchange.mdinfo import get_historical_data
+from exchange.mdinfo import wait_for_history
+from exchange.history import append_history
+from exchange.matrix_io import staging_area
 
 #-------------------------------------------------------------------------------
 
@@ -66,12 +23,12 @@ if __name__ == '__main__':
     a column of a swap matrix for this replica.
 
     For this replica we read .mdinfo file and obtain energy values.
-    Next, we write all necessary data to history_info_temp.dat file, which
+    Next, we write all necessary data to history_info_temp directory, which
     is located in staging_area of this pilot.
 
-    Note: there is only a single instance of history_info_temp.dat file and 
-    each CU associated with some replica is writing to this file (we use locks).
-    Then, CU responsible for exchange calculations reads from that file.
+    Note: each CU associated with some replica is writing a record to its own
+    file in history_info_temp directory, so no locks are needed.
+    Then, CU responsible for exchange calculations reads those records.
     """
 
     json_data = sys.argv[1]
@@ -90,52 +47,20 @@ if __name__ == '__main__':
     history_name = base_name + "_" + replica_id + "_" + replica_cycle + ".mdinfo"
 
     #---------------------------------------------------------------------------
-    success = 0
-    attempts = 0
-    while (success == 0):
-        try:
-            replica_temp, replica_energy = get_historical_data(None, history_name)
-            print "Got history data for self!"
-            success = 1
-        except:
-            print "Waiting for self (history file)"
-            time.sleep(1)
-            attempts += 1
-            if attempts > 10:
-                replica_temp   = -1.0
-                replica_energy = -1.0
-                print "MD run failed for replica {0}".format(replica_id)
-            pass
+    md_data = wait_for_history(get_historical_data, [history_name], attempts=10)
+    if md_data is not None:
+        replica_temp   = md_data['temp']
+        replica_energy = md_data['eptot']
+        print "Got history data for self!"
+    else:
+        replica_temp   = -1.0
+        replica_energy = -1.0
+        print "MD run failed for replica {0}".format(replica_id)
 
     print "rstr_vals: "
     print rstr_vals
 
-    history_str = str(replica_id) + " " + \
-                  str(init_temp) + " " + \
-                  str(replica_energy) + " " + \
-                  str(new_restraints) + " "
-
-    for val in rstr_vals:
-        history_str += str(val) + " "
-    history_str += "\n"
-
-    print "history_str: {0}".format(history_str)
- 
-    pwd = os.getcwd()
-    size = len(pwd)-1
-    path = pwd
-    for i in range(0,size):
-        if pwd[size-i] != '/':
-            path = path[:-1]
-        else:
-            break
-
-    path += "staging_area/history_info_temp.dat" 
-    try:
-        with open(path, "a") as g:
-            fcntl.flock(g, fcntl.LOCK_EX)
-            g.write(history_str)
-            fcntl.flock(g, fcntl.LOCK_UN)
-    except:
-        raise
+    history_fields = [replica_id, init_temp, replica_energy, new_restraints] + list(rstr_vals)
+    print "history_fields: {0}".format(history_fields)
 
+    append_history(staging_area("history_info_temp"), history_fields)
@@ -0,0 +1,120 @@
+"""
+.. module:: radical.repex.remote_application_modules.ram_amber.md_bundle
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import sys
+import json
+import time
+import runpy
+import traceback
+
+# data of post processing RAMs is kept in CU sandbox between pre and post step
+POST_DATA = "md_bundle_post.json"
+
+#-------------------------------------------------------------------------------
+#
+def run_ram(ram, data):
+    """Runs a given RAM in this process with data as it's argument.
+
+    Returns:
+        exit status of RAM
+    """
+
+    script = os.path.join(os.getcwd(), ram)
+    argv = sys.argv
+    status = 0
+    try:
+        sys.argv = [script, json.dumps(data)]
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code is not None:
+            status = 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.argv = argv
+        sys.stdout.flush()
+    return status
+
+#-------------------------------------------------------------------------------
+#
+def pre_step(data):
+    """Runs input_file_builder.py for every replica of a bundle and writes 
+    groupfile with one line of Amber arguments per replica. Data of post 
+    processing RAMs is written to POST_DATA file.
+
+    Args:
+        data - dictionary with list of tasks, each task has 'pre' (data of
+        input_file_builder.py), 'post' ([ram, data] or None) and 'arguments'
+        (Amber arguments of replica)
+
+    Returns:
+        number of failed RAMs
+    """
+
+    failed = 0
+    with open(data.get("groupfile", "groupfile"), 'w') as f:
+        for task in data["tasks"]:
+            if run_ram("input_file_builder.py", task["pre"]) != 0:
+                failed += 1
+            f.write(task["arguments"].strip() + "\n")
+
+    post = [task["post"] for task in data["tasks"] if task.get("post")]
+    with open(POST_DATA, 'w') as f:
+        json.dump(post, f)
+    return failed
+
+#-------------------------------------------------------------------------------
+#
+def post_step():
+    """Runs post processing RAM (matrix calculator) for every replica of a 
+    bundle, as recorded in POST_DATA file by pre_step().
+
+    Returns:
+        number of failed RAMs
+    """
+
+    with open(POST_DATA, 'r') as f:
+        post = json.load(f)
+
+    failed = 0
+    for ram, ram_data in post:
+        if run_ram(ram, ram_data) != 0:
+            failed += 1
+    return failed
+
+#-------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    """This RAM does pre and post processing for a bundle of replicas, which
+    run MD simulation in a single CU, using a single Amber call with a
+    groupfile (-ng option). Per replica RAMs are run in this process, so
+    Python is started only once for pre and once for post processing of all
+    replicas in the bundle.
+
+    pre - runs input_file_builder.py for every replica and writes groupfile
+    with one line of Amber arguments per replica
+
+    post - runs post processing RAM (matrix calculator) for every replica
+    """
+
+    step = sys.argv[1]
+    t_start = time.time()
+    failed = 0
+
+    if step == 'pre':
+        failed = pre_step(json.loads(sys.argv[2]))
+    elif step == 'post':
+        failed = post_step()
+
+    print "Bundle {0} step finished in {1:.3f} s, failed: {2}".format(step, time.time()-t_start, failed)
+    if failed > 0:
+        sys.exit(1)
@@ -12,62 +12,13 @@ import sys
 import json
 import time
 import socket
-
-#-------------------------------------------------------------------------------
-#
-def reduced_energy(temperature, potential):
-    """Calculates reduced energy.
-
-    Args:
-        temperature - replica temperature
-        potential - replica potential energy
-
-    Returns:
-        reduced enery of replica
-    """
-    kb = 0.0019872041    #boltzmann const in kcal/mol
-    if temperature != 0:
-        beta = 1. / (kb*temperature)
-    else:
-        beta = 1. / kb     
-    return float(beta * potential)
-
-#-------------------------------------------------------------------------------
-#
-def get_historical_data(history_name, data_path=os.getcwd()):
-    """reads potential energy from a given .mdinfo file
-
-    Args:
-        data_path - path to replica directory in RP's staging_area
-
-        history_name - name of .mdinfo file
-
-    Returns:
-        eptot - potential energy
-
-        path_to_replica_folder - path to CU sandbox where MD simulation was 
-        executed
-    """
-    home_dir = os.getcwd()
-    os.chdir(data_path)
-
-    temp = 0.0    #temperature
-    eptot = 0.0   #potential
-    try:
-        f = open(history_name)
-        lines = f.readlines()
-        f.close()
-        path_to_replica_folder = os.getcwd()
-        for i,j in enumerate(lines):
-            #if "TEMP(K)" in lines[i]:
-            #    temp = float(lines[i].split()[8])
-            if "EPtot" in lines[i]:
-                eptot = float(lines[i].split()[8])
-    except:
-        raise
-
-    os.chdir(home_dir)
-    return eptot, path_to_replica_folder
+import numpy
+from exchange.acceptance import get_acceptance
+from exchange.mdinfo import get_historical_data
+from exchange.mdinfo import prefetch_historical_data
+from exchange.matrix_io import staging_area
+from exchange.shared_matrix import shared_matrix_name
+from exchange.shared_matrix import write_shared_column
 
 #-------------------------------------------------------------------------------
 #
@@ -100,8 +51,13 @@ if __name__ == '__main__':
 
     #---------------------------------------------------------------------------
 
-    temperatures = [0.0]*replicas  
-    energies = [0.0]*replicas
+    temperatures = numpy.zeros(replicas)
+    energies     = numpy.zeros(replicas)
+
+    # energy files of the whole group are read concurrently, files which are
+    # not available yet are read again below
+    prefetch_historical_data([base_name + "_" + str(j) + "_" + str(replica_cycle) + "_energy.mdinfo" 
+                              for j in current_group_tsu.keys()])
 
     for j in current_group_tsu.keys():
         success = 0
@@ -109,7 +65,7 @@ if __name__ == '__main__':
         while (success == 0):
             energy_history_name = base_name + "_" + str(j) + "_" + str(replica_cycle) + "_energy.mdinfo"
             try:
-                rj_energy, path_to_replica_folder = get_historical_data( energy_history_name )
+                rj_energy = get_historical_data( energy_history_name )['eptot']
                 temperatures[int(j)] = float(init_temp)
                 energies[int(j)] = rj_energy
                 success = 1
@@ -120,30 +76,19 @@ if __name__ == '__main__':
                 if attempts > 5:
                     temperatures[int(j)] = -1.0
                     energies[int(j)] = -1.0
-                    path_to_replica_folder = '/'
                     success = 1
                     print "Replica {0} failed, initialized temperatures[j] and energies[j] to -1.0".format(j)
-                pass
 
-    swap_column = [0.0]*replicas
-    for j in current_group_tsu.keys():       
-        swap_column[int(j)] = reduced_energy(temperatures[int(j)], energies[int(j)])
+    # single point energies of this configuration at salt concentration of
+    # every replica in current group
+    group_idx = numpy.array([int(j) for j in current_group_tsu.keys()], dtype=int)
+    swap_column = numpy.zeros(replicas)
+    swap_column[group_idx] = get_acceptance('salt').swap_column(temperatures[group_idx], 
+                                                                None, 
+                                                                energies[group_idx])
 
     #---------------------------------------------------------------------------
-    # writing to file
-    outfile = "matrix_column_{replica}_{cycle}.dat".format(cycle=replica_cycle, replica=replica_id )
-    with open(outfile, 'w+') as f:
-        row_str = ""
-        for item in swap_column:        
-            if len(row_str) != 0:
-                row_str = row_str + " " + str(item)
-            else:
-                row_str = str(item)   
-        row_str + " " + (str(path_to_replica_folder).rstrip())
-        f.write(row_str)    
-        f.write('\n')
-        row_str = str(replica_id) + " " + str(replica_cycle) + " " + new_restraints + " " + str(init_temp) + " " + str(init_salt)
-        f.write(row_str)
-    f.close()
-  
- 
\ No newline at end of file
+    # writing column directly to swap matrix file in staging_area
+    outfile = staging_area(shared_matrix_name(replica_cycle))
+    info = [replica_id, replica_cycle, new_restraints, init_temp, init_salt]
+    write_shared_column(outfile, replicas, replica_id, swap_column, info)
@@ -12,51 +12,9 @@ import sys
 import json
 import time
 import socket
-
-#-------------------------------------------------------------------------------
-#
-def get_historical_data(replica_path, history_name):
-    """reads potential energy from a given .mdinfo file
-
-    Args:
-        replica_path - path to replica directory in RP's staging_area
-
-        history_name - name of .mdinfo file
-
-    Returns:
-        eptot - potential energy
-
-        path_to_replica_folder - path to directory of a given replica in RP's 
-        staging area
-    """
-
-    home_dir = os.getcwd()
-    if replica_path is not None:
-        path = "../staging_area" + replica_path
-        try:
-            os.chdir(path)
-        except:
-            raise
-
-    temp = 0.0    #temperature
-    eptot = 0.0   #potential
-
-    try:
-        f = open(history_name)
-        lines = f.readlines()
-        f.close()
-        #path_to_replica_folder = os.getcwd()
-        path_to_replica_folder = path
-        for i,j in enumerate(lines):
-            if "EPtot" in lines[i]:
-                eptot = float(lines[i].split()[8])
-    except:
-        os.chdir(home_dir)
-        raise 
-
-    os.chdir(home_dir)
-    
-    return eptot, path_to_replica_folder
+from exchange.mdinfo import get_historical_data
+from exchange.templates import mdin_values
+from exchange.templates import render_file
 
 #-------------------------------------------------------------------------------
 #
@@ -85,11 +43,12 @@ if __name__ == '__main__':
     # getting history data for self
     history_name = base_name + "_" + str(replica_id) + "_" + str(replica_cycle) + ".mdinfo"
     replica_path = "/replica_{0}/".format(str(replica_id))
-    replica_energy, path_to_replica_folder = get_historical_data( replica_path, history_name )
+    md_data = get_historical_data( history_name, replica_path )
+    replica_energy = md_data['eptot']
 
     # FILE ala10_remd_X_X.rst IS IN DIRECTORY WHERE THIS SCRIPT IS LAUNCHED AND CEN BE REFERRED TO AS:
     new_coor_file = "{0}_{1}_{2}.rst".format(base_name, replica_id, replica_cycle)
-    new_coor = path_to_replica_folder + new_coor_file
+    new_coor = os.path.join(md_data['path'], new_coor_file)
 
     f_groupfile = file('groupfile','w')
     # call amber to run 1-step energy calculation
@@ -98,31 +57,10 @@ if __name__ == '__main__':
         energy_history_name = base_name + "_" + j + "_" + str(replica_cycle) + "_energy.mdinfo"
         energy_input_name = base_name + "_" + j + "_" + str(replica_cycle) + "_energy.mdin"
 
-        input_template = mdin_name
-        f = file(input_template,'r')
-        input_data = f.readlines()
-        f.close()
-
         # change nstlim to be zero
-        f = file(energy_input_name,'w')
-        for line in input_data:
-            if "@nstlim@" in line:
-                f.write(line.replace("@nstlim@","0"))
-            elif "@salt@" in line:
-                f.write(line.replace("@salt@",current_group_tsu[j][1]))
-            elif "@temp@" in line:
-                f.write(line.replace("@temp@",current_group_tsu[j][0]))
-            elif "@disang@" in line:
-                f.write(line.replace("@disang@",current_group_tsu[j][2]))
-            elif "@irest@" in line:
-                line = line.replace("@irest@","0")
-                f.write(line)
-            elif "@ntx@" in line:
-                line = line.replace("@ntx@","1")
-                f.write(line)
-            else:
-                f.write(line)
-        f.close()
+        values = mdin_values("0", current_group_tsu[j][0], True,
+                             current_group_tsu[j][2], current_group_tsu[j][1])
+        render_file(mdin_name, energy_input_name, values)
         
         line = ' -O -i ' + energy_input_name + ' -p ' + prmtop_name + ' -c ' + new_coor + ' -inf ' + energy_history_name + '\n'
         f_groupfile.write(line)
@@ -0,0 +1,108 @@
+"""
+.. module:: radical.repex.remote_application_modules.ram_amber.salt_group_post_exec
+.. moduleauthor::  <antons.treikalis@gmail.com>
+.. moduleauthor::  <haoyuan.chen@rutgers.edu>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import sys
+import json
+import numpy
+from exchange.acceptance import get_acceptance
+from exchange.mdinfo import prefetch_historical_data
+from exchange.matrix_io import staging_area
+from exchange.shared_matrix import shared_matrix_name
+from exchange.shared_matrix import write_shared_column
+
+#-------------------------------------------------------------------------------
+#
+def energy_names(base_name, replica_cycle, group, rows):
+    """Returns names of _energy.mdinfo files of SPE calculations, for every
+    replica in rows and every replica of a group (row major order).
+    """
+
+    names = []
+    for i in rows:
+        for j in group:
+            names.append(base_name + "_" + i + "_" + str(replica_cycle) + "_" + j + "_energy.mdinfo")
+    return names
+
+#-------------------------------------------------------------------------------
+#
+def group_columns(records, replicas, current_group_tsu, rows):
+    """Assembles columns of swap matrix of replicas in rows from records of
+    SPE calculations. Failed calculations (record is None) are initialized
+    to -1.0, as in salt_conc_post_exec.py.
+
+    Args:
+        records - list of .mdinfo records in order of energy_names()
+
+        replicas - total number of replicas
+
+        current_group_tsu - dictionary with temperature, salt concentration
+        and restraint file of every replica of a group
+
+        rows - list of ids of replicas, coordinates of which were evaluated
+
+    Returns:
+        list of (replica id, column) tuples
+    """
+
+    group = sorted(current_group_tsu.keys(), key=int)
+    group_idx = numpy.array([int(j) for j in group], dtype=int)
+    acceptance = get_acceptance('salt')
+    size = len(group)
+
+    columns = []
+    for n, i in enumerate(rows):
+        init_temp = float(current_group_tsu[i][0])
+        temperatures = numpy.zeros(size)
+        energies = numpy.zeros(size)
+        for m, j in enumerate(group):
+            record = records[n*size + m]
+            if record is None:
+                temperatures[m] = -1.0
+                energies[m] = -1.0
+                print "Calculation {0}/{1} failed, initialized temperatures[j] and energies[j] to -1.0".format(i, j)
+            else:
+                temperatures[m] = init_temp
+                energies[m] = record['eptot']
+
+        # single point energies of configuration of replica i at salt 
+        # concentration of every replica in current group
+        swap_column = numpy.zeros(replicas)
+        swap_column[group_idx] = acceptance.swap_column(temperatures, None, energies)
+        columns.append((i, swap_column))
+    return columns
+
+#-------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+    """This RAM is executed after Amber call, which calculated single point 
+    energies of replicas in rows of this unit (see salt_group_pre_exec.py). 
+    It reads rows x G _energy.mdinfo files and writes columns of swap matrix 
+    of these replicas to swap matrix file in staging area. All calculations 
+    are done by the same Amber call, so we don't wait for missing files: 
+    failed calculations are initialized to -1.0, as in salt_conc_post_exec.py.
+    """
+   
+    json_data = sys.argv[1]
+    data=json.loads(json_data)
+
+    replica_cycle     = int(data["replica_cycle"])
+    replicas          = int(data["replicas"])
+    base_name         = data["base_name"]
+    current_group_tsu = data["current_group_tsu"]
+
+    group = sorted(current_group_tsu.keys(), key=int)
+    rows = [str(i) for i in data.get("rows", group)]
+
+    records = prefetch_historical_data(energy_names(base_name, replica_cycle, group, rows))
+
+    outfile = staging_area(shared_matrix_name(replica_cycle))
+    for i, swap_column in group_columns(records, replicas, current_group_tsu, rows):
+        info = [i, replica_cycle, current_group_tsu[i][2], current_group_tsu[i][0], current_group_tsu[i][1]]
+        write_shared_column(outfile, replicas, int(i), swap_column, info)
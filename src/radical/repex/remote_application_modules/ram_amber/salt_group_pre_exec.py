@@ -0,0 +1,86 @@
+"""
+.. module:: radical.repex.remote_application_modules.ram_amber.salt_group_pre_exec
+.. moduleauthor::  <antons.treikalis@gmail.com>
+.. moduleauthor::  <haoyuan.chen@rutgers.edu>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import sys
+import json
+from exchange.mdinfo import replica_folder
+from exchange.templates import mdin_values
+from exchange.templates import render_file
+
+#-------------------------------------------------------------------------------
+#
+def write_group_inputs(data, groupfile='groupfile'):
+    """Writes Amber input file for salt concentration of every replica of a
+    group and a groupfile with SPE calculations of coordinates of replicas 
+    in rows of this unit (all replicas of a group if rows are not given) at
+    salt concentration of every replica of a group.
+
+    Args:
+        data - dictionary with data passed to this RAM
+
+        groupfile - name of groupfile
+
+    Returns:
+        number of lines in groupfile
+    """
+
+    replica_cycle     = int(data["replica_cycle"])
+    base_name         = data["base_name"]
+    prmtop_name       = data["amber_parameters"]
+    mdin_name         = data["amber_input"]
+    current_group_tsu = data["current_group_tsu"]
+
+    group = sorted(current_group_tsu.keys(), key=int)
+    rows = [str(i) for i in data.get("rows", group)]
+
+    # one input file per salt concentration (state j)
+    for j in group:
+        energy_input_name = base_name + "_" + j + "_" + str(replica_cycle) + "_energy.mdin"
+
+        # change nstlim to be zero
+        values = mdin_values("0", current_group_tsu[j][0], True,
+                             current_group_tsu[j][2], current_group_tsu[j][1])
+        render_file(mdin_name, energy_input_name, values)
+
+    # coordinates of replica i are evaluated at every state j
+    lines = 0
+    f_groupfile = file(groupfile,'w')
+    for i in rows:
+        coor_file = "{0}_{1}_{2}.rst".format(base_name, i, replica_cycle)
+        new_coor = os.path.join(replica_folder("/replica_{0}/".format(i)), coor_file)
+        for j in group:
+            energy_input_name = base_name + "_" + j + "_" + str(replica_cycle) + "_energy.mdin"
+            energy_name = base_name + "_" + i + "_" + str(replica_cycle) + "_" + j + "_energy"
+            line = ' -O -i ' + energy_input_name + \
+                   ' -p ' + prmtop_name + \
+                   ' -c ' + new_coor + \
+                   ' -o ' + energy_name + '.mdout' + \
+                   ' -r ' + energy_name + '.rst' + \
+                   ' -inf ' + energy_name + '.mdinfo\n'
+            f_groupfile.write(line)
+            lines += 1
+    f_groupfile.close()
+    return lines
+
+#-------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+    """This RAM is executed after MD simulation of all replicas of a group is
+    done and before we call Amber for Single Point Energy (SPE) calculations.
+    It prepares a single groupfile with SPE calculations of coordinates of 
+    replicas in rows of this unit at salt concentration of every replica of 
+    a group (rows x G calculations). Input file is written once per salt 
+    concentration and is shared by all coordinates.
+    """
+    
+    json_data = sys.argv[1]
+    data=json.loads(json_data)
+
+    write_group_inputs(data)
@@ -8,148 +8,18 @@ __license__ = "MIT"
 
 import os
 import sys
-import math
 import json
 import time
-import random
+import numpy
 from mpi4py import MPI
-
-#-------------------------------------------------------------------------------
-
-def reduced_energy(temperature, potential):
-    """Calculates reduced energy.
-
-    Args:
-        temperature - replica temperature
-
-        potential - replica potential energy
-
-    Returns:
-    reduced enery of replica
-    """
-    kb = 0.0019872041
-    # check for division by zero
-    if temperature != 0:
-        beta = 1. / (kb*temperature)
-    else:
-        beta = 1. / kb     
-    return float(beta * potential)
-
-#-------------------------------------------------------------------------------
-#
-def weighted_choice_sub(weights):
-    """Adopted from asyncre-bigjob [1]
-    """
-
-    rnd = random.random() * sum(weights)
-    for i, w in enumerate(weights):
-        rnd -= w
-        if rnd < 0:
-            return i
-
-#-------------------------------------------------------------------------------
-#
-def gibbs_exchange(r_i, replicas, swap_matrix):
-    """Adopted from asyncre-bigjob [1]
-    Produces a replica "j" to exchange with the given replica "i"
-    based off independence sampling of the discrete distribution
-
-    Args:
-        r_i - given replica for which is found partner replica
-
-        replicas - list of Replica objects
-
-        swap_matrix - matrix of dimension-less energies, where each column is a 
-    replica and each row is a state
-
-    Returns:
-        r_j - replica to exchnage parameters with
-    """
-
-    #evaluate all i-j swap probabilities
-    ps = [0.0]*(len(replicas))
-
-    j = 0
-    for r_j in replicas:
-        ps[j] = -(swap_matrix[r_i.sid][r_j.id] + swap_matrix[r_j.sid][r_i.id] - 
-                  swap_matrix[r_i.sid][r_i.id] - swap_matrix[r_j.sid][r_j.id]) 
-        j += 1
-        
-    ######################################
-    new_ps = []
-    for item in ps:
-        if item > math.log(sys.float_info.max): new_item=sys.float_info.max
-        elif item < math.log(sys.float_info.min) : new_item=0.0
-        else :
-            new_item = math.exp(item)
-        new_ps.append(new_item)
-    ps = new_ps
-    # index of swap replica within replicas_waiting list
-    j = len(replicas)
-    while j > (len(replicas) - 1):
-        j = weighted_choice_sub(ps)
-        
-    # guard for errors
-    if j is None:
-        j = random.randint(0,(len(replicas)-1))
-        print "...gibbs exchnage warning: j was None..."
-    # actual replica
-    r_j = replicas[j]
-    ######################################
-
-    return r_j
-
-#-------------------------------------------------------------------------------
-
-def get_historical_data(replica_path, history_name):
-    """reads potential energy from a given .history file
-
-    Args:
-        replica_path - path to staging area of this piot where .history file
-        resides
-
-        history_name - name of .history file
-
-    Returns:
-        temp - temperature
-        
-        eptot - potential energy
-
-        path_to_replica_folder - path to CU sandbox where MD simulation was 
-        executed
-    """
-
-    home_dir = os.getcwd()
-    if replica_path != None:
-        path = "../staging_area" + replica_path
-        try:
-            os.chdir(path)
-        except:
-            raise
-
-    try:
-        f = open(history_name)
-        lines = f.readlines()
-        f.close()
-        path_to_replica_folder = os.getcwd()
-        data = lines[0].split()
-    except:
-        os.chdir(home_dir)
-        pass 
-    #os.chdir("../")
- 
-    os.chdir(home_dir)
-    return float(data[0]), float(data[1]), path_to_replica_folder
-
-#-------------------------------------------------------------------------------
-#
-class Replica(object):
-    """Class representing replica and it's associated data.
-    """
-    def __init__(self, my_id):
-       
-        self.id = int(my_id)
-        self.sid = int(my_id)
+from exchange.engine import do_exchange
+from exchange.acceptance import get_acceptance
+from exchange.acceptance import parse_temperatures
+from exchange.mdinfo import get_namd_historical_data
+from exchange.mdinfo import wait_for_history
+from exchange.matrix_io import write_pairs
+from exchange.matrix_io import merge_rank_records
+from exchange.replica import Replica
 
 #-------------------------------------------------------------------------------
 
@@ -160,7 +30,7 @@ if __name__ == '__main__':
     swap_matrix. 
     Then for each replica we create a replica object to hold
     data associated with that replica. 
-    Next, we call gibbs_exchange() to calculate pairs of replicas, which will 
+    Next, we call do_exchange() to calculate pairs of replicas, which will 
     exchange parameters and finaly we write obtaned pairs of replicas to
     pairs_for_exchange_d_c.dat file. 
     """
@@ -175,15 +45,7 @@ if __name__ == '__main__':
     base_name     = str(sys.argv[3])
     temps         = str(sys.argv[4])
 
-    tmp = temps.split(' ')
-    tmp.pop(0)
-    # init swap column
-    swap_column = [0.0]*replicas
-    temperatures = [0.0]*replicas
-    energies = [0.0]*replicas
-
-    for i in range(replicas):
-        temperatures[i] = float(tmp[i])
+    temperatures = parse_temperatures(temps, replicas)
 
     print "temperatures: {0}".format( temperatures )
 
@@ -214,86 +76,36 @@ if __name__ == '__main__':
         print "r_ids: "
         print r_ids
 
-    all_temperatures = [0.0]*replicas
-    all_energies = [0.0]*replicas
-
     comm.Barrier()
 
     #---------------------------------------------------------------------------
-    id_number = 0
+    records = []
     for replica_id in r_ids[rank]:
-        temperatures = [0.0]*replicas
-        energies = [0.0]*replicas
         # getting history data for self
         history_name = base_name + "_" + str(replica_id) + "_" + str(current_cycle) + ".history"
         
-        success = 0
-        attempts = 0
-        while (success == 0):
-            try:
-                replica_path = "/"
-                # old
-                #replica_temp, replica_energy, path_to_replica_folder = get_historical_data( history_name )
-                replica_temp, replica_energy, path_to_replica_folder = get_historical_data(replica_path, history_name)
-                #temperatures[replica_id] = replica_temp
-                energies[replica_id] = replica_energy
-
-                print "rank: {0} temp: {1} energy: {2}".format(rank, replica_temp, replica_energy)
-                #temperatures = comm.gather(replica_temp, root=0)
-                energies     = comm.gather(replica_energy, root=0)
+        replica_path = "/"
+        history = wait_for_history(get_namd_historical_data, [history_name, replica_path])
+        if history is not None:
+            replica_temp, replica_energy, path_to_replica_folder = history
+            print "rank: {0} temp: {1} energy: {2}".format(rank, replica_temp, replica_energy)
+            print "rank {0}: Got history data for replica {1}".format(rank, replica_id)
+        else:
+            print "rank {0}: NAMD run failed for replica {1}, using zero energy".format(rank, replica_id)
+            replica_energy = 0.0
 
+        records.append([replica_id, replica_energy])
 
-                if rank == 0:  
-                    for r in range(size):
-                        index = r_ids[r][id_number]
-                        print "index: %d" % index
-                        all_temperatures[index] = temperatures[r]
-                        all_energies[index] = energies[r] 
-
-                print "rank {0}: Got history data for self!".format(rank)
-                success = 1
-                id_number += 1
-            except:
-                print "rank {0}: Waiting for self (history file)".format(rank)
-                time.sleep(1)
-                attempts += 1
-                if attempts >= 3:
-                    print "rank {0}: Amber run failed, matrix_swap_column_x_x.dat populated with zeros".format(rank)
-
-                    #-----------------------------------------------------------
-                    # temp fix
-                    replica_temp = 0.0
-                    replica_energy = 0.0
-                    temperatures = comm.gather(replica_temp, root=0)
-                    energies     = comm.gather(replica_energy, root=0)
-                    #-----------------------------------------------------------
- 
-                    success = 1
-                pass
+    records = comm.gather(records, root=0)
 
     #---------------------------------------------------------------------------
+    if rank == 0:
+        all_energies, = merge_rank_records(records, replicas, 1)
 
-    all_temperatures = comm.bcast(all_temperatures, root=0)
-    all_energies = comm.bcast(all_energies, root=0)
-
-    #---------------------------------------------------------------------------
-    if rank ==0:
-        swap_matrix = []
-        temp_columns = [[0.0]*replicas]*replicas
-
-    for replica_id in r_ids[rank]:
-        swap_column = [0.0]*replicas
-        for j in range(replicas):
-            swap_column[j] = reduced_energy(all_temperatures[j], all_energies[replica_id])
-
-        temp_columns = comm.gather(swap_column, root=0)
-
-        if rank == 0:
-            for col in temp_columns:
-                swap_matrix.append(col)
+        # element [j][i] is reduced energy of replica i at temperature of 
+        # replica j
+        swap_matrix = get_acceptance('temperature').swap_matrix(temperatures, all_energies)
 
-    #---------------------------------------------------------------------------
-    if rank == 0:
         replicas_obj = []
         for rid in range(replicas):
             # creating replica with dummy temperature, since it is not needed
@@ -301,28 +113,12 @@ if __name__ == '__main__':
             replicas_obj.append(r)
 
         #-----------------------------------------------------------------------
-        exchange_list = []
-        for r_i in replicas_obj:
-            r_j = gibbs_exchange(r_i, replicas_obj, swap_matrix)
-            if (r_j != r_i):
-                exchange_pair = []
-                exchange_pair.append(r_i.id)
-                exchange_pair.append(r_j.id)
-                exchange_list.append(exchange_pair)
+        exchange_list = do_exchange(replicas_obj, swap_matrix)
             
         #-----------------------------------------------------------------------
         # writing to file
+        outfile = "pairs_for_exchange_{cycle}.dat".format(cycle=current_cycle)
         try:
-            outfile = "pairs_for_exchange_{cycle}.dat".format(cycle=current_cycle)
-            with open(outfile, 'w+') as f:
-                for pair in exchange_list:
-                    if pair:
-                        row_str = str(pair[0]) + " " + str(pair[1]) 
-                        f.write(row_str)
-                        f.write('\n')
-            f.close()
-
+            write_pairs(outfile, exchange_list)
         except IOError:
-            print 'Error: unable to create column file %s for replica %s' % \
-            (outfile, replica_id)
-
+            print 'Error: unable to create file %s' % (outfile)
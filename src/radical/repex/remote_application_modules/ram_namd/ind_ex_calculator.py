@@ -9,55 +9,13 @@ __license__ = "MIT"
 import os
 import sys
 import json
-
-#-------------------------------------------------------------------------------
-
-def reduced_energy(temperature, potential):
-    """Calculates reduced energy.
-
-    Args:
-        temperature - replica temperature
-
-        potential - replica potential energy
-
-    Returns:
-        reduced enery of replica
-    """
-    kb = 0.0019872041
-    # check for division by zero
-    if temperature != 0:
-        beta = 1. / (kb*temperature)
-    else:
-        beta = 1. / kb     
-    return float(beta * potential)
-
-#-------------------------------------------------------------------------------
-
-def get_historical_data(history_name):
-    """reads potential energy from a given .history file
-
-    Args:
-        history_name - name of .history file
-
-    Returns:
-        temp - temperature
-        
-        eptot - potential energy
-
-        path_to_replica_folder - path to CU sandbox where MD simulation was 
-        executed
-    """
-
-    try:
-        f = open(history_name)
-        lines = f.readlines()
-        f.close()
-        path_to_replica_folder = os.getcwd()
-        data = lines[0].split()
-    except:
-        raise
-    
-    return float(data[0]), float(data[1]), path_to_replica_folder
+import numpy
+from exchange.acceptance import get_acceptance
+from exchange.acceptance import parse_temperatures
+from exchange.mdinfo import get_namd_historical_data
+from exchange.matrix_io import staging_area
+from exchange.shared_matrix import shared_matrix_name
+from exchange.shared_matrix import write_shared_column
 
 #-------------------------------------------------------------------------------
 
@@ -74,40 +32,14 @@ if __name__ == '__main__':
     base_name     = data["basename"]
     temps         = data["temperatures"]
 
-    tmp = temps.split(' ')
-    tmp.pop(0)
-
-    temperatures = [0.0]*replicas
-    energies = [0.0]*replicas
-
-    for i in range(replicas):
-        temperatures[i] = float(tmp[i])
+    temperatures = parse_temperatures(temps, replicas)
 
-    pwd = os.getcwd()
-
-    # getting history data for self
+    # getting history data for self, history files of other replicas are not
+    # needed for temperature exchange
     history_name = base_name + "_" + replica_id + "_" + replica_cycle + ".history"
-    replica_temp, replica_energy, path_to_replica_folder = get_historical_data( history_name )
-
-    # getting history data for all replicas
-    # we rely on the fact that last cycle for every replica is the same, e.g. == replica_cycle
-    # but this is easily changeble for arbitrary cycle numbers
-
-    for j in range(replicas):
-        history_name = base_name + "_" + str(j) + "_" + replica_cycle + ".history" 
-        print "history_name: {0}".format(history_name)
-        try:
-            rj_temp, rj_energy, pth = get_historical_data( history_name )
-            #temperatures[j] = rj_temp
-            energies[j] = rj_energy
-        except:
-             pass 
+    replica_temp, replica_energy, path_to_replica_folder = get_namd_historical_data( history_name )
 
-    # init swap column
-    swap_column = [0.0]*replicas
-
-    for j in range(replicas):        
-        swap_column[j] = reduced_energy(temperatures[j], replica_energy)
+    swap_column = get_acceptance('temperature').swap_column(temperatures, replica_energy)
 
     for item in swap_column:
         print item,    
@@ -115,21 +47,9 @@ if __name__ == '__main__':
     # printing path
     print str(path_to_replica_folder).rstrip()
 
+    # writing column directly to swap matrix file in staging_area
+    outfile = staging_area(shared_matrix_name(replica_cycle))
     try:
-        outfile = "matrix_column_{id}_{cycle}.dat".format(id=replica_id, cycle=replica_cycle)
-        with open(outfile, 'w+') as f:
-            row_str = ""
-            for item in swap_column:
-                if len(row_str) != 0:
-                    row_str = row_str + " " + str(item)
-                else:
-                    row_str = str(item)
-            f.write(row_str)
-            f.write('\n')
-            row_str = replica_id + " " + replica_cycle
-            f.write(row_str)
-        f.close()
-
+        write_shared_column(outfile, replicas, int(replica_id), swap_column, [replica_id, replica_cycle])
     except IOError:
         print 'Error: unable to create column file %s for replica %s' % (outfile, replica_id)
-
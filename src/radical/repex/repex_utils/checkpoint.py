@@ -0,0 +1,280 @@
+"""
+.. module:: radical.repex.repex_utils.checkpoint
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import copy
+import Queue
+import pickle
+import threading
+import numpy as np
+
+JOURNAL_FILE = "simulation_journal.pkl"
+
+# ReplicaStore attributes, which are saved in journal
+ARRAY_FIELDS = ['sids', 'state', 'cycle', 'sim_cycle', 'cur_dim', 'swap',
+                'group_idx', 'params', 'old_params']
+LIST_FIELDS  = ['new_restraints', 'coor_file', 'old_path']
+
+# usually all replicas advance these counters at once
+SHIFT_FIELDS = ['cycle', 'sim_cycle']
+
+#-------------------------------------------------------------------------------
+#
+def diff_store(old, new):
+    """Determines items of replica store, which have changed since last
+    checkpoint.
+
+    Args:
+        old - ReplicaStore object at last checkpoint
+
+        new - current ReplicaStore object
+
+    Returns:
+        dictionary where key is name of ReplicaStore attribute and value is
+        either ('shift', delta) if all items were changed by the same delta or
+        ('set', indexes, values) with indexes and new values of changed items
+    """
+
+    changes = {}
+    for name in ARRAY_FIELDS:
+        a = getattr(old, name)
+        b = getattr(new, name)
+        if name in SHIFT_FIELDS and len(b):
+            delta = b - a
+            if delta.min() == delta.max():
+                if delta[0] != 0:
+                    changes[name] = ('shift', int(delta[0]))
+                continue
+        changed = np.nonzero((a != b).reshape(len(b), -1).any(axis=1))[0]
+        if len(changed):
+            changes[name] = ('set', changed, b[changed].copy())
+
+    for name in LIST_FIELDS:
+        a = getattr(old, name)
+        b = getattr(new, name)
+        changed = [i for i in range(len(b)) if a[i] != b[i]]
+        if changed:
+            changes[name] = ('set', changed, [b[i] for i in changed])
+
+    return changes
+
+#-------------------------------------------------------------------------------
+#
+def apply_changes(store, changes):
+    """Applies changes obtained with diff_store() to a given replica store.
+
+    Args:
+        store - ReplicaStore object
+
+        changes - dictionary returned by diff_store()
+    """
+
+    for name, change in changes.items():
+        values = getattr(store, name)
+        if change[0] == 'shift':
+            values += change[1]
+        elif name in LIST_FIELDS:
+            for i, v in zip(change[1], change[2]):
+                values[i] = v
+        else:
+            values[change[1]] = change[2]
+
+#-------------------------------------------------------------------------------
+
+class CheckpointJournal(object):
+    """Append-only checkpoint of the simulation. After every dimension step we
+    append to the journal file only items of replica store, which have changed
+    during this step, together with the restart object. Every
+    snapshot_interval steps a full copy of replica store is appended, so that
+    recovery does not have to replay the whole simulation.
+
+    Journal file is a sequence of pickled records:
+        ('snapshot', dimension, cycle, store, restart_object)
+        ('step', dimension, cycle, changes, restart_object)
+
+    If background writer is started, commit() only copies replica store and
+    restart object, records are computed and written by writer thread in the
+    order of commits.
+
+    Attributes:
+        path - name of the journal file
+
+        snapshot_interval - number of steps between full snapshots
+
+        steps - number of steps since last snapshot
+
+        last - copy of replica store at last checkpoint
+
+        queue - queue of pending commits, None if background writer is not
+        running
+
+        error - exception raised by background writer
+    """
+
+    def __init__(self, path, snapshot_interval=10):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.steps = 0
+        self.last = None
+        self.queue = None
+        self.writer = None
+        self.error = None
+
+    def reset(self):
+        """Removes journal file of a previous simulation.
+        """
+
+        self.wait()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.steps = 0
+        self.last = None
+
+    def start_writer(self):
+        """Starts background thread, which writes records of subsequent
+        commits.
+        """
+
+        if self.writer is not None:
+            return
+        self.queue = Queue.Queue()
+        self.writer = threading.Thread(target=self._write_records)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def stop_writer(self):
+        """Waits until all pending records are written and stops background
+        thread.
+        """
+
+        if self.writer is None:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.writer = None
+        self.queue = None
+        self._check_error()
+
+    def wait(self):
+        """Waits until all pending records are written.
+        """
+
+        if self.queue is not None:
+            self.queue.join()
+        self._check_error()
+
+    def _check_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def _write_records(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self._write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def commit(self, dimension, cycle, store, restart_object):
+        """Appends a record for a given dimension step to the journal file.
+        First record written by this object is always a snapshot. If
+        background writer is running, record is written asynchronously.
+
+        Args:
+            dimension - index of the current dimension
+
+            cycle - current simulation cycle
+
+            store - ReplicaStore object
+
+            restart_object - Restart object
+        """
+
+        if self.writer is None:
+            self._write(dimension, cycle, store, restart_object)
+        else:
+            self._check_error()
+            # both objects are modified by next dimension step, while record
+            # is being written
+            self.queue.put((dimension,
+                            cycle,
+                            copy.deepcopy(store),
+                            copy.deepcopy(restart_object),
+                            True))
+
+    def _write(self, dimension, cycle, store, restart_object, owned=False):
+        if (self.last is None) or (self.steps >= self.snapshot_interval):
+            record = ('snapshot', dimension, cycle, store, restart_object)
+            self.steps = 0
+        else:
+            changes = diff_store(self.last, store)
+            record = ('step', dimension, cycle, changes, restart_object)
+        self.steps += 1
+
+        with open(self.path, 'ab') as output:
+            pickle.dump(record, output, pickle.HIGHEST_PROTOCOL)
+
+        if owned:
+            self.last = store
+        else:
+            self.last = copy.deepcopy(store)
+
+#-------------------------------------------------------------------------------
+#
+def replay_journal(path, cycle=None, dimension=None):
+    """Restores simulation state from a journal file written by
+    CheckpointJournal. Restored state is the state after the last record for
+    a given cycle (and dimension, if specified). If cycle is not specified,
+    state after the last complete record is restored.
+
+    Args:
+        path - name of the journal file
+
+        cycle - simulation cycle to restore
+
+        dimension - index of dimension to restore
+
+    Returns:
+        store - restored ReplicaStore object
+
+        restart_object - restored Restart object
+
+        or None if no record matches
+    """
+
+    store = None
+    found = None
+    with open(path, 'rb') as input:
+        while True:
+            try:
+                record = pickle.load(input)
+            except (EOFError, pickle.UnpicklingError):
+                # end of file or partially written record
+                break
+            kind, r_dim, r_cycle, data, restart_object = record
+            if kind == 'snapshot':
+                store = data
+            elif store is not None:
+                apply_changes(store, data)
+            else:
+                continue
+
+            if cycle is None:
+                found = (store, restart_object)
+            elif (r_cycle == cycle) and (dimension is None or r_dim == dimension):
+                # store is modified by following records
+                found = (copy.deepcopy(store), restart_object)
+
+    return found
@@ -0,0 +1,122 @@
+"""
+.. module:: radical.repex.repex_utils.md_tracker
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+#-------------------------------------------------------------------------------
+
+class MdTracker(object):
+    """Keeps track of submitted MD units of asynchronous RE pattern and of
+    replicas which finished MD. Finished replicas are grouped by their group
+    index and dimension, since replicas can exchange only within a group.
+    Each replica must have a partner, so only an even number of replicas of
+    each group can proceed to exchange, remaining replicas wait for the next
+    exchange.
+
+    Attributes:
+        units - dictionary where key is uid of MD unit and value is a list of
+        (replica, (group index, dimension), submission time), one item per
+        replica of a unit (bundled units have several replicas)
+
+        ready_groups - dictionary where key is (group index, dimension) and
+        value is a list of replicas, which finished MD
+
+        completed - number of replicas in ready_groups, which can proceed to
+        exchange
+    """
+
+    def __init__(self):
+        self.units = {}
+        self.ready_groups = {}
+        self.completed = 0
+
+    def __len__(self):
+        """Returns number of running MD units.
+        """
+
+        return len(self.units)
+
+    def add(self, uid, bundle, now):
+        """Adds submitted MD unit.
+
+        Args:
+            uid - uid of MD unit
+
+            bundle - list of replicas, which run MD in this unit
+
+            now - submission time
+        """
+
+        self.units[uid] = [(r, (r.group_idx[r.cur_dim-1], r.cur_dim), now) for r in bundle]
+
+    def running(self):
+        """Returns list of ('md', replica, submission time) of replicas with
+        running MD, as used by RuntimeModel.
+        """
+
+        running = []
+        for items in self.units.values():
+            for r, key, start in items:
+                running.append(('md', r, start))
+        return running
+
+    def group_sizes(self):
+        """Returns list with number of replicas of each group, which finished
+        or can still finish MD.
+        """
+
+        sizes = dict([(key, len(group)) for key, group in self.ready_groups.items()])
+        for items in self.units.values():
+            for r, key, start in items:
+                sizes[key] = sizes.get(key, 0) + 1
+        return sizes.values()
+
+    def complete(self, uid, now, failed=False):
+        """Moves replicas of a given MD unit to ready_groups. Unit which is
+        not tracked (or was already completed) is ignored. Replicas of failed
+        unit proceed to exchange too, so the unit is not waited for forever.
+
+        Args:
+            uid - uid of MD unit, which reached a final state
+
+            now - completion time
+
+            failed - True if unit reached Failed or Canceled state
+
+        Returns:
+            list of (replica, runtime) of replicas of this unit, empty for
+            failed unit, since its runtime tells nothing about MD runtime
+        """
+
+        done = []
+        for r, key, start in self.units.pop(uid, []):
+            group = self.ready_groups.setdefault(key, list())
+            # only even number of replicas of each group is counted
+            self.completed -= (len(group) / 2) * 2
+            group.append(r)
+            self.completed += (len(group) / 2) * 2
+            if not failed:
+                done.append((r, now - start))
+        return done
+
+    def take(self):
+        """Removes replicas, which can proceed to exchange, from ready_groups.
+        Replicas without a partner stay in ready_groups until next exchange.
+
+        Returns:
+            list of replicas
+        """
+
+        exchange_replicas = list()
+        for key in sorted(self.ready_groups.keys()):
+            group = self.ready_groups[key]
+            nr_ex = (len(group) / 2) * 2
+            exchange_replicas += group[:nr_ex]
+            del group[:nr_ex]
+            if not group:
+                del self.ready_groups[key]
+        self.completed = 0
+        return exchange_replicas
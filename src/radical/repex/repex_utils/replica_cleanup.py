@@ -35,7 +35,7 @@ def move_output_files(work_dir_local, md_kernel, replicas):
             raise
 
     pairs_name = "pairs_for_exchange_"
-    obj_name   = "simulation_objects_"
+    obj_name   = "simulation_journal"
     files = os.listdir( work_dir_local )
 
     for item in files:
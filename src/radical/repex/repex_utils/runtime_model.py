@@ -0,0 +1,139 @@
+"""
+.. module:: radical.repex.repex_utils.runtime_model
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+#-------------------------------------------------------------------------------
+
+class RuntimeModel(object):
+    """Predicts runtimes of units of replicas. Runtime of a unit is split into
+    MD time, which depends on parameters of a replica (e.g. replicas at high
+    temperature run slower), and overhead (staging, launching), which is the
+    same for all units of a given kind. MD time is taken from Elapsed(s) in
+    .mdinfo file, if it is available, otherwise from unit runtime minus
+    overhead. Estimates are exponentially weighted averages per parameter
+    window (parameters of a replica in all dimensions), per replica and per
+    kind of unit.
+
+    Attributes:
+        alpha - weight of a new observation
+
+        default - runtime returned if there are no observations
+
+        by_window - dictionary where key is (kind, window) and value is
+        estimated MD time
+
+        by_replica - dictionary where key is (kind, replica id) and value is
+        estimated MD time
+
+        by_kind - dictionary where key is kind and value is estimated MD time
+
+        overhead - dictionary where key is kind and value is estimated overhead
+    """
+
+    def __init__(self, alpha=0.5, default=1.0):
+        self.alpha = alpha
+        self.default = default
+        self.by_window = {}
+        self.by_replica = {}
+        self.by_kind = {}
+        self.overhead = {}
+
+    def _update(self, table, key, value):
+        if key in table:
+            table[key] += self.alpha * (value - table[key])
+        else:
+            table[key] = value
+
+    @staticmethod
+    def window(replica):
+        """Returns parameter window of a given replica.
+        """
+
+        return tuple(replica.store.params[replica.idx])
+
+    def observe(self, kind, replica, runtime, md_time=None):
+        """Updates estimates with runtime of a completed unit. Must be called
+        before parameters of a replica are exchanged.
+
+        Args:
+            kind - kind of unit, e.g. 'md' or 'ex'
+
+            replica - Replica object
+
+            runtime - runtime of a unit in seconds
+
+            md_time - MD time of a unit in seconds, if known
+        """
+
+        if md_time is not None:
+            self._update(self.overhead, kind, max(runtime - md_time, 0.0))
+        else:
+            md_time = max(runtime - self.overhead.get(kind, 0.0), 0.0)
+
+        self._update(self.by_window, (kind, self.window(replica)), md_time)
+        self._update(self.by_replica, (kind, replica.id), md_time)
+        self._update(self.by_kind, kind, md_time)
+
+    def predict(self, kind, replica):
+        """Returns predicted runtime of the next unit of a given replica.
+        Estimate of the current window of a replica is used first, then
+        estimate of a replica and then of a kind of units.
+
+        Args:
+            kind - kind of unit, e.g. 'md' or 'ex'
+
+            replica - Replica object
+
+        Returns:
+            runtime in seconds
+        """
+
+        md_time = self.by_window.get((kind, self.window(replica)))
+        if md_time is None:
+            md_time = self.by_replica.get((kind, replica.id))
+        if md_time is None:
+            md_time = self.by_kind.get(kind)
+        if md_time is None:
+            return self.default
+        return md_time + self.overhead.get(kind, 0.0)
+
+    def expected_wait(self, running, count, now):
+        """Returns time until a given number of running units is predicted to
+        complete.
+
+        Args:
+            running - list of (kind, replica, start time) of running units
+
+            count - number of units
+
+            now - current time
+
+        Returns:
+            time in seconds or None if fewer than count units are running
+        """
+
+        if count > len(running):
+            return None
+        if count <= 0:
+            return 0.0
+        finish = sorted([start + self.predict(kind, r) for kind, r, start in running])
+        return max(finish[count-1] - now, 0.0)
+
+    def completed_by(self, running, deadline):
+        """Returns number of running units, which are predicted to complete
+        before a given time.
+
+        Args:
+            running - list of (kind, replica, start time) of running units
+
+            deadline - time
+
+        Returns:
+            integer
+        """
+
+        return len([r for kind, r, start in running if start + self.predict(kind, r) <= deadline])
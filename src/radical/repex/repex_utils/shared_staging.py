@@ -0,0 +1,208 @@
+"""
+.. module:: radical.repex.repex_utils.shared_staging
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import os
+import sys
+import json
+import shutil
+import tarfile
+import hashlib
+
+# names of files in staging area of the pilot
+ARCHIVE = "shared_data.tar.gz"
+INDEX   = "shared_data.json"
+MISSING = "shared_data_missing.json"
+
+# directory in staging area, where unpacked files are kept if there is no
+# persistent cache on the target resource
+STORE = ".shared_data"
+
+#-------------------------------------------------------------------------------
+#
+def url_path(url):
+    """Returns local path of a given file:// url.
+    """
+
+    if url.startswith('file://'):
+        return url[len('file://'):]
+    return url
+
+#-------------------------------------------------------------------------------
+#
+def file_digest(path, block=1048576):
+    """Returns SHA1 digest of content of a given file.
+    """
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            sha.update(data)
+    return sha.hexdigest()
+
+#-------------------------------------------------------------------------------
+#
+def build_archive(names, paths, archive_path, index_path, cached=()):
+    """Packs given files into a single compressed archive. Content of each
+    file is stored once under it's digest, so files with equal content (e.g.
+    coordinate files of different replicas) and files which are already in
+    cache of the target resource are not transferred. Index file maps names
+    of files in staging area to digests.
+
+    Args:
+        names - list of names of files in staging area
+
+        paths - list of local paths of these files
+
+        archive_path - path to archive which is created
+
+        index_path - path to index file which is created
+
+        cached - digests which are already in cache of the target resource
+
+    Returns:
+        list with digests of all files (same order as names) and list with
+        digests which were packed into archive
+    """
+
+    digests = []
+    packed = []
+    tar = tarfile.open(archive_path, 'w:gz')
+    try:
+        for name, path in zip(names, paths):
+            digest = file_digest(path)
+            digests.append(digest)
+            if (digest not in cached) and (digest not in packed):
+                tar.add(path, arcname=digest)
+                packed.append(digest)
+    finally:
+        tar.close()
+
+    with open(index_path, 'w') as f:
+        json.dump({'files': zip(names, digests)}, f)
+
+    return digests, packed
+
+#-------------------------------------------------------------------------------
+#
+def load_manifest(path, key):
+    """Returns digests of files, which were unpacked to a given cache in
+    previous simulations.
+
+    Args:
+        path - path to manifest file
+
+        key - key of cache, e.g. resource and path to cache
+
+    Returns:
+        set of digests
+    """
+
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return set()
+    return set(manifest.get(key, []))
+
+#-------------------------------------------------------------------------------
+#
+def save_manifest(path, key, digests):
+    """Records digests of files, which are in a given cache.
+    """
+
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+    manifest[key] = sorted(digests)
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+
+#-------------------------------------------------------------------------------
+#
+def unpack(archive_path, index_path, staging, cache=None):
+    """Unpacks archive created by build_archive() and places files under
+    their names into staging area. Files are hard linked from store (cache
+    or STORE directory in staging area), or copied if linking fails.
+
+    Args:
+        archive_path - path to archive
+
+        index_path - path to index file
+
+        staging - path to staging area
+
+        cache - path to persistent cache on the target resource or None
+
+    Returns:
+        list with names of files which are neither in archive nor in cache
+    """
+
+    if cache is None:
+        cache = os.path.join(staging, STORE)
+    if not os.path.isdir(cache):
+        os.makedirs(cache)
+
+    tar = tarfile.open(archive_path, 'r:gz')
+    try:
+        for member in tar.getmembers():
+            # only plain files named by digest are extracted
+            if member.isfile() and (os.path.basename(member.name) == member.name):
+                src = tar.extractfile(member)
+                tmp = os.path.join(cache, member.name + ".part")
+                with open(tmp, 'wb') as f:
+                    shutil.copyfileobj(src, f)
+                os.rename(tmp, os.path.join(cache, member.name))
+    finally:
+        tar.close()
+
+    with open(index_path, 'r') as f:
+        files = json.load(f)['files']
+
+    missing = []
+    for name, digest in files:
+        src = os.path.join(cache, digest)
+        if not os.path.isfile(src):
+            missing.append(name)
+            continue
+        dest = os.path.join(staging, name)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+    return missing
+
+#-------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    """Runs in a compute unit sandbox and unpacks shared data archive into
+    staging area of the pilot. Names of files which could not be placed are
+    written to MISSING file.
+
+    Arguments: archive, index and optionally path to persistent cache
+    """
+
+    archive_path = sys.argv[1]
+    index_path = sys.argv[2]
+    if len(sys.argv) > 3:
+        cache = sys.argv[3]
+    else:
+        cache = None
+
+    staging = os.path.join(os.path.dirname(os.getcwd()), "staging_area")
+    missing = unpack(archive_path, index_path, staging, cache)
+    with open(MISSING, 'w') as f:
+        json.dump(missing, f)
@@ -0,0 +1,122 @@
+"""
+.. module:: radical.repex.repex_utils.unit_packer
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+import heapq
+
+#-------------------------------------------------------------------------------
+
+class UnitPacker(object):
+    """Schedules units of a simulation step on a pilot with a fixed number of
+    cores. Each unit is an item with number of cores and estimated runtime.
+    Pending units are released longest first, as soon as enough cores are
+    free, shorter units are used to fill remaining cores (backfill). Units
+    can belong to a group, completion of the last unit of a group is reported
+    by release().
+
+    Attributes:
+        cores - number of cores of the pilot
+
+        free - number of currently free cores
+
+        pending - heap of (-estimate, sequence number, key) of units which
+        are not released yet
+
+        units - dictionary where key is unit key and value is
+        (cores, group, item)
+
+        running - set of keys of released units
+
+        group_units - dictionary where key is group and value is number of
+        not completed units of that group
+    """
+
+    def __init__(self, cores):
+        self.cores = cores
+        self.free = cores
+        self.pending = []
+        self.units = {}
+        self.running = set()
+        self.group_units = {}
+        self.seq = 0
+
+    def __len__(self):
+        """Returns number of pending and running units.
+        """
+
+        return len(self.units)
+
+    def add(self, key, cores, estimate, item, group=None):
+        """Adds unit to this packer.
+
+        Args:
+            key - unique key of a unit, e.g. replica id
+
+            cores - number of cores used by a unit
+
+            estimate - estimated runtime of a unit
+
+            item - object associated with a unit, returned by next_units()
+
+            group - group of a unit or None
+        """
+
+        if key in self.units:
+            raise ValueError("Unit %s is already added" % key)
+        self.units[key] = (cores, group, item)
+        if group is not None:
+            self.group_units[group] = self.group_units.get(group, 0) + 1
+        heapq.heappush(self.pending, (-float(estimate), self.seq, key))
+        self.seq += 1
+
+    def next_units(self):
+        """Releases pending units which fit into free cores. If no unit is
+        running, the longest pending unit is released even if it needs more
+        cores than the pilot has.
+
+        Returns:
+            list of (key, item) of released units, longest first
+        """
+
+        released = []
+        skipped = []
+        while self.pending and self.free > 0:
+            entry = heapq.heappop(self.pending)
+            key = entry[2]
+            cores = self.units[key][0]
+            if cores <= self.free or (len(self.running) == 0 and len(released) == 0):
+                self.running.add(key)
+                self.free -= cores
+                released.append((key, self.units[key][2]))
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.pending, entry)
+
+        return released
+
+    def release(self, key):
+        """Marks released unit as completed and frees it's cores.
+
+        Args:
+            key - key of a unit
+
+        Returns:
+            group of a unit if it was the last unit of that group, otherwise
+            None
+        """
+
+        self.running.remove(key)
+        cores, group, item = self.units.pop(key)
+        self.free = min(self.free + cores, self.cores)
+        if group is None:
+            return None
+        self.group_units[group] -= 1
+        if self.group_units[group] == 0:
+            del self.group_units[group]
+            return group
+        return None
@@ -0,0 +1,183 @@
+"""
+.. module:: radical.repex.repex_utils.wait_controller
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+# throughput - maximize number of completed MD units per second
+# exchange_rate - maximize number of accepted exchanges per hour
+OBJECTIVES = ['throughput', 'exchange_rate']
+
+#-------------------------------------------------------------------------------
+#
+def wait_size_limit(wait_ratio, replicas, group_sizes):
+    """Returns wait size of asynchronous RE: exchange starts when more than 
+    wait size completed replicas can be paired. Wait size is limited, so 
+    that it can be reached with replicas which are running MD or are waiting 
+    for exchange (only even number of replicas of each group can be paired).
+
+    Args:
+        wait_ratio - fraction of replicas to wait for
+
+        replicas - total number of replicas
+
+        group_sizes - list with number of replicas of each group, which are
+        running MD or are waiting for exchange
+
+    Returns:
+        integer
+    """
+
+    size = int(replicas * wait_ratio)
+    if size == 0:
+        size = 2
+    pairable = sum([(n / 2) * 2 for n in group_sizes])
+    return min(size, pairable - 1)
+
+#-------------------------------------------------------------------------------
+
+class WaitRatioController(object):
+    """Tunes wait ratio of asynchronous RE online. Every interval exchange
+    rounds score of the chosen objective is measured over elapsed wall-clock
+    time and wait ratio is moved by step in the direction which improved the
+    score (if score dropped, direction is reversed). Wait ratio is kept
+    between min_ratio and max_ratio. Additionally it is not set below the
+    fraction of replicas which complete MD during one exchange round, since
+    those replicas have to wait anyway.
+
+    Attributes:
+        wait_ratio - current wait ratio
+
+        replicas - total number of replicas
+
+        objective - one of OBJECTIVES
+
+        history - list of dictionaries with time, wait ratio and metrics
+        measured at every update
+    """
+
+    def __init__(self,
+                 wait_ratio,
+                 replicas,
+                 objective='throughput',
+                 min_ratio=0.05,
+                 max_ratio=1.0,
+                 step=0.05,
+                 interval=2):
+
+        if objective not in OBJECTIVES:
+            raise ValueError("Unknown objective %s" % objective)
+
+        self.wait_ratio = min(max(wait_ratio, min_ratio), max_ratio)
+        self.replicas = replicas
+        self.objective = objective
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+        self.step = step
+        self.interval = interval
+
+        self.direction = 1
+        self.last_score = None
+        self.start = None
+        self.history = []
+        self._reset()
+
+    def _reset(self):
+        self.md_done = 0
+        self.attempts = 0
+        self.accepted = 0
+        self.latency = 0.0
+        self.rounds = 0
+
+    def observe_md(self, count=1):
+        """Records completion of MD units.
+        """
+
+        self.md_done += count
+
+    def observe_exchange(self, attempts, accepted, latency):
+        """Records an exchange round.
+
+        Args:
+            attempts - number of replicas which took part in exchange
+
+            accepted - number of replicas which exchanged parameters
+
+            latency - time of exchange round in seconds
+        """
+
+        self.attempts += attempts
+        self.accepted += accepted
+        self.latency += latency
+        self.rounds += 1
+
+    def update(self, now):
+        """Updates wait ratio, should be called after every exchange round.
+
+        Args:
+            now - current time in seconds
+
+        Returns:
+            wait ratio
+        """
+
+        if self.start is None:
+            self.start = now
+            self._reset()
+            return self.wait_ratio
+        if (self.rounds < self.interval) or (now <= self.start):
+            return self.wait_ratio
+
+        elapsed = now - self.start
+        md_rate = self.md_done / elapsed
+        exchange_rate = self.accepted * 3600.0 / elapsed
+        latency = self.latency / self.rounds
+        if self.attempts > 0:
+            acceptance = float(self.accepted) / self.attempts
+        else:
+            acceptance = 0.0
+
+        if self.objective == 'throughput':
+            score = md_rate
+        else:
+            score = exchange_rate
+
+        if (self.last_score is not None) and (score < self.last_score):
+            self.direction = -self.direction
+        self.last_score = score
+
+        floor = max(self.min_ratio, md_rate * latency / self.replicas)
+        floor = min(floor, self.max_ratio)
+        ratio = self.wait_ratio + self.direction * self.step
+        if ratio <= floor:
+            ratio = floor
+            self.direction = 1
+        elif ratio >= self.max_ratio:
+            ratio = self.max_ratio
+            self.direction = -1
+        self.wait_ratio = ratio
+
+        self.history.append({'time': now,
+                             'wait_ratio': ratio,
+                             'score': score,
+                             'md_rate': md_rate,
+                             'exchange_rate': exchange_rate,
+                             'latency': latency,
+                             'acceptance': acceptance})
+        self.start = now
+        self._reset()
+
+        return self.wait_ratio
+
+    def write_history(self, path):
+        """Writes history of wait ratio and metrics to a given file.
+        """
+
+        fields = ['time', 'wait_ratio', 'score', 'md_rate',
+                  'exchange_rate', 'latency', 'acceptance']
+        with open(path, 'w') as f:
+            f.write(",".join(fields) + "\n")
+            for item in self.history:
+                f.write(",".join(["%g" % item[k] for k in fields]) + "\n")
@@ -0,0 +1,144 @@
+"""
+.. module:: radical.repex.replicas.registry
+.. moduleauthor::  <antons.treikalis@gmail.com>
+"""
+
+__copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
+__license__ = "MIT"
+
+#-------------------------------------------------------------------------------
+
+class ReplicaRegistry(object):
+    """Indexes replica objects of AMM by id and by group in each dimension, so
+    that replica and group lookups do not require a scan over all replicas.
+    Indexes are updated incrementally, when group indexes of a replica change.
+
+    Attributes:
+        nr_dims - number of dimensions of this simulation
+
+        by_id - dictionary where key is replica id and value is replica object
+
+        groups - list with a dictionary for each dimension, where key is group
+        index and value is a dictionary with group members, indexed by
+        replica id
+    """
+
+    def __init__(self, nr_dims, replicas=None):
+        """
+        Args:
+            nr_dims - number of dimensions of this simulation
+
+            replicas - list of replica objects to index
+        """
+
+        self.nr_dims = nr_dims
+        self.by_id = {}
+        self.groups = [{} for d in range(nr_dims)]
+
+        if replicas is not None:
+            for r in replicas:
+                self.add(r)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def add(self, replica):
+        """Adds a replica to id index and to group index of each dimension,
+        where group index of replica is already assigned.
+
+        Args:
+            replica - replica object
+        """
+
+        self.by_id[replica.id] = replica
+        for dim in range(self.nr_dims):
+            idx = replica.group_idx[dim]
+            if idx is not None:
+                self.groups[dim].setdefault(idx, {})[replica.id] = replica
+
+    def get(self, rid):
+        """Returns replica object with a given id or None.
+        """
+
+        return self.by_id.get(int(rid))
+
+    def reindex(self, dim_int):
+        """Rebuilds group index of a given dimension from group indexes of
+        replicas. Should be called after group indexes are (re)assigned.
+
+        Args:
+            dim_int - integer representing the index of dimension
+        """
+
+        dim = dim_int-1
+        self.groups[dim] = {}
+        for r in self.by_id.itervalues():
+            idx = r.group_idx[dim]
+            if idx is not None:
+                self.groups[dim].setdefault(idx, {})[r.id] = r
+
+    def update(self, replica, old_group_idx):
+        """Moves replica between groups in each dimension where it's group
+        index has changed.
+
+        Args:
+            replica - replica object with updated group_idx attribute
+
+            old_group_idx - list with group indexes of replica before update
+        """
+
+        for dim in range(self.nr_dims):
+            old = old_group_idx[dim]
+            new = replica.group_idx[dim]
+            if old == new:
+                continue
+            if old is not None:
+                members = self.groups[dim].get(old)
+                if members is not None:
+                    members.pop(replica.id, None)
+                    if not members:
+                        del self.groups[dim][old]
+            if new is not None:
+                self.groups[dim].setdefault(new, {})[replica.id] = replica
+
+    def group(self, dim_int, group_idx, ids=None):
+        """Returns members of a given group, ordered by replica id.
+
+        Args:
+            dim_int - integer representing the index of dimension
+
+            group_idx - index of the group in this dimension
+
+            ids - if not None, only members with these replica ids are
+            returned
+
+        Returns:
+            list of replica objects
+        """
+
+        members = self.groups[dim_int-1].get(group_idx, {})
+        return [members[rid] for rid in sorted(members) if (ids is None) or (rid in ids)]
+
+    def replica_group(self, dim_int, replica, ids=None):
+        """Returns members of a group of a given replica in a given dimension,
+        optionally restricted to given replica ids.
+        """
+
+        return self.group(dim_int, replica.group_idx[dim_int-1], ids)
+
+    def all_groups(self, dim_int, ids=None):
+        """Returns non-empty groups of a given dimension, ordered by group
+        index.
+
+        Args:
+            dim_int - integer representing the index of dimension
+
+            ids - if not None, groups are restricted to replicas with these 
+            ids, groups without such replicas are omitted
+
+        Returns:
+            2d list of replica objects
+        """
+
+        groups = [self.group(dim_int, idx, ids) for idx in sorted(self.groups[dim_int-1])]
+        return [group for group in groups if group]
@@ -10,19 +10,312 @@ import os
 import sys
 import math
 import json
+import numpy as np
+
+#-------------------------------------------------------------------------------
+
+class ReplicaStore(object):
+    """Holds the state of all replicas of a simulation in NumPy arrays, one
+    item (or row) per replica. Replica objects are views into this store, so
+    the whole ensemble is pickled as a handful of arrays and exchange and
+    grouping code can operate on whole arrays.
+
+    Attributes:
+        size - number of replicas in this store
+
+        nr_dims - number of dimensions
+
+        types - list with type of exchange in each dimension
+
+        ids - array with replica ids
+
+        sids - array with state ids
+
+        state - array with replica states (see Replica)
+
+        cycle - array with replica cycles
+
+        sim_cycle - array with simulation cycles
+
+        cur_dim - array with current dimension of each replica
+
+        swap - array with swap flags
+
+        group_idx - 2d array with group index of each replica in each
+        dimension, -1 means that group index is not assigned
+
+        params - 2d array with parameter of each replica in each dimension
+
+        old_params - 2d array with previous parameters
+
+        new_restraints - list with names of restraint files
+
+        coor_file - list with names of coordinates files
+
+        old_path - list with paths to previous replica sandboxes
+    """
+
+    def __init__(self, size, nr_dims=1, types=None):
+        """
+        Args:
+            size - number of replicas
+
+            nr_dims - number of dimensions
+
+            types - list with type of exchange in each dimension
+        """
+
+        self.size = size
+        self.nr_dims = nr_dims
+        if types is None:
+            self.types = [None] * nr_dims
+        else:
+            self.types = list(types)
+
+        self.ids       = np.arange(size, dtype=np.int32)
+        self.sids      = np.arange(size, dtype=np.int32)
+        self.state     = np.empty(size, dtype='S2')
+        self.state[:]  = 'I'
+        self.cycle     = np.zeros(size, dtype=np.int32)
+        self.sim_cycle = np.zeros(size, dtype=np.int32)
+        self.cur_dim   = np.ones(size, dtype=np.int8)
+        self.swap      = np.zeros(size, dtype=np.int8)
+        self.group_idx = np.empty((size, 3), dtype=np.int32)
+        self.group_idx[:] = -1
+
+        self.params     = np.zeros((size, nr_dims), dtype=np.float64)
+        self.old_params = np.zeros((size, nr_dims), dtype=np.float64)
+
+        self.new_restraints = [''] * size
+        self.coor_file      = [''] * size
+        self.old_path       = [''] * size
+
+    def set_replica(self, idx, my_id, params, new_restraints=None, coor=None):
+        """Initializes item of this store with a given index.
+
+        Args:
+            idx - index of item in this store
+
+            my_id - replica id
+
+            params - list with parameter in each dimension
+
+            new_restraints - name of restraint file
+
+            coor - name of coordinates file
+
+        Returns:
+            Replica object
+        """
+
+        self.ids[idx]  = my_id
+        self.sids[idx] = my_id
+        self.params[idx]     = params[:self.nr_dims]
+        self.old_params[idx] = params[:self.nr_dims]
+        if new_restraints is not None:
+            self.new_restraints[idx] = new_restraints
+        if coor is not None:
+            self.coor_file[idx] = coor
+
+        return self.replica(idx)
+
+    def replica(self, idx):
+        """Returns replica object backed by item of this store with a given
+        index.
+        """
+
+        return Replica.view(self, idx)
+
+    def replicas(self):
+        """Returns list of replica objects, one per item of this store.
+        """
+
+        return [self.replica(i) for i in range(self.size)]
+
+    def assign_group_idx(self, dim_int):
+        """Assigns group index in a given dimension to all replicas. Replicas
+        are in the same group if their parameters are equal in all other
+        dimensions. Groups are numbered in order of their first member.
+
+        Args:
+            dim_int - integer representing the index of dimension
+
+        Returns:
+            number of groups in this dimension
+        """
+
+        others = [d for d in range(self.nr_dims) if d != dim_int-1]
+        if len(others) == 0:
+            self.group_idx[:, dim_int-1] = 0
+            return 1
+
+        keys = np.ascontiguousarray(self.params[:, others])
+        uniq, first, inverse = np.unique(keys,
+                                         axis=0,
+                                         return_index=True,
+                                         return_inverse=True)
+        rank = np.empty(len(first), dtype=np.int32)
+        rank[np.argsort(first)] = np.arange(len(first))
+        self.group_idx[:, dim_int-1] = rank[inverse]
+
+        return len(first)
+
+    def signature(self, idx):
+        """Returns items of replica with a given index, which determine
+        input of it's next compute unit. If signature of a replica has not
+        changed, it's compute unit can be reused.
+
+        Args:
+            idx - index of item in this store
+
+        Returns:
+            tuple
+        """
+
+        return (int(self.ids[idx]),
+                int(self.cycle[idx]),
+                tuple(self.params[idx]),
+                self.new_restraints[idx],
+                self.coor_file[idx],
+                self.old_path[idx])
+
+#-------------------------------------------------------------------------------
+
+def _item_property(name, cast, doc):
+    """Returns property which reads and writes item of a given attribute of
+    ReplicaStore.
+    """
+
+    def fget(self):
+        return cast(getattr(self.store, name)[self.idx])
+
+    def fset(self, value):
+        getattr(self.store, name)[self.idx] = value
+
+    return property(fget, fset, doc=doc)
+
+#-------------------------------------------------------------------------------
+
+class _GroupIdx(object):
+    """List-like view of group indexes of a single replica. None means that
+    group index is not assigned.
+    """
+
+    __slots__ = ('store', 'idx')
+
+    def __init__(self, store, idx):
+        self.store = store
+        self.idx = idx
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, i):
+        value = int(self.store.group_idx[self.idx, i])
+        if value < 0:
+            return None
+        return value
+
+    def __setitem__(self, i, value):
+        if value is None:
+            value = -1
+        self.store.group_idx[self.idx, i] = value
+
+    def __iter__(self):
+        for i in range(3):
+            yield self[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+#-------------------------------------------------------------------------------
+
+class _Dim(object):
+    """Dictionary-like view of parameters of a single replica in a single
+    dimension, with keys 'par', 'old_par' and 'type'.
+    """
+
+    __slots__ = ('store', 'idx', 'dim')
+
+    def __init__(self, store, idx, dim):
+        self.store = store
+        self.idx = idx
+        self.dim = dim
+
+    def __getitem__(self, key):
+        if key == 'par':
+            return float(self.store.params[self.idx, self.dim])
+        elif key == 'old_par':
+            return float(self.store.old_params[self.idx, self.dim])
+        elif key == 'type':
+            return self.store.types[self.dim]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'par':
+            self.store.params[self.idx, self.dim] = value
+        elif key == 'old_par':
+            self.store.old_params[self.idx, self.dim] = value
+        elif key == 'type':
+            self.store.types[self.dim] = value
+        else:
+            raise KeyError(key)
+
+    def __repr__(self):
+        return repr({'par' : self['par'], 'old_par' : self['old_par'], 'type' : self['type']})
+
+#-------------------------------------------------------------------------------
+
+class _Dims(object):
+    """Dictionary-like view of parameters of a single replica in all
+    dimensions, with keys 'd1', 'd2' and 'd3'.
+    """
+
+    __slots__ = ('store', 'idx')
+
+    def __init__(self, store, idx):
+        self.store = store
+        self.idx = idx
+
+    def keys(self):
+        return ['d' + str(d+1) for d in range(self.store.nr_dims)]
+
+    def __len__(self):
+        return self.store.nr_dims
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+        return _Dim(self.store, self.idx, int(key[1])-1)
+
+    def __repr__(self):
+        return repr(dict([(k, self[k]) for k in self.keys()]))
 
 #-------------------------------------------------------------------------------
 
 class Replica(object):
-    """Class representing a replica object. Should be used for both Amber 
-    and NAMD.
+    """Class representing a replica object. Should be used for both Amber
+    and NAMD. Replica object is a view into a ReplicaStore, which holds the
+    state of all replicas in NumPy arrays.
 
     Attributes:
         id - ID of this replica
 
         sid - state id of this replica
 
-        state - letter, representing state of this replica. Mainly used for 
+        state - letter, representing state of this replica. Mainly used for
         asynchronous RE. possible states are:
             I  - initiaized
             MD - replica is performing MD simulation
@@ -31,25 +324,32 @@ class Replica(object):
         group_idx - list with group indexes of this replica in each dimension
 
         dims - dictionary holding parameters and types of each dimension
+
+    Names of files produced by a replica are not stored, those are derived
+    from basename, replica id and cycle, see name().
     """
 
-    def __init__(self, 
-                 my_id, 
-                 d1_param=0.0, 
-                 d2_param=0.0, 
-                 d3_param=0.0, 
-                 d1_type = None, 
-                 d2_type = None, 
-                 d3_type = None, 
-                 new_restraints=None, 
+    __slots__ = ('store', 'idx')
+
+    def __init__(self,
+                 my_id,
+                 d1_param=0.0,
+                 d2_param=0.0,
+                 d3_param=0.0,
+                 d1_type = None,
+                 d2_type = None,
+                 d3_type = None,
+                 new_restraints=None,
                  coor=None,
                  nr_dims = 1):
-        """
+        """Creates a replica backed by it's own single item store. Replicas
+        of a simulation should be created with ReplicaStore.set_replica().
+
         Args:
             my_id - replica id
 
             d1_param - parameter in first dimension
-            
+
             d2_param - parameter in second dimension
 
             d3_param - parameter in third dimension
@@ -66,44 +366,79 @@ class Replica(object):
 
             nr_dims - number of dimenions for this replica
         """
-    
-        self.id = int(my_id)
-        self.sid = int(my_id)
-        self.state = 'I'
-        self.cycle = 0
-        self.sim_cycle = 0
-        self.group_idx = [None, None, None]
-        self.cur_dim = 1
 
-        if coor is not None:
-            self.coor_file = coor
+        store = ReplicaStore(1, nr_dims, [d1_type, d2_type, d3_type][:nr_dims])
+        store.set_replica(0,
+                          my_id,
+                          [d1_param, d2_param, d3_param],
+                          new_restraints=new_restraints,
+                          coor=coor)
+        self.store = store
+        self.idx = 0
 
-        if new_restraints is None:
-            self.new_restraints = ''
-        else:
-            self.new_restraints = new_restraints
+    @classmethod
+    def view(cls, store, idx):
+        """Returns replica object backed by item of a given store.
+        """
+
+        replica = cls.__new__(cls)
+        replica.store = store
+        replica.idx = idx
+        return replica
+
+    id        = _item_property('ids', int, "replica id")
+    sid       = _item_property('sids', int, "state id")
+    state     = _item_property('state', str, "replica state")
+    cycle     = _item_property('cycle', int, "replica cycle")
+    sim_cycle = _item_property('sim_cycle', int, "simulation cycle")
+    cur_dim   = _item_property('cur_dim', int, "current dimension")
+    swap      = _item_property('swap', int, "swap flag")
+
+    new_restraints = _item_property('new_restraints', str, "name of restraint file")
+    coor_file      = _item_property('coor_file', str, "name of coordinates file")
+    old_path       = _item_property('old_path', str, "path to previous sandbox")
 
-        self.dims = {}
+    @property
+    def group_idx(self):
+        return _GroupIdx(self.store, self.idx)
 
-        if nr_dims == 1:
-            self.dims['d1'] = {'par' : d1_param, 'old_par' : d1_param, 'type' : d1_type} 
-        elif nr_dims == 2:
-            self.dims['d1'] = {'par' : d1_param, 'old_par' : d1_param, 'type' : d1_type} 
-            self.dims['d2'] = {'par' : d2_param, 'old_par' : d2_param, 'type' : d2_type} 
-        elif nr_dims == 3:
-            self.dims['d1'] = {'par' : d1_param, 'old_par' : d1_param, 'type' : d1_type} 
-            self.dims['d2'] = {'par' : d2_param, 'old_par' : d2_param, 'type' : d2_type} 
-            self.dims['d3'] = {'par' : d3_param, 'old_par' : d3_param, 'type' : d3_type}
+    @group_idx.setter
+    def group_idx(self, values):
+        for i, value in enumerate(values):
+            self.group_idx[i] = value
+
+    @property
+    def dims(self):
+        return _Dims(self.store, self.idx)
+
+    def name(self, basename, cycle=None):
+        """Returns name of files produced by this replica in a given cycle,
+        without extension.
+
+        Args:
+            basename - base name of simulation input files
+
+            cycle - replica cycle, if None current cycle of this replica is
+            used
+
+        Returns:
+            file name
+        """
 
-        self.new_traj = ""
-        self.new_info = ""
-        self.new_coor = ""  # namd and amber
+        if cycle is None:
+            cycle = self.cycle
+        return "%s_%d_%d" % (basename, self.id, cycle)
 
-        self.old_traj = ""
-        self.old_info = ""
-        self.old_coor = ""  # namd and amber
+    def __eq__(self, other):
+        if not isinstance(other, Replica):
+            return NotImplemented
+        return (self.store is other.store) and (self.idx == other.idx)
 
-        self.old_path   = ""
-        self.first_path = ""
-        self.swap       = 0
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        if eq is NotImplemented:
+            return eq
+        return not eq
 
+    def __hash__(self):
+        return hash((id(self.store), self.idx))
@@ -0,0 +1,207 @@
+import os
+import json
+import pytest
+import numpy as np
+rp = pytest.importorskip("radical.pilot")
+from application_management_modules.amm_amber import AmmAmber
+from exchange.matrix_io import read_pairs
+
+#-------------------------------------------------------------------------------
+
+EXAMPLES = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'examples', 'amber'))
+
+def make_amm(tmpdir, name, options={}, dims={}):
+    with open(os.path.join(EXAMPLES, name)) as f:
+        inp = json.load(f)
+    with open(os.path.join(EXAMPLES, 'local.json')) as f:
+        rconfig = json.load(f)
+    inp['remd.input'].update(options)
+    for d, values in dims.items():
+        inp['dim.input'][d].update(values)
+
+    with tmpdir.as_cwd():
+        amm = AmmAmber(inp, rconfig, EXAMPLES)
+        replicas = amm.initialize_replicas()
+        amm.prepare_shared_data(replicas)
+    sd_shared_list = [{'source': 'staging:///%s' % f, 'target': f, 'action': rp.COPY} 
+                      for f in amm.shared_files]
+    return amm, replicas, sd_shared_list
+
+def cu_data(command):
+    # JSON argument of a RAM call in pre_exec or post_exec
+    return json.loads(command[command.index("'")+1:command.rindex("'")])
+
+#-------------------------------------------------------------------------------
+
+class TestSaltGroupExchange(object):
+
+    def test_units(self, tmpdir):
+        amm, replicas, sd = make_amm(tmpdir, 'tsu_remd_ace_ala_nme.json',
+                                     {'salt_group_exchange': 'True', 
+                                      'amber_path_mpi': 'sander.MPI'},
+                                     {'d2': {'number_of_replicas': '4'}})
+        group = amm.get_all_groups(2, replicas)[0][1:]
+        assert len(group) == 4
+
+        units = amm.prepare_group_for_exchange(1, 2, 'd2', group, sd)
+        assert [cu.cores for cu in units] == [16]
+        assert units[0].arguments == ['-ng', '16', '-groupfile', 'groupfile']
+
+        # rows of G x G calculations are split between units, which fit 
+        # into the pilot
+        units = amm.prepare_group_for_exchange(1, 2, 'd2', group, sd, 8)
+        assert [cu.cores for cu in units] == [8, 8]
+        rows = [cu_data(cu.pre_exec[-1])["rows"] for cu in units]
+        assert rows == [[str(r.id) for r in group[:2]], [str(r.id) for r in group[2:]]]
+        assert cu_data(units[1].post_exec[0])["rows"] == rows[1]
+
+        # unit with a single row is used, if pilot is smaller than a group
+        units = amm.prepare_group_for_exchange(1, 2, 'd2', group, sd, 2)
+        assert [cu.cores for cu in units] == [4, 4, 4, 4]
+        assert units[0].arguments[1] == '4'
+
+#-------------------------------------------------------------------------------
+
+MDINFO = """ NSTEP =     500   TIME(PS) =       2.000  TEMP(K) =   %.2f  PRESS =     0.0
+ Etot   =     -1000.0000  EKtot   =       500.0000  EPtot      =     %.4f
+"""
+
+class TestLocalExchange(object):
+
+    def test_pairs(self, tmpdir):
+        amm, replicas, sd = make_amm(tmpdir, 't_remd_ace_ala_nme.json',
+                                     {'local_exchange': 'True'})
+        group = amm.get_all_groups(1, replicas)[0][1:]
+        assert len(group) == 4
+        for r in group:
+            r.cycle = 1
+
+        # MD run of the last replica failed and it has no .mdinfo file
+        failed = group[-1]
+        with tmpdir.as_cwd():
+            for r in group[:-1]:
+                with open(r.name(amm.inp_basename, 0) + ".mdinfo", 'w') as f:
+                    f.write(MDINFO % (r.dims['d1']['par'], -1500.0 - r.id))
+            np.random.seed(1)
+            amm.calc_local_exchange(1, 1, 'd1', group)
+
+            assert os.path.isfile("pairs_for_exchange_1_1.dat")
+            pairs, sandbox = read_pairs("pairs_for_exchange_1_1.dat")
+        ids = set(sum(pairs, []))
+        assert ids
+        assert ids <= set([r.id for r in group[:-1]])
+        assert failed.id not in ids
+
+        # no exchange for a group with a single replica with .mdinfo file
+        with tmpdir.as_cwd():
+            os.remove(group[0].name(amm.inp_basename, 0) + ".mdinfo")
+            os.remove(group[1].name(amm.inp_basename, 0) + ".mdinfo")
+            amm.calc_local_exchange(2, 1, 'd1', group)
+            assert read_pairs("pairs_for_exchange_1_2.dat") == ([], None)
+
+#-------------------------------------------------------------------------------
+
+class TestMdBundle(object):
+
+    def test_bundle_unit(self, tmpdir):
+        amm, replicas, sd = make_amm(tmpdir, 't_remd_ace_ala_nme.json',
+                                     {'md_bundle_size': '3', 
+                                      'amber_path_mpi': 'sander.MPI',
+                                      'replica_mpi': 'True',
+                                      'replica_cores': '2'})
+        group = amm.get_all_groups(1, replicas)[0][1:]
+        bundles = amm.get_md_bundles('d1', group)
+        assert [len(b) for b in bundles] == [3, 1]
+
+        cu = amm.prepare_bundle_for_md(1, 1, 'd1', group, bundles[0], sd)
+        assert cu.executable.endswith(" -ng 3 -groupfile groupfile")
+        assert cu.cores == 3 * 2
+        assert cu.mpi == True
+        assert cu.post_exec == ["python md_bundle.py post"]
+
+        # shared files are staged in once for the whole bundle
+        targets = [s['target'] for s in cu.input_staging]
+        assert len(targets) == len(set(targets))
+        assert "md_bundle.py" in targets
+        assert "input_file_builder.py" in targets
+
+        # one task with input file builder data, post processing RAM and 
+        # Amber arguments per replica of a bundle
+        tasks = cu_data(cu.pre_exec[-1])["tasks"]
+        assert len(tasks) == 3
+        for r, task in zip(bundles[0], tasks):
+            name = r.name(amm.inp_basename, 0)
+            assert task["pre"]["new_input_file"] == name + ".mdin"
+            assert task["post"][0] == "matrix_calculator_temp_ex.py"
+            assert task["post"][1]["rid"] == str(r.id)
+            assert "-inf " + name + ".mdinfo" in task["arguments"]
+        # restart file of every replica is staged out
+        targets = [s['target'] for s in cu.output_staging]
+        assert targets == ['staging:///replica_%d/%s.rst' % (r.id, r.name(amm.inp_basename, 0)) 
+                           for r in bundles[0]]
+
+        # single replica bundle is a regular MD unit
+        cu = amm.prepare_bundle_for_md(1, 1, 'd1', group, bundles[1], sd)
+        assert "md_bundle.py" not in [s['target'] for s in cu.input_staging]
+        assert cu.cores == 2
+
+#-------------------------------------------------------------------------------
+
+class TestGroups(object):
+
+    def test_subset(self, tmpdir):
+        amm, replicas, sd = make_amm(tmpdir, 't_remd_ace_ala_nme.json')
+        assert [[r.id for r in g[1:]] for g in amm.get_all_groups(1, replicas)] == [[0, 1, 2, 3]]
+
+        # replicas 0 and 3 are still running MD
+        done = replicas[1:3]
+        assert [[r.id for r in g[1:]] for g in amm.get_all_groups(1, done)] == [[1, 2]]
+        assert amm.get_all_groups_ids(1, done) == [[1, 2]]
+        assert [r.id for r in amm.get_replica_group(1, done, replicas[1])] == [1, 2]
+        assert amm.get_current_group_ids(1, done, replicas[1]) == ['1', '2']
+
+        for r in replicas:
+            r.cycle = 1
+        cu = amm.prepare_global_ex_calc(1, 1, 'd1', done, sd)
+        assert json.loads(cu.arguments[1])["group_ids"] == [[1, 2]]
+
+        # running replicas don't exchange parameters, even if calculator 
+        # paired them
+        temps = [r.dims['d1']['par'] for r in replicas]
+        with tmpdir.as_cwd():
+            with open("pairs_for_exchange_1_1.dat", 'w') as f:
+                f.write("0 3\n1 2\n")
+            amm.do_exchange(1, 1, 'd1', done)
+        assert [r.dims['d1']['par'] for r in replicas] == [temps[0], temps[2], temps[1], temps[3]]
+
+#-------------------------------------------------------------------------------
+
+class TestSaltExchange(object):
+
+    def units(self, tmpdir, scheme):
+        amm, replicas, sd = make_amm(tmpdir, 'tsu_remd_ace_ala_nme.json',
+                                     {'exchange_scheme': scheme, 
+                                      'amber_path_mpi': 'sander.MPI'},
+                                     {'d2': {'number_of_replicas': '4'}})
+        group = amm.get_all_groups(2, replicas)[0][1:]
+        return group, [amm.prepare_replica_for_exchange(1, 2, 'd2', group, r, sd) for r in group]
+
+    def test_gibbs(self, tmpdir):
+        group, units = self.units(tmpdir, 'gibbs')
+        ids = sorted([str(r.id) for r in group])
+        for cu in units:
+            assert cu.arguments == ['-ng', '4', '-groupfile', 'groupfile']
+            assert cu.cores == 4
+            assert sorted(cu_data(cu.pre_exec[-1])["current_group_tsu"]) == ids
+
+    def test_neighbor(self, tmpdir):
+        # single point energies only at salt concentrations of neighbors
+        group, units = self.units(tmpdir, 'neighbor')
+        ordered = sorted(group, key=lambda r: r.dims['d2']['par'])
+        for r, cu in zip(group, units):
+            k = ordered.index(r)
+            expected = sorted([str(r.id) for r in ordered[max(k-1, 0):k+2]])
+            assert sorted(cu_data(cu.pre_exec[-1])["current_group_tsu"]) == expected
+            assert sorted(cu_data(cu.post_exec[-1])["current_group_tsu"]) == expected
+            assert cu.arguments == ['-ng', str(len(expected)), '-groupfile', 'groupfile']
+            assert cu.cores == len(expected)
@@ -0,0 +1,116 @@
+import math
+import pytest
+import numpy as np
+from exchange.engine import log_sum_exp
+from exchange.engine import swap_log_probabilities
+from exchange.engine import sample_partners
+from exchange.engine import do_exchange
+from exchange.engine import neighbor_exchange
+from exchange.engine import exchange_parity
+from exchange.engine import neighbors
+from exchange.engine import permutation_pairs
+
+#-------------------------------------------------------------------------------
+
+class Repl(object):
+    def __init__(self, my_id):
+        self.id = my_id
+        self.sid = my_id
+
+#-------------------------------------------------------------------------------
+
+def reference_log_ps(r_i, replicas, swap_matrix):
+    ps = []
+    for r_j in replicas:
+        ps.append( -(swap_matrix[r_i.sid][r_j.id] + swap_matrix[r_j.sid][r_i.id] -
+                     swap_matrix[r_i.sid][r_i.id] - swap_matrix[r_j.sid][r_j.id]) )
+    return ps
+
+#-------------------------------------------------------------------------------
+
+class TestEngine(object):
+
+    def test_log_probabilities(self):
+        rng = np.random.RandomState(1)
+        swap_matrix = rng.uniform(-50.0, 50.0, (8,8))
+        replicas = [Repl(i) for i in [1,3,4,6]]
+        ids = [r.id for r in replicas]
+
+        log_ps = swap_log_probabilities(swap_matrix, ids)
+        for a, r_i in enumerate(replicas):
+            ref = reference_log_ps(r_i, replicas, swap_matrix)
+            assert np.allclose(log_ps[a], ref)
+
+    def test_log_sum_exp(self):
+        x = np.array([[1000.0, 1000.0], [-np.inf, 0.0]])
+        assert np.allclose(log_sum_exp(x, axis=1), [1000.0 + math.log(2.0), 0.0])
+
+    def test_sample_distribution(self):
+        rng = np.random.RandomState(7)
+        p = np.array([0.1, 0.2, 0.7])
+        log_ps = np.tile(np.log(p), (3,1))
+        counts = np.zeros(3)
+        for i in range(4000):
+            counts += np.bincount(sample_partners(log_ps, rng), minlength=3)
+        assert np.allclose(counts / counts.sum(), p, atol=0.02)
+
+    def test_sample_degenerate(self):
+        # huge exponents must not overflow, rows without finite entries stay
+        log_ps = np.array([[0.0, 1.0e6, -np.inf],
+                           [-np.inf, -np.inf, -np.inf],
+                           [-np.inf, -1.0e6, 0.0]])
+        partners = sample_partners(log_ps, np.random.RandomState(3))
+        assert list(partners) == [1, 1, 2]
+
+    def test_do_exchange(self):
+        replicas = [Repl(i) for i in range(16)]
+        swap_matrix = np.zeros((16,16))
+        # all swaps equally likely, so pairs must be valid id pairs
+        pairs = do_exchange(replicas, swap_matrix, np.random.RandomState(5))
+        for pair in pairs:
+            assert pair[0] != pair[1]
+            assert 0 <= pair[1] < 16
+        assert do_exchange(replicas[:1], swap_matrix) == []
+
+    def test_neighbor_exchange(self):
+        replicas = [Repl(i) for i in [3, 0, 2, 1]]
+        swap_matrix = np.zeros((4,4))
+        # zero energies, every attempted pair is accepted
+        assert neighbor_exchange(replicas, swap_matrix, 0) == [[3, 0], [2, 1]]
+        assert neighbor_exchange(replicas, swap_matrix, 1) == [[0, 2]]
+
+        # unfavourable swap of 0 and 2 is rejected, NaN's never exchange
+        swap_matrix[0][2] = 1.0e6
+        swap_matrix[3][0] = np.nan
+        assert neighbor_exchange(replicas, swap_matrix, 1, np.random.RandomState(1)) == []
+        assert neighbor_exchange(replicas, swap_matrix, 0, np.random.RandomState(1)) == [[2, 1]]
+
+    def test_neighbor_acceptance(self):
+        rng = np.random.RandomState(11)
+        replicas = [Repl(0), Repl(1)]
+        swap_matrix = np.array([[0.0, 0.5], [0.5, 0.0]])
+        accepted = 0
+        for i in range(4000):
+            accepted += len(neighbor_exchange(replicas, swap_matrix, 0, rng))
+        assert abs(accepted / 4000.0 - math.exp(-1.0)) < 0.03
+
+    def test_parity(self):
+        assert exchange_parity('deo', 4) == 0
+        assert exchange_parity('deo', 7) == 1
+        assert exchange_parity('neighbor', 0, np.random.RandomState(2)) in (0, 1)
+        assert neighbors([5, 2, 7, 1], 5) == [5, 2]
+        assert neighbors([5, 2, 7, 1], 7) == [2, 7, 1]
+
+    def test_permutation_pairs(self):
+        ids = [3, 4, 5, 6]
+        old = [300.0, 310.0, 320.0, 330.0]
+        new = ["330.00", "300.00", "310.00", "320.00"]
+        pairs = permutation_pairs(ids, old, new)
+        params = dict(zip(ids, old))
+        for a, b in pairs:
+            params[a], params[b] = params[b], params[a]
+        assert [params[i] for i in ids] == [330.0, 300.0, 310.0, 320.0]
+        assert permutation_pairs(ids, old, old) == []
+
+        with pytest.raises(ValueError):
+            permutation_pairs(ids, old, [300.0, 300.0, 320.0, 330.0])
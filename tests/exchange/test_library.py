@@ -0,0 +1,468 @@
+import os
+import pytest
+import numpy as np
+from exchange.acceptance import KB
+from exchange.acceptance import get_acceptance
+from exchange.acceptance import reduced_energy
+from exchange.acceptance import parse_temperatures
+from exchange.acceptance import state_terms_matrix
+from exchange.history import append_history
+from exchange.history import consume_history
+from exchange.matrix_io import write_column
+from exchange.matrix_io import read_column
+from exchange.matrix_io import write_group_columns
+from exchange.matrix_io import read_group_columns
+from exchange.matrix_io import write_columns
+from exchange.matrix_io import read_columns
+from exchange.matrix_io import write_pairs
+from exchange.matrix_io import read_pairs
+from exchange.matrix_io import merge_rank_records
+from exchange.shared_matrix import write_shared_column
+from exchange.shared_matrix import read_shared_matrix
+from exchange.shared_matrix import release_shared_columns
+from exchange.shared_matrix import remove_stale_matrices
+from exchange.replica import create_replica
+from exchange.replica import group_replicas
+from exchange.engine import exchange_group
+from exchange.mdinfo import get_historical_data
+from exchange.mdinfo import prefetch_historical_data
+from exchange.mdinfo import get_namd_historical_data
+from exchange.mdinfo import wait_for_history
+from exchange.mdinfo import read_remlog
+from exchange.restraints import DEG2
+from exchange.restraints import RestraintSet
+from exchange.restraints import read_coordinates
+from exchange.restraints import read_atom_coordinates
+from exchange.restraints import energy_matrix
+from exchange.restraints import entries_energies
+from exchange.restraints import restraint_energies
+from exchange.restraint_cache import RestraintCache
+from exchange.templates import Template
+from exchange.templates import load_template
+from exchange.templates import mdin_values
+from exchange.templates import rstr_values
+from exchange.templates import render_file
+from exchange.templates import set_cntrl
+
+#-------------------------------------------------------------------------------
+
+class TestAcceptance(object):
+
+    def test_temperature(self):
+        temps = np.array([300.0, 310.0, 320.0])
+        energies = np.array([-10.0, -20.0, -30.0])
+        m = get_acceptance('temperature').swap_matrix(temps, energies)
+        for j in range(3):
+            for i in range(3):
+                assert np.isclose(m[j][i], reduced_energy(temps[j], energies[i]))
+
+        col = get_acceptance('temperature').swap_column(temps, energies[1])
+        assert np.allclose(col, m[:,1])
+
+    def test_umbrella(self):
+        temps = np.array([300.0, 300.0])
+        energies = np.array([-10.0, -20.0])
+        # us[i][j] - configuration of replica i, restraints of replica j
+        us = np.array([[1.0, 2.0], [3.0, 4.0]])
+        m = get_acceptance('umbrella').swap_matrix(temps, energies, us)
+        beta = 1.0 / (KB * 300.0)
+        assert np.isclose(m[1][0], beta * (energies[0] + us[0][1]))
+        assert np.isclose(m[0][1], beta * (energies[1] + us[1][0]))
+
+        col = get_acceptance('umbrella').swap_column(temps, energies[0], us[0])
+        assert np.allclose(col, m[:,0])
+
+    def test_umbrella_state_terms(self):
+        temps = np.array([300.0, 310.0, 320.0])
+        energies = np.array([-10.0, -20.0, -30.0])
+        # restraint energies as written to history files (j:energy items) or
+        # gathered from MPI ranks, replica 2 has only a neighbor
+        rows = {0: {"0": "1.0", "1": "2.0", "2": "3.0"},
+                1: {0: 4.0, 1: 5.0, 2: 6.0},
+                2: {1: 8.0}}
+        us = state_terms_matrix(rows, 3)
+        assert np.allclose(us, [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [0.0, 8.0, 0.0]])
+
+        # element [j][i] is E_i + U_j(x_i) at temperature of state j, rows
+        # are not aliased and U_i(x_i) is not used for every j
+        m = get_acceptance('umbrella').swap_matrix(temps, energies, us)
+        for j in range(3):
+            for i in range(3):
+                assert np.isclose(m[j][i], reduced_energy(temps[j], energies[i] + us[i][j]))
+        assert not np.isclose(m[0][1], m[1][1])
+
+    def test_parse_temperatures(self):
+        # NAMD AMM passes temperatures of replicas as " t_0 t_1 ... t_n"
+        temps = parse_temperatures(" 300.0 310.0 320.0", 3)
+        assert np.allclose(temps, [300.0, 310.0, 320.0])
+        assert np.allclose(parse_temperatures("300 310 320 330", 3), temps)
+
+        # swap column uses temperatures of states, not 1/kb of zero
+        # temperatures
+        col = get_acceptance('temperature').swap_column(temps, -10.0)
+        assert np.allclose(col, [reduced_energy(t, -10.0) for t in temps])
+        assert not np.isclose(col[0], -10.0 / KB)
+
+        with pytest.raises(ValueError):
+            parse_temperatures(" 300.0 310.0", 3)
+
+    def test_salt(self):
+        temps = np.array([300.0, 300.0])
+        spe = np.array([-5.0, -6.0])
+        col = get_acceptance('salt').swap_column(temps, None, spe)
+        assert np.allclose(col, spe / (KB * 300.0))
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            get_acceptance('pressure')
+
+#-------------------------------------------------------------------------------
+
+class TestRestraints(object):
+
+    def test_energies(self, tmpdir):
+        path = str(tmpdir.join("ala10_0_1.rst"))
+        with open(path, 'w') as f:
+            f.write("title\n     4\n")
+            f.write("%12.7f%12.7f%12.7f%12.7f%12.7f%12.7f\n" % (0, 0, 0, 1, 0, 0))
+            f.write("%12.7f%12.7f%12.7f%12.7f%12.7f%12.7f\n" % (1, 1, 0, 1, 1, 1))
+        crds = read_coordinates(path)
+        assert crds.shape == (4, 3)
+
+        bond     = "\n iat=1,2\n r1=0 , r2=2, r3=2, r4=5 ,\n rk2=10.0, rk3=10.0,\n /\n"
+        angle    = "\n iat=1,2,3\n r1=0 , r2=90, r3=90, r4=180 ,\n rk2=50.0, rk3=50.0,\n /\n"
+        dihedral = "\n iat=1,2,3,4\n r1=0 , r2=100, r3=100, r4=200 ,\n rk2=1.0, rk3=1.0,\n /\n"
+        rs = RestraintSet([[bond], [angle, dihedral]])
+
+        m = energy_matrix([crds, crds*2.0], rs)
+        assert m.shape == (2, 2)
+        assert np.isclose(m[0][0], 10.0)
+        assert np.isclose(m[0][1], 100.0 / DEG2)
+        assert np.isclose(m[1][0], 0.0)
+        assert np.isclose(m[1][1], 100.0 / DEG2)
+
+        assert np.allclose(entries_energies(path, [[bond], [angle, dihedral]]), m[0])
+
+    def test_atom_coordinates(self, tmpdir):
+        path = str(tmpdir.join("ala10_0_1.rst"))
+        values = np.arange(15, dtype=float) - 7.5
+        with open(path, 'w') as f:
+            f.write("title\n     5  0.1000000E+03\n")
+            for k in range(0, 15, 6):
+                f.write("".join(["%12.7f" % v for v in values[k:k+6]]) + "\n")
+        crds = read_coordinates(path)
+        assert np.array_equal(crds, values.reshape(5, 3))
+        atoms = [4, 1, 2]
+        assert np.array_equal(read_atom_coordinates(path, atoms), crds[atoms])
+        with pytest.raises(IOError):
+            read_atom_coordinates(path, [5])
+
+    def test_cache(self, tmpdir):
+        paths = []
+        for k, r2 in enumerate([2.0, 3.0]):
+            path = str(tmpdir.join("r%d.RST" % k))
+            with open(path, 'w') as f:
+                f.write("title\n &rst\n iat=1,2\n r1=0, r2=%s, r3=%s, r4=5,\n rk2=10.0, rk3=10.0,\n /\n" % (r2, r2))
+            paths.append(path)
+        crd = str(tmpdir.join("ala10_0_1.rst"))
+        with open(crd, 'w') as f:
+            f.write("title\n     2\n%12.7f%12.7f%12.7f%12.7f%12.7f%12.7f\n" % (0, 0, 0, 1, 0, 0))
+
+        cache_dir = str(tmpdir.join("restraint_cache"))
+        cache = RestraintCache(maxsize=1, cache_dir=cache_dir, max_files=1)
+        energies = restraint_energies(crd, paths, cache)
+        assert np.allclose(energies, restraint_energies(crd, paths))
+        assert np.allclose(energies, [10.0, 40.0])
+        assert list(cache.entries.keys()) == [os.path.abspath(paths[1])]
+        assert len(os.listdir(cache_dir)) == 1
+
+        # entry on disk is used by other process
+        other = RestraintCache(cache_dir=cache_dir)
+        assert other.get(paths[1]) == cache.get(paths[1])
+
+        # changed file is parsed again
+        with open(paths[1], 'w') as f:
+            f.write("title\n &rst\n iat=1,2\n r1=0, r2=4.25, r3=4.25, r4=5,\n rk2=10.0, rk3=10.0,\n /\n")
+        assert np.allclose(restraint_energies(crd, paths[1:], cache), [105.625])
+
+        # file rewritten with the same size and modification time is parsed
+        # again, also by other process using entry on disk
+        os.utime(paths[1], (1000, 1000))
+        size = os.stat(paths[1]).st_size
+        other.get(paths[1])
+        cache.get(paths[1])
+        with open(paths[1], 'w') as f:
+            f.write("title\n &rst\n iat=1,2\n r1=0, r2=3.25, r3=3.25, r4=5,\n rk2=10.0, rk3=10.0,\n /\n")
+        os.utime(paths[1], (1000, 1000))
+        assert os.stat(paths[1]).st_size == size
+        assert np.allclose(restraint_energies(crd, paths[1:], cache), [50.625])
+        assert np.allclose(restraint_energies(crd, paths[1:], RestraintCache(cache_dir=cache_dir)), [50.625])
+
+#-------------------------------------------------------------------------------
+
+MDINFO_BLOCK = """ NSTEP =     %d   TIME(PS) =       2.000  TEMP(K) =   %.2f  PRESS =     0.0
+ Etot   =     -1000.0000  EKtot   =       500.0000  EPtot      =     %.4f
+ BOND   =        10.0000  ANGLE   =        20.0000  DIHED      =        30.0000
+ EAMBER (non-restraint)  =     %.4f
+ ------------------------------------------------------------------------------
+"""
+
+class TestMdinfo(object):
+
+    def test_last_values(self, tmpdir):
+        path = str(tmpdir.join("ala10_0_1.mdinfo"))
+        with open(path, 'w') as f:
+            # many blocks, so that file is read backwards in several parts
+            for step in range(200):
+                f.write(MDINFO_BLOCK % (step, 300.0 + step, -1500.0 - step, -1400.0 - step))
+            f.write("| Total CPU time:        1.00 seconds\n")
+
+        with tmpdir.as_cwd():
+            data = get_historical_data("ala10_0_1.mdinfo")
+        assert data['temp'] == 499.0
+        assert data['eptot'] == -1699.0
+        assert data['eamber'] == -1599.0
+        assert data['path'] == str(tmpdir)
+
+        # changed file is parsed again
+        with open(path, 'w') as f:
+            f.write(" NSTEP =     1   TIME(PS) =       2.000  TEMP(K) =   310.00  PRESS =     0.0\n")
+        with tmpdir.as_cwd():
+            data = get_historical_data("ala10_0_1.mdinfo")
+            assert (data['temp'], data['eptot'], data['eamber']) == (310.0, 0.0, 0.0)
+            records = prefetch_historical_data(["ala10_0_1.mdinfo", "ala10_1_1.mdinfo"])
+        assert records[0]['temp'] == 310.0
+        assert records[1] is None
+
+    def test_wait_for_history(self, tmpdir):
+        calls = []
+        def read(name):
+            calls.append(name)
+            if len(calls) < 2:
+                raise IOError(name)
+            return get_historical_data(name)
+
+        with open(str(tmpdir.join("ala10_0_1.mdinfo")), 'w') as f:
+            f.write(MDINFO_BLOCK % (1, 300.0, -1500.0, -1400.0))
+        with tmpdir.as_cwd():
+            # file which appears later is read
+            data = wait_for_history(read, ["ala10_0_1.mdinfo"], delay=0)
+            assert data['eptot'] == -1500.0
+            assert len(calls) == 2
+
+            # failed MD run doesn't make calculators wait forever
+            del calls[:]
+            assert wait_for_history(read, ["ala10_1_1.mdinfo"], attempts=3, delay=0) is None
+            assert len(calls) == 3
+
+            # empty NAMD history file
+            tmpdir.join("ala10_0_1.history").write("")
+            assert wait_for_history(get_namd_historical_data, ["ala10_0_1.history"], delay=0) is None
+
+    def test_remlog(self, tmpdir):
+        path = str(tmpdir.join("rem.log"))
+        with open(path, 'w') as f:
+            f.write("# Replica Exchange log file\n"
+                    "# numexchg is        2\n"
+                    "# exchange        1\n"
+                    "     1     2    1.0000   301.10 -1500.00   300.00   310.00 0.50\n"
+                    "     2     1    1.0000   309.20 -1480.00   310.00   300.00 0.50\n"
+                    "# exchange        2\n"
+                    "     1     2    1.0000   305.70 -1490.00   310.00   300.00 0.00\n")
+        # the last exchange is incomplete
+        assert read_remlog(path) == [310.0, 300.0]
+
+        with open(path, 'w') as f:
+            f.write("# Replica Exchange log file\n")
+        assert read_remlog(path) is None
+
+#-------------------------------------------------------------------------------
+
+class TestFiles(object):
+
+    def test_history(self, tmpdir):
+        path = str(tmpdir.join("history_info_temp"))
+        append_history(path, [0, 300.0, -10.0, "r0.RST", "_", "_"])
+        append_history(path, [1, 310.0, -20.0, "r1.RST", "_", "_"])
+        append_history(path, [1, 310.0, -25.0, "r1.RST", "_", "_"])
+        append_history(path, [2, 320.0])
+
+        records = consume_history(path, [1, 3], min_fields=6)
+        assert list(records.keys()) == [1]
+        assert records[1][2] == "-25.0"
+
+        records = consume_history(path, [0, 2], min_fields=6)
+        assert list(records.keys()) == [0]
+        assert os.listdir(path) == []
+
+    def test_columns(self, tmpdir):
+        path = str(tmpdir.join("matrix_column_0_0.dat"))
+        write_column(path, [1.5, 2.5, 3.5], [0, 0, "r0.RST", 300.0])
+        column, info = read_column(path, 3)
+        assert np.allclose(column, [1.5, 2.5, 3.5])
+        assert info == ["0", "0", "r0.RST", "300.0"]
+
+        assert read_column(str(tmpdir.join("missing")), 3, attempts=0, delay=0) is None
+
+    def test_binary_columns(self, tmpdir):
+        path = str(tmpdir.join("matrix_column_1_0.dat"))
+        columns = np.arange(6, dtype=np.float64).reshape(2, 3)
+        write_columns(path, [4, 1], columns, [[4, 0, "r4.RST"], [1, 0, "r1.RST"]])
+        ids, mapped, infos = read_columns(path, 3)
+        assert list(ids) == [4, 1]
+        assert isinstance(mapped, np.memmap)
+        assert np.array_equal(mapped, columns)
+        assert infos[1] == ["1", "0", "r1.RST"]
+
+        # wrong column length or truncated file
+        assert read_columns(path, 4, attempts=0, delay=0) is None
+        data = open(path, 'rb').read()
+        open(path, 'wb').write(data[:-3])
+        assert read_columns(path, 3, attempts=0, delay=0) is None
+
+    def test_group_columns(self, tmpdir):
+        path = str(tmpdir.join("matrix_column_0_0.dat"))
+        write_group_columns(path, [[2, 1.0, 2.0, 3.0], [0, 4.0, 5.0, 6.0]],
+                                  [[2, 0, "r2.RST", 300.0], [0, 0, "r0.RST", 310.0]])
+        columns, infos = read_group_columns(path, 2, 3)
+        assert sorted(columns.keys()) == [0, 2]
+        assert np.allclose(columns[0], [4.0, 5.0, 6.0])
+        assert infos[1][2] == "r0.RST"
+
+    def test_shared_matrix(self, tmpdir):
+        path = str(tmpdir.join("swap_matrix_0.dat"))
+        assert read_shared_matrix(path, 3, [0, 1, 2], attempts=0, delay=0) is None
+
+        write_shared_column(path, 3, 2, [7.0, 8.0, 9.0], [2, 0, "r2.RST", 300.0])
+        write_shared_column(path, 3, 0, [1.0, 2.0, 3.0], [0, 0, "r0.RST", 310.0])
+
+        # column of replica 1 is missing
+        swap_matrix, infos = read_shared_matrix(path, 3, [0, 1, 2], attempts=0, delay=0)
+        assert sorted(infos.keys()) == [0, 2]
+        assert infos[2] == ["2", "0", "r2.RST", "300.0"]
+        assert np.array_equal(swap_matrix[:,0], [1.0, 2.0, 3.0])
+        assert np.array_equal(swap_matrix[:,2], [7.0, 8.0, 9.0])
+
+        write_shared_column(path, 3, 1, [4.0, 5.0, 6.0], [1, 0, "r1.RST", 320.0])
+        swap_matrix, infos = read_shared_matrix(path, 3, [0, 1, 2], attempts=0, delay=0)
+        assert len(infos) == 3
+        assert np.array_equal(swap_matrix, np.arange(1.0, 10.0).reshape(3, 3).T)
+
+        with pytest.raises(ValueError):
+            write_shared_column(path, 3, 1, [4.0, 5.0], [1])
+
+    def test_release_columns(self, tmpdir):
+        path = str(tmpdir.join("swap_matrix_4.dat"))
+        write_shared_column(path, 3, 0, [1.0, 2.0, 3.0], [0, 4])
+        write_shared_column(path, 3, 1, [4.0, 5.0, 6.0], [1, 4])
+        # replica 0 and 1 exchanged, replica 2 writes it's column later
+        release_shared_columns(path, 3, [0, 1])
+        write_shared_column(path, 3, 2, [7.0, 8.0, 9.0], [2, 4])
+
+        swap_matrix, infos = read_shared_matrix(path, 3, [0, 1, 2], attempts=0, delay=0)
+        assert infos.keys() == [2]
+        assert np.array_equal(swap_matrix[:,2], [7.0, 8.0, 9.0])
+
+        for cycle in [1, 2]:
+            tmpdir.join("swap_matrix_%d.dat" % cycle).write("")
+        tmpdir.join("swap_matrix_1.lock").write("")
+        assert remove_stale_matrices(str(tmpdir), 2) == ["swap_matrix_1.dat"]
+        assert sorted(os.listdir(str(tmpdir))) == ["swap_matrix_1.lock", 
+                                                   "swap_matrix_2.dat", 
+                                                   "swap_matrix_4.dat"]
+
+    def test_merge_rank_records(self):
+        # 5 replicas on 2 ranks in round robin order, replica 4 has no record
+        records = [[[0, 300.0, -10.0], [2, 320.0, -30.0]],
+                   [[1, 310.0, -20.0], [3, 330.0, -40.0]]]
+        temps, energies = merge_rank_records(records, 5, 2)
+        assert np.allclose(temps, [300.0, 310.0, 320.0, 330.0, 0.0])
+        assert np.allclose(energies, [-10.0, -20.0, -30.0, -40.0, 0.0])
+
+        # swap matrix is the same as if it was built from replica ordered
+        # data, not in rank order
+        m = get_acceptance('temperature').swap_matrix(temps[:4], energies[:4])
+        for j in range(4):
+            for i in range(4):
+                assert np.isclose(m[j][i], reduced_energy(300.0 + 10*j, -10.0 - 10*i))
+
+    def test_pairs(self, tmpdir):
+        path = str(tmpdir.join("pairs_for_exchange_1_0.dat"))
+        write_pairs(path, [[0, 1], [], [2, 3]], "/tmp/unit.000001")
+        pairs, sandbox = read_pairs(path)
+        assert pairs == [[0, 1], [2, 3]]
+        assert sandbox == "/tmp/unit.000001"
+
+#-------------------------------------------------------------------------------
+
+class TestReplica(object):
+
+    def test_groups(self):
+        dim_types = ['', 'temperature', 'umbrella']
+        replicas = []
+        rid = 0
+        for t in ['300.0', '310.0']:
+            for u in ['0.0', '120.0', '240.0']:
+                replicas.append(create_replica(rid, dim_types, [0.0, t, u]))
+                rid += 1
+
+        groups = group_replicas(replicas, 1, 2)
+        assert [[r.id for r in g] for g in groups] == [[0, 3], [1, 4], [2, 5]]
+
+        groups = group_replicas(replicas, 2, 2)
+        assert [[r.id for r in g] for g in groups] == [[0, 1, 2], [3, 4, 5]]
+
+    def test_exchange_group(self):
+        dim_types = ['', 'temperature']
+        temps = ['320.0', '300.0', '310.0']
+        replicas = [create_replica(i, dim_types, [0.0, t]) for i, t in enumerate(temps)]
+        swap_matrix = np.zeros((3,3))
+        # replicas are ordered by temperature: 1, 2, 0
+        assert exchange_group(replicas, swap_matrix, 'deo', 1, 0) == [[1, 2]]
+        assert exchange_group(replicas, swap_matrix, 'deo', 1, 1) == [[2, 0]]
+        with pytest.raises(ValueError):
+            exchange_group(replicas, swap_matrix, 'random', 1, 0)
+
+#-------------------------------------------------------------------------------
+
+class TestTemplates(object):
+
+    def test_render(self):
+        t = Template("nstlim=@nstlim@, temp0=@temp@, @other@\n"
+                     "r1=@val1l@, r2=@val1@, r3=@val1h@\n")
+        values = mdin_values("1000", 300.0, False)
+        values.update(rstr_values([120.0]))
+        assert t.render(values) == "nstlim=1000, temp0=300.0, @other@\n" \
+                                   "r1=30.0, r2=120.0, r3=210.0\n"
+        # missing values are left as placeholders
+        assert t.render({}) == "nstlim=@nstlim@, temp0=@temp@, @other@\n" \
+                               "r1=@val1l@, r2=@val1@, r3=@val1h@\n"
+        assert mdin_values("0", 300.0, True, "r.RST", "0.5") == \
+            {'nstlim': "0", 'temp': 300.0, 'irest': '0', 'ntx': '1',
+             'disang': "r.RST", 'salt': "0.5"}
+
+    def test_render_file(self, tmpdir):
+        template = str(tmpdir.join("ala10.mdin"))
+        path = str(tmpdir.join("ala10_0_1.mdin"))
+        with open(template, 'w') as f:
+            f.write("irest=@irest@, ntx=@ntx@\n")
+
+        assert load_template(template) is load_template(template)
+        assert render_file(template, path, mdin_values("1000", 300.0, True))
+        assert open(path).read() == "irest=0, ntx=1\n"
+        # identical content is not written again
+        assert not render_file(template, path, mdin_values("1000", 300.0, True))
+        assert render_file(template, path, mdin_values("1000", 300.0, False))
+        assert open(path).read() == "irest=1, ntx=5\n"
+
+        # modified template is compiled again
+        with open(template, 'w') as f:
+            f.write("irest=@irest@\n")
+        render_file(template, path, mdin_values("1000", 300.0, False))
+        assert open(path).read() == "irest=1\n"
+
+    def test_set_cntrl(self):
+        text = "ala10\n &cntrl\n  nstlim = 1000,\n /\n"
+        assert set_cntrl(text, "numexchg", 4) == \
+            "ala10\n &cntrl\n  numexchg = 4,\n  nstlim = 1000,\n /\n"
+        assert set_cntrl(text, "NSTLIM", 10) == text
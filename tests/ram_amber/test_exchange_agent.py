@@ -0,0 +1,65 @@
+import os
+import json
+import threading
+import subprocess
+import pytest
+from ram_amber.exchange_agent import request_script
+from ram_amber.exchange_agent import handle_request
+from ram_amber.exchange_agent import serve
+
+#-------------------------------------------------------------------------------
+
+CALCULATOR = """
+import sys
+with open("pairs.dat", "w") as f:
+    f.write(sys.argv[1])
+sys.exit(int(sys.argv[2]))
+"""
+
+def prepare(tmpdir):
+    # pilot sandbox with agent unit, requesting unit and staging_area
+    agent_dir = tmpdir.mkdir("unit.0")
+    cu_dir = tmpdir.mkdir("unit.1")
+    requests_dir = tmpdir.mkdir("staging_area").mkdir("exchange_requests")
+    agent_dir.join("calc.py").write(CALCULATOR)
+    return str(agent_dir), str(cu_dir), str(requests_dir)
+
+#-------------------------------------------------------------------------------
+
+class TestExchangeAgent(object):
+
+    def test_handle_request(self, tmpdir):
+        agent_dir, cu_dir, requests_dir = prepare(tmpdir)
+        req_path = os.path.join(requests_dir, "pairs_1_2.req")
+        with open(req_path, 'w') as f:
+            f.write(cu_dir + "\n")
+            f.write(json.dumps({"ram": "calc.py", "args": ["1 2", "3"]}) + "\n")
+
+        assert handle_request(req_path, agent_dir) == 3
+        assert not os.path.exists(req_path)
+        assert open(os.path.join(requests_dir, "pairs_1_2.done")).read() == "3"
+        assert open(os.path.join(cu_dir, "pairs.dat")).read() == "1 2"
+        assert os.getcwd() != cu_dir
+
+    def test_request_done(self, tmpdir):
+        agent_dir, cu_dir, requests_dir = prepare(tmpdir)
+        agent = threading.Thread(target=serve, args=(requests_dir, agent_dir, 0.05, 1))
+        agent.start()
+
+        request = json.dumps({"ram": "calc.py", "args": ["it's", "0"]})
+        script = request_script("../staging_area/exchange_requests/pairs_1_2", request, 30)
+        status = subprocess.call(["/bin/sh", "-c", script], cwd=cu_dir)
+        agent.join()
+
+        assert status == 0
+        assert open(os.path.join(cu_dir, "pairs.dat")).read() == "it's"
+        # requesting unit removes done file
+        assert os.listdir(requests_dir) == []
+
+    def test_timeout(self, tmpdir):
+        agent_dir, cu_dir, requests_dir = prepare(tmpdir)
+        request = json.dumps({"ram": "calc.py", "args": ["1 2", "0"]})
+        script = request_script("../staging_area/exchange_requests/pairs_1_2", request, 0.3)
+        # no agent is running
+        assert subprocess.call(["/bin/sh", "-c", script], cwd=cu_dir) == 1
+        assert os.listdir(requests_dir) == []
@@ -0,0 +1,70 @@
+import os
+import json
+import pytest
+from ram_amber.md_bundle import POST_DATA
+from ram_amber.md_bundle import run_ram
+from ram_amber.md_bundle import pre_step
+from ram_amber.md_bundle import post_step
+
+#-------------------------------------------------------------------------------
+
+# writes input file of replica, fails for replica "2"
+BUILDER = """
+import sys
+import json
+data = json.loads(sys.argv[1])
+with open("ala_%s.mdin" % data["rid"], 'w') as f:
+    f.write(data["temp"])
+if data["rid"] == "2":
+    sys.exit(1)
+"""
+
+# records replicas, for which it was called
+CALCULATOR = """
+import sys
+import json
+data = json.loads(sys.argv[1])
+with open("post.log", 'a') as f:
+    f.write(data["rid"] + "\\n")
+if data["rid"] == "5":
+    raise ValueError(data["rid"])
+"""
+
+def task(rid, post=True):
+    t = {"pre": {"rid": rid, "temp": "300.0"},
+         "post": ["matrix_calculator_temp_ex.py", {"rid": rid}],
+         "arguments": " -O -i ala_%s.mdin -inf ala_%s_1.mdinfo " % (rid, rid)}
+    if not post:
+        t["post"] = None
+    return t
+
+#-------------------------------------------------------------------------------
+
+class TestMdBundle(object):
+
+    def test_run_ram(self, tmpdir):
+        tmpdir.join("ram.py").write("import sys\nsys.exit(3)\n")
+        with tmpdir.as_cwd():
+            assert run_ram("ram.py", {}) == 3
+            assert run_ram("missing.py", {}) == 1
+
+    def test_pre_post(self, tmpdir):
+        tmpdir.join("input_file_builder.py").write(BUILDER)
+        tmpdir.join("matrix_calculator_temp_ex.py").write(CALCULATOR)
+        data = {"tasks": [task("0"), task("2"), task("5"), task("7", post=False)]}
+
+        with tmpdir.as_cwd():
+            # builder failed for one replica, but groupfile has all of them
+            assert pre_step(json.loads(json.dumps(data))) == 1
+            lines = open("groupfile").read().splitlines()
+            assert lines == ["-O -i ala_%s.mdin -inf ala_%s_1.mdinfo" % (r, r)
+                             for r in "0257"]
+            assert sorted(f for f in os.listdir(".") if f.endswith(".mdin")) == \
+                   ["ala_0.mdin", "ala_2.mdin", "ala_5.mdin", "ala_7.mdin"]
+
+            # post step gets data only from POST_DATA file
+            post = json.load(open(POST_DATA))
+            assert [p[1]["rid"] for p in post] == ["0", "2", "5"]
+
+            assert post_step() == 1
+            assert open("post.log").read().split() == ["0", "2", "5"]
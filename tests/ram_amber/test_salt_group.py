@@ -0,0 +1,79 @@
+import os
+import pytest
+import numpy as np
+from exchange.acceptance import KB
+from ram_amber.salt_group_pre_exec import write_group_inputs
+from ram_amber.salt_group_post_exec import energy_names
+from ram_amber.salt_group_post_exec import group_columns
+
+#-------------------------------------------------------------------------------
+
+# replica id: temperature, salt concentration, restraint file
+GROUP = {"2": ["300.0", "0.1", "ala.RST.2"],
+         "5": ["300.0", "0.5", "ala.RST.5"],
+         "9": ["300.0", "1.0", "ala.RST.9"]}
+
+def group_data(rows=None):
+    data = {"replica_cycle": "3",
+            "replicas": "10",
+            "base_name": "ala",
+            "amber_input": "ala.mdin",
+            "amber_parameters": "ala.parm7",
+            "current_group_tsu": GROUP}
+    if rows is not None:
+        data["rows"] = rows
+    return data
+
+#-------------------------------------------------------------------------------
+
+class TestSaltGroup(object):
+
+    def test_groupfile(self, tmpdir):
+        unit = tmpdir.mkdir("unit.0")
+        unit.join("ala.mdin").write("nstlim=@nstlim@, saltcon=@salt@, DISANG=@disang@\n")
+        with unit.as_cwd():
+            assert write_group_inputs(group_data()) == 9
+            lines = open("groupfile").readlines()
+            # one input file per salt concentration
+            assert open("ala_5_3_energy.mdin").read() == \
+                "nstlim=0, saltcon=0.5, DISANG=ala.RST.5\n"
+
+        staging = str(tmpdir.join("staging_area"))
+        # coordinates of replica i at salt concentration of replica j, row 
+        # major order
+        for n, (i, j) in enumerate([(i, j) for i in "259" for j in "259"]):
+            words = lines[n].split()
+            assert words[words.index('-i')+1] == "ala_%s_3_energy.mdin" % j
+            assert words[words.index('-c')+1] == os.path.join(staging, "replica_%s" % i, "ala_%s_3.rst" % i)
+            assert words[words.index('-inf')+1] == "ala_%s_3_%s_energy.mdinfo" % (i, j)
+
+        # unit calculating only a part of rows
+        with unit.as_cwd():
+            assert write_group_inputs(group_data(rows=["9"])) == 3
+            lines = open("groupfile").readlines()
+        assert [l.split()[-1] for l in lines] == ["ala_9_3_%s_energy.mdinfo" % j for j in "259"]
+
+    def test_columns(self):
+        rows = ["5", "9"]
+        names = energy_names("ala", 3, ["2", "5", "9"], rows)
+        assert names[:3] == ["ala_5_3_2_energy.mdinfo", 
+                             "ala_5_3_5_energy.mdinfo", 
+                             "ala_5_3_9_energy.mdinfo"]
+        assert len(names) == 6
+
+        records = [{'eptot': -10.0}, {'eptot': -11.0}, {'eptot': -12.0},
+                   {'eptot': -20.0}, None, {'eptot': -22.0}]
+        columns = group_columns(records, 10, GROUP, rows)
+        assert [i for i, column in columns] == rows
+
+        beta = 1.0 / (KB * 300.0)
+        column = columns[0][1]
+        assert len(column) == 10
+        assert np.allclose(column[[2, 5, 9]], beta * np.array([-10.0, -11.0, -12.0]))
+        assert not column[[0, 1, 3, 4, 6, 7, 8]].any()
+
+        # failed calculation is initialized to -1.0
+        column = columns[1][1]
+        assert np.isclose(column[2], beta * -20.0)
+        assert np.isclose(column[5], 1.0 / (KB * -1.0) * -1.0)
+        assert np.isclose(column[9], beta * -22.0)
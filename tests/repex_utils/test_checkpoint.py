@@ -0,0 +1,89 @@
+import numpy as np
+from replicas.replica import ReplicaStore
+from repex_utils.simulation_restart import Restart
+from repex_utils.checkpoint import CheckpointJournal
+from repex_utils.checkpoint import diff_store
+from repex_utils.checkpoint import replay_journal
+
+#-------------------------------------------------------------------------------
+
+def make_store():
+    store = ReplicaStore(4, 1, ['temperature'])
+    for i, t in enumerate([300.0, 310.0, 320.0, 330.0]):
+        store.set_replica(i, i, [t], new_restraints="r.RST.%d" % i)
+    store.assign_group_idx(1)
+    return store
+
+def swap(store, i, j):
+    store.params[[i, j]] = store.params[[j, i]]
+    store.new_restraints[i], store.new_restraints[j] = \
+        store.new_restraints[j], store.new_restraints[i]
+    store.swap[[i, j]] = 1
+
+#-------------------------------------------------------------------------------
+
+class TestCheckpoint(object):
+
+    def test_diff(self):
+        store = make_store()
+        old = make_store()
+        store.cycle += 1
+        swap(store, 0, 1)
+        changes = diff_store(old, store)
+        assert changes['cycle'] == ('shift', 1)
+        assert list(changes['params'][1]) == [0, 1]
+        assert changes['new_restraints'][1] == [0, 1]
+        assert 'group_idx' not in changes
+
+    def test_replay(self, tmpdir):
+        path = str(tmpdir.join("simulation_journal.pkl"))
+        journal = CheckpointJournal(path, snapshot_interval=2)
+        store = make_store()
+        restart = Restart()
+        states = {}
+        for c in range(1, 6):
+            store.cycle += 1
+            swap(store, c % 3, c % 3 + 1)
+            restart.current_cycle = c
+            restart.new_sandbox = "sandbox_%d" % c
+            journal.commit(1, c, store, restart)
+            states[c] = store.params[:,0].copy()
+
+        for c in range(1, 6):
+            r_store, r_restart = replay_journal(path, c)
+            assert np.array_equal(r_store.params[:,0], states[c])
+            assert r_store.cycle[0] == c
+            assert r_restart.new_sandbox == "sandbox_%d" % c
+
+        r_store, r_restart = replay_journal(path)
+        assert np.array_equal(r_store.params[:,0], states[5])
+        assert r_store.replica(2).new_restraints == store.new_restraints[2]
+        assert replay_journal(path, 7) is None
+
+        # partially written record is ignored
+        with open(path, 'ab') as f:
+            f.write('\x80\x02(U\x04step')
+        r_store, r_restart = replay_journal(path)
+        assert r_restart.current_cycle == 5
+
+    def test_writer(self, tmpdir):
+        path = str(tmpdir.join("simulation_journal.pkl"))
+        journal = CheckpointJournal(path, snapshot_interval=3)
+        journal.start_writer()
+        store = make_store()
+        restart = Restart()
+        for c in range(1, 5):
+            store.cycle += 1
+            swap(store, c % 3, c % 3 + 1)
+            restart.current_cycle = c
+            journal.commit(1, c, store, restart)
+        # objects are copied, so later changes are not written
+        store.params[:] = 0.0
+        restart.current_cycle = 0
+        journal.stop_writer()
+        assert journal.writer is None
+
+        r_store, r_restart = replay_journal(path)
+        assert r_restart.current_cycle == 4
+        assert r_store.cycle[0] == 4
+        assert list(r_store.params[:,0]) == [320.0, 330.0, 300.0, 310.0]
@@ -0,0 +1,88 @@
+from repex_utils.md_tracker import MdTracker
+
+#-------------------------------------------------------------------------------
+
+class FakeReplica(object):
+
+    def __init__(self, rid, group):
+        self.id = rid
+        self.cur_dim = 1
+        self.group_idx = [group, None, None]
+
+def make_replicas():
+    # 6 replicas: 0-3 are in group 0, 4 and 5 are in group 1
+    return [FakeReplica(i, 0 if i < 4 else 1) for i in range(6)]
+
+#-------------------------------------------------------------------------------
+
+class TestMdTracker(object):
+
+    def test_bundled_units(self):
+        replicas = make_replicas()
+        tracker = MdTracker()
+        tracker.add('unit.0', replicas[0:2], 10.0)
+        tracker.add('unit.1', replicas[2:6], 20.0)
+        assert len(tracker) == 2
+        assert sorted(tracker.group_sizes()) == [2, 4]
+        assert sorted((r.id, s) for k, r, s in tracker.running()) == \
+               [(0, 10.0), (1, 10.0), (2, 20.0), (3, 20.0), (4, 20.0), (5, 20.0)]
+
+        done = tracker.complete('unit.0', 15.0)
+        assert [(r.id, t) for r, t in done] == [(0, 5.0), (1, 5.0)]
+        assert tracker.completed == 2
+        assert len(tracker) == 1
+        # finished replicas still count for group sizes
+        assert sorted(tracker.group_sizes()) == [2, 4]
+
+        assert len(tracker.complete('unit.1', 30.0)) == 4
+        assert tracker.completed == 6
+        assert len(tracker) == 0
+        assert sorted(r.id for r in tracker.take()) == range(6)
+        assert tracker.completed == 0
+        assert tracker.ready_groups == {}
+
+    def test_partial_group(self):
+        replicas = make_replicas()
+        tracker = MdTracker()
+        for r in replicas:
+            tracker.add('unit.%d' % r.id, [r], 0.0)
+
+        # odd replica of a group has no partner
+        for i in [0, 1, 2, 4]:
+            tracker.complete('unit.%d' % i, 1.0)
+        assert tracker.completed == 2
+        assert [r.id for r in tracker.take()] == [0, 1]
+        assert [r.id for r in tracker.ready_groups[(0, 1)]] == [2]
+        assert [r.id for r in tracker.ready_groups[(1, 1)]] == [4]
+        assert tracker.completed == 0
+
+        # left replicas are paired at next exchange
+        tracker.complete('unit.5', 2.0)
+        assert tracker.completed == 2
+        assert [r.id for r in tracker.take()] == [4, 5]
+        assert [r.id for r in tracker.ready_groups[(0, 1)]] == [2]
+
+    def test_failed_unit(self):
+        replicas = make_replicas()
+        tracker = MdTracker()
+        tracker.add('unit.0', replicas[0:2], 0.0)
+        tracker.add('unit.1', replicas[2:4], 0.0)
+
+        # failed unit is not waited for, but its runtime is not observed
+        assert tracker.complete('unit.1', 5.0, failed=True) == []
+        assert len(tracker) == 1
+        assert tracker.completed == 2
+        assert len(tracker.complete('unit.0', 6.0)) == 2
+        assert [r.id for r in tracker.take()] == [2, 3, 0, 1]
+
+    def test_unknown_unit(self):
+        replicas = make_replicas()
+        tracker = MdTracker()
+        tracker.add('unit.0', replicas[0:2], 0.0)
+        assert len(tracker.complete('unit.0', 1.0)) == 2
+
+        # repeated and unknown completions are ignored
+        assert tracker.complete('unit.0', 2.0) == []
+        assert tracker.complete('unit.7', 2.0) == []
+        assert tracker.completed == 2
+        assert [r.id for r in tracker.take()] == [0, 1]
@@ -0,0 +1,50 @@
+from replicas.replica import ReplicaStore
+from repex_utils.runtime_model import RuntimeModel
+
+#-------------------------------------------------------------------------------
+
+def make_replicas():
+    store = ReplicaStore(3, 1, ['temperature'])
+    for i, t in enumerate([300.0, 350.0, 400.0]):
+        store.set_replica(i, i, [t])
+    return store.replicas()
+
+#-------------------------------------------------------------------------------
+
+class TestRuntimeModel(object):
+
+    def test_predict(self):
+        model = RuntimeModel(alpha=0.5, default=5.0)
+        r0, r1, r2 = make_replicas()
+        assert model.predict('md', r0) == 5.0
+
+        # overhead is learned from units with known MD time
+        model.observe('md', r0, 12.0, md_time=10.0)
+        model.observe('md', r2, 32.0)
+        assert model.overhead['md'] == 2.0
+        assert model.by_window[('md', (400.0,))] == 30.0
+        assert model.predict('md', r2) == 32.0
+        assert model.predict('md', r1) == 22.0
+        assert model.predict('ex', r1) == 5.0
+
+        # window estimate follows parameters, not the replica
+        r0.dims['d1']['par'], r2.dims['d1']['par'] = 400.0, 300.0
+        assert model.predict('md', r0) == 32.0
+        assert model.predict('md', r2) == 12.0
+
+        model.observe('md', r0, 22.0, md_time=20.0)
+        assert model.by_window[('md', (400.0,))] == 25.0
+
+    def test_expected_wait(self):
+        model = RuntimeModel(default=10.0)
+        r0, r1, r2 = make_replicas()
+        model.observe('md', r0, 10.0)
+        model.observe('md', r2, 40.0)
+        # unknown window uses average of all MD units
+        running = [('md', r0, 100.0), ('md', r1, 90.0), ('md', r2, 100.0)]
+        assert model.expected_wait(running, 1, 100.0) == 10.0
+        assert model.expected_wait(running, 2, 100.0) == 15.0
+        assert model.expected_wait(running, 3, 100.0) == 40.0
+        assert model.expected_wait(running, 4, 100.0) is None
+        assert model.completed_by(running, 110.0) == 1
+        assert model.completed_by(running, 140.0) == 3
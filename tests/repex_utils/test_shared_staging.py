@@ -0,0 +1,63 @@
+import os
+import pytest
+from repex_utils.shared_staging import build_archive
+from repex_utils.shared_staging import unpack
+from repex_utils.shared_staging import load_manifest
+from repex_utils.shared_staging import save_manifest
+from repex_utils.shared_staging import STORE
+
+#-------------------------------------------------------------------------------
+
+class TestSharedStaging(object):
+
+    def prepare(self, tmpdir):
+        names = ["ala.inpcrd.0", "ala.inpcrd.1", "exchange/engine.py"]
+        paths = []
+        for name, content in zip(names, ["coords\n", "coords\n", "engine\n"]):
+            path = str(tmpdir.join(name.replace('/', '_')))
+            with open(path, 'w') as f:
+                f.write(content)
+            paths.append(path)
+        return names, paths
+
+    def test_archive(self, tmpdir):
+        names, paths = self.prepare(tmpdir)
+        archive = str(tmpdir.join("shared_data.tar.gz"))
+        index = str(tmpdir.join("shared_data.json"))
+        staging = str(tmpdir.mkdir("staging_area"))
+
+        digests, packed = build_archive(names, paths, archive, index)
+        # equal content is packed once
+        assert digests[0] == digests[1]
+        assert len(packed) == 2
+
+        assert unpack(archive, index, staging) == []
+        for name in names:
+            assert os.path.isfile(os.path.join(staging, name))
+        assert open(os.path.join(staging, "exchange/engine.py")).read() == "engine\n"
+        assert len(os.listdir(os.path.join(staging, STORE))) == 2
+
+    def test_cache(self, tmpdir):
+        names, paths = self.prepare(tmpdir)
+        archive = str(tmpdir.join("shared_data.tar.gz"))
+        index = str(tmpdir.join("shared_data.json"))
+        cache = str(tmpdir.mkdir("cache"))
+        manifest = str(tmpdir.join("staging_manifest.json"))
+
+        digests, packed = build_archive(names, paths, archive, index)
+        unpack(archive, index, str(tmpdir.mkdir("staging_1")), cache)
+        save_manifest(manifest, "local:cache", digests)
+        assert load_manifest(manifest, "local:cache") == set(digests)
+        assert load_manifest(manifest, "other:cache") == set()
+
+        # files in cache are not packed again
+        digests, packed = build_archive(names, paths, archive, index, 
+                                        load_manifest(manifest, "local:cache"))
+        assert packed == []
+        staging = str(tmpdir.mkdir("staging_2"))
+        assert unpack(archive, index, staging, cache) == []
+        assert open(os.path.join(staging, "ala.inpcrd.1")).read() == "coords\n"
+
+        # files removed from cache are reported
+        os.remove(os.path.join(cache, digests[2]))
+        assert unpack(archive, index, staging, cache) == ["exchange/engine.py"]
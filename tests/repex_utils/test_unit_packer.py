@@ -0,0 +1,38 @@
+from repex_utils.unit_packer import UnitPacker
+
+#-------------------------------------------------------------------------------
+
+class TestUnitPacker(object):
+
+    def test_packing(self):
+        packer = UnitPacker(4)
+        for i, t in enumerate([1.0, 5.0, 2.0, 4.0, 3.0]):
+            packer.add(i, 1, t, 'r%d' % i, group=i % 2)
+        packer.add(5, 3, 2.5, 'big')
+        assert len(packer) == 6
+
+        # longest first, free cores are filled by shorter units
+        assert [k for k, item in packer.next_units()] == [1, 3, 4, 2]
+        assert packer.free == 0
+        assert packer.next_units() == []
+
+        # big unit waits for cores, short unit is used to fill them
+        assert packer.release(3) is None
+        assert packer.next_units() == [(0, 'r0')]
+        assert packer.release(4) is None
+        assert packer.release(2) is None
+        assert packer.release(0) == 0
+        assert packer.next_units() == [(5, 'big')]
+        assert packer.release(1) == 1
+        assert packer.release(5) is None
+        assert len(packer) == 0
+        assert packer.free == 4
+
+    def test_oversized(self):
+        packer = UnitPacker(2)
+        packer.add('a', 4, 1.0, None)
+        packer.add('b', 1, 0.5, None)
+        assert [k for k, item in packer.next_units()] == ['a']
+        assert packer.next_units() == []
+        packer.release('a')
+        assert [k for k, item in packer.next_units()] == ['b']
@@ -0,0 +1,62 @@
+import pytest
+from repex_utils.wait_controller import WaitRatioController
+from repex_utils.wait_controller import wait_size_limit
+
+#-------------------------------------------------------------------------------
+
+def run_round(controller, now, md_done, accepted, latency=1.0):
+    controller.observe_md(md_done)
+    controller.observe_exchange(10, accepted, latency)
+    return controller.update(now)
+
+#-------------------------------------------------------------------------------
+
+class TestWaitRatioController(object):
+
+    def test_throughput(self):
+        controller = WaitRatioController(0.25, 100, step=0.05, interval=1)
+        assert controller.update(0.0) == 0.25
+
+        # score improves, ratio keeps moving up
+        assert run_round(controller, 10.0, 10, 2) == pytest.approx(0.30)
+        assert run_round(controller, 20.0, 20, 2) == pytest.approx(0.35)
+        # score drops, direction is reversed
+        assert run_round(controller, 30.0, 5, 2) == pytest.approx(0.30)
+        assert len(controller.history) == 3
+        assert controller.history[-1]['md_rate'] == 0.5
+
+    def test_bounds(self):
+        controller = WaitRatioController(0.1, 10,
+                                         objective='exchange_rate',
+                                         min_ratio=0.1,
+                                         max_ratio=0.2,
+                                         interval=1)
+        controller.update(0.0)
+        assert run_round(controller, 10.0, 1, 4) == pytest.approx(0.15)
+        assert run_round(controller, 20.0, 1, 6) == pytest.approx(0.2)
+        assert run_round(controller, 30.0, 1, 8) == pytest.approx(0.15)
+        assert controller.history[0]['acceptance'] == 0.4
+        assert controller.history[0]['exchange_rate'] == 1440.0
+
+        # replicas completing during one exchange round have to wait anyway
+        assert run_round(controller, 40.0, 100, 8, latency=0.5) == pytest.approx(0.2)
+
+    def test_objective(self):
+        with pytest.raises(ValueError):
+            WaitRatioController(0.25, 10, objective='speed')
+
+    def test_upper_bound(self):
+        controller = WaitRatioController(0.8, 8, step=0.1, interval=1)
+        controller.update(0.0)
+        # score keeps improving, ratio is moved up to max_ratio
+        assert run_round(controller, 10.0, 10, 2) == pytest.approx(0.9)
+        ratio = run_round(controller, 20.0, 20, 2)
+        assert ratio == pytest.approx(1.0)
+
+        # 8 replicas in groups of 3 and 5: at most 2 + 4 can be paired, so
+        # exchange starts when all 6 are completed
+        size = wait_size_limit(ratio, 8, [3, 5])
+        assert size == 5
+        assert wait_size_limit(0.5, 8, [3, 5]) == 4
+        assert wait_size_limit(0.0, 8, [4, 4]) == 2
+        assert wait_size_limit(1.0, 8, [1]) == -1
@@ -0,0 +1,57 @@
+from replicas.replica import Replica
+from replicas.registry import ReplicaRegistry
+
+#-------------------------------------------------------------------------------
+
+def make_replicas():
+    # 2 x 3 replicas, group index in d1 is index of d2 param and vice versa
+    replicas = []
+    for i, t in enumerate([300.0, 310.0]):
+        for j, u in enumerate([0.0, 120.0, 240.0]):
+            r = Replica(j + i*3, d1_param=t, d2_param=u, nr_dims=2)
+            r.group_idx = [j, i, None]
+            replicas.append(r)
+    return replicas
+
+#-------------------------------------------------------------------------------
+
+class TestReplicaRegistry(object):
+
+    def test_lookup(self):
+        replicas = make_replicas()
+        registry = ReplicaRegistry(2, replicas)
+        assert len(registry) == 6
+        assert registry.get('4') is replicas[4]
+        assert registry.get(7) is None
+
+        assert [[r.id for r in g] for g in registry.all_groups(1)] == [[0, 3], [1, 4], [2, 5]]
+        assert [r.id for r in registry.replica_group(2, replicas[4])] == [3, 4, 5]
+
+    def test_update(self):
+        replicas = make_replicas()
+        registry = ReplicaRegistry(2, replicas)
+
+        # replicas 0 and 3 exchange temperatures, so they swap d2 groups
+        r0, r3 = replicas[0], replicas[3]
+        old_0, old_3 = list(r0.group_idx), list(r3.group_idx)
+        r0.group_idx[1], r3.group_idx[1] = r3.group_idx[1], r0.group_idx[1]
+        registry.update(r0, old_0)
+        registry.update(r3, old_3)
+
+        assert [[r.id for r in g] for g in registry.all_groups(2)] == [[1, 2, 3], [0, 4, 5]]
+        assert [[r.id for r in g] for g in registry.all_groups(1)] == [[0, 3], [1, 4], [2, 5]]
+
+        for r in replicas:
+            r.group_idx[1] = 0
+        registry.reindex(2)
+        assert [[r.id for r in g] for g in registry.all_groups(2)] == [range(6)]
+
+    def test_subset(self):
+        replicas = make_replicas()
+        registry = ReplicaRegistry(2, replicas)
+
+        # groups keep registry order, but contain only given replicas
+        ids = set([1, 3, 4])
+        assert [[r.id for r in g] for g in registry.all_groups(1, ids)] == [[3], [1, 4]]
+        assert [r.id for r in registry.replica_group(2, replicas[4], ids)] == [3, 4]
+        assert registry.all_groups(2, set()) == []
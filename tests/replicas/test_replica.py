@@ -0,0 +1,81 @@
+import pickle
+import numpy as np
+from replicas.replica import Replica
+from replicas.replica import ReplicaStore
+
+#-------------------------------------------------------------------------------
+
+def make_store():
+    store = ReplicaStore(6, 2, ['temperature', 'umbrella'])
+    for i, t in enumerate([300.0, 310.0]):
+        for j, u in enumerate([0.0, 120.0, 240.0]):
+            rid = j + i*3
+            store.set_replica(rid, rid, [t, u], new_restraints="r.RST.%d" % rid)
+    return store
+
+#-------------------------------------------------------------------------------
+
+class TestReplicaStore(object):
+
+    def test_views(self):
+        store = make_store()
+        r = store.replica(4)
+        assert r.id == 4
+        assert r.state == 'I'
+        assert r.group_idx[0] is None
+        assert sorted(r.dims.keys()) == ['d1', 'd2']
+        assert r.dims['d1']['par'] == 310.0
+        assert r.dims['d2']['type'] == 'umbrella'
+        assert r.new_restraints == "r.RST.4"
+
+        r.dims['d1']['par'] = 300.0
+        r.cycle += 1
+        r.state = 'MD'
+        assert store.params[4][0] == 300.0
+        assert store.cycle[4] == 1
+        assert store.replica(4).state == 'MD'
+        assert r == store.replica(4)
+        assert r != store.replica(3)
+
+        assert r.name("ala10") == "ala10_4_1"
+        assert r.name("ala10", 0) == "ala10_4_0"
+
+    def test_groups(self):
+        store = make_store()
+        assert store.assign_group_idx(1) == 3
+        assert store.assign_group_idx(2) == 2
+        assert list(store.group_idx[:,0]) == [0, 1, 2, 0, 1, 2]
+        assert list(store.group_idx[:,1]) == [0, 0, 0, 1, 1, 1]
+        assert store.replica(5).group_idx == [2, 1, None]
+
+        # groups are numbered in order of their first member
+        store.params[:,1] = [240.0, 0.0, 120.0, 240.0, 0.0, 120.0]
+        store.assign_group_idx(1)
+        assert list(store.group_idx[:,0]) == [0, 1, 2, 0, 1, 2]
+
+    def test_signature(self):
+        store = make_store()
+        sig = store.signature(1)
+        store.swap[1] = 1
+        store.group_idx[1] = 2
+        assert store.signature(1) == sig
+        store.cycle[1] += 1
+        assert store.signature(1) != sig
+        assert store.signature(2) != store.signature(4)
+
+    def test_pickle(self):
+        store = make_store()
+        store.assign_group_idx(1)
+        store.replica(2).swap = 1
+        loaded = pickle.loads(pickle.dumps(store, pickle.HIGHEST_PROTOCOL))
+        replicas = loaded.replicas()
+        assert [r.id for r in replicas] == range(6)
+        assert replicas[2].swap == 1
+        assert np.array_equal(loaded.group_idx, store.group_idx)
+
+    def test_single(self):
+        r = Replica(7, d1_param=300.0, nr_dims=1)
+        assert r.id == 7
+        assert r.dims.keys() == ['d1']
+        assert r.dims['d1']['old_par'] == 300.0
+        assert r.dims['d1']['type'] is None